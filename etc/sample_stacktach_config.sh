@@ -4,6 +4,10 @@ export STACKTACH_DB_USERNAME="root"
 export STACKTACH_DB_PASSWORD="password"
 export STACKTACH_DB_PORT="3306"
 export STACKTACH_INSTALL_DIR="/srv/www/stacktach/"
+export STACKTACH_BIGINT_TIMES="false"
+export STACKTACH_RAWDATA_PARTITIONS=""
+export STACKTACH_RAWDATA_ARCHIVE_DIR=""
+export STACKTACH_COMPRESS_RAWDATA="false"
 export STACKTACH_DEPLOYMENTS_FILE="/srv/www/stacktach/stacktach_worker_config.json"
 export STACKTACH_VERIFIER_CONFIG="/srv/www/stacktach/stacktach_verifier_config.json"
 
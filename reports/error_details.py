@@ -6,9 +6,12 @@ import os
 import re
 
 sys.path.append(os.environ.get('STACKTACH_INSTALL_DIR', '/stacktach'))
+from stacktach import archive
 from stacktach import datetime_to_decimal as dt
+from stacktach import fields
 from stacktach import image_type
 from stacktach import models
+from stacktach import partitions
 
 
 if __name__ != '__main__':
@@ -107,6 +110,16 @@ def build_exc_msg(exc=None, separator=", "):
             message.append("%s: %s" % (k, v))
     return separator.join(message)
 
+
+def find_raw(raw_id, start, end):
+    """RawData raw_id from the database or, once it has been archived,
+    from the archive. None if neither has it."""
+    try:
+        return partitions.bounded(models.RawData.objects, start, end)\
+                         .get(id=raw_id)
+    except models.RawData.DoesNotExist:
+        return archive.load_rawdata(raw_id)
+
 if __name__ == '__main__':
 
     # Start report
@@ -148,6 +161,10 @@ if __name__ == '__main__':
 
     dstart = dt.dt_to_decimal(start)
     dend = dt.dt_to_decimal(end)
+    # A request can run past either end of the window, but bounding the
+    # per-request lookups keeps them to the partitions near it.
+    req_start = dstart - partitions.REQUEST_SLACK
+    req_end = dend + partitions.REQUEST_SLACK
 
     for deploy in models.Deployment.objects.all():
         deployments[deploy.id] = deploy.name
@@ -172,8 +189,9 @@ if __name__ == '__main__':
         for req_dict in reqs:
             req = req_dict['request_id']
 
-            raws = list(models.RawData.objects.filter(request_id=req)
-                        .exclude(event='compute.instance.exists')
+            raws = models.RawData.objects.filter(request_id=req)
+            raws = partitions.bounded(raws, req_start, req_end)
+            raws = list(raws.exclude(event='compute.instance.exists')
                         .values("id", "when", "routing_key", "old_state",
                                 "state", "tenant", "event", "image_type",
                                 "deployment")
@@ -191,7 +209,7 @@ if __name__ == '__main__':
             image_type_num = 0
 
             for raw in raws:
-                _when = raw['when']
+                _when = fields.from_db(raw['when'])
                 _routing_key = raw['routing_key']
                 _old_state = raw['old_state']
                 _state = raw['state']
@@ -254,9 +272,14 @@ if __name__ == '__main__':
                 tenant_issues[tenant] = tenant_issues.get(tenant, 0) + 1
 
                 if err_id:
-                    err = models.RawData.objects.get(id=err_id)
-                    queue, body = json.loads(err.json)
-                    payload = body['payload']
+                    err = find_raw(err_id, req_start, req_end)
+                    if err is None:
+                        continue
+                    # Headers-only events have no body to look in.
+                    payload = {}
+                    if err.json:
+                        queue, body = json.loads(err.json)
+                        payload = body['payload']
 
                     # Add error information to failed request report
                     failed_request['event_id'] = err.id
@@ -289,8 +312,9 @@ if __name__ == '__main__':
                     failed_request['failure_type'] = failure_type
 
                     raws = models.RawData.objects.filter(request_id=req)\
-                                         .exclude(event='compute.instance.exists')\
-                                         .order_by('when')
+                                         .exclude(event='compute.instance.exists')
+                    raws = partitions.bounded(raws, req_start, req_end)\
+                                     .order_by('when')
 
                     failed_request['details'] = []
                     for raw in raws:
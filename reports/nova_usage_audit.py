@@ -29,6 +29,7 @@ sys.path.append(os.environ.get('STACKTACH_INSTALL_DIR', '/stacktach'))
 from django.db.models import F
 
 from stacktach import datetime_to_decimal as dt
+from stacktach import fields
 from stacktach import models
 from stacktach.reconciler import Reconciler
 
@@ -151,11 +152,13 @@ def _audit_for_exists(exists_query):
 
 def _verifier_audit_for_day(beginning, ending):
     summary = {}
+    # Added to a column in the query, so in the column's units.
+    one_day = fields.to_db(60*60*24)
 
     filters = {
         'raw__when__gte': beginning,
         'raw__when__lte': ending,
-        'audit_period_ending': F('audit_period_beginning') + (60*60*24)
+        'audit_period_ending': F('audit_period_beginning') + one_day
     }
     periodic_exists = models.InstanceExists.objects.filter(**filters)
 
@@ -164,7 +167,7 @@ def _verifier_audit_for_day(beginning, ending):
     filters = {
         'raw__when__gte': beginning,
         'raw__when__lte': ending,
-        'audit_period_ending__lt': F('audit_period_beginning') + (60*60*24)
+        'audit_period_ending__lt': F('audit_period_beginning') + one_day
     }
     instant_exists = models.InstanceExists.objects.filter(**filters)
 
@@ -198,7 +201,7 @@ def _launch_audit_for_period(beginning, ending):
     # Thus, we send it 'beginning' three times...
     old_launches = models.InstanceUsage.objects\
                          .raw(OLD_LAUNCHES_QUERY,
-                              [beginning, beginning, beginning])
+                              [fields.to_db(beginning)] * 3)
 
     old_launches_dict = {}
     for launch in old_launches:
@@ -11,6 +11,7 @@ sys.path.append(os.environ.get('STACKTACH_INSTALL_DIR', '/stacktach'))
 from stacktach import datetime_to_decimal as dt
 from stacktach import image_type
 from stacktach import models
+from stacktach import partitions
 
 
 def make_report(yesterday=None, start_hour=0, hours=24, percentile=97,
@@ -25,6 +26,10 @@ def make_report(yesterday=None, start_hour=0, hours=24, percentile=97,
 
     dstart = dt.dt_to_decimal(rstart)
     dend = dt.dt_to_decimal(rend)
+    # A request can run past either end of the window, but bounding the
+    # per-request lookups keeps them to the partitions near it.
+    req_start = dstart - partitions.REQUEST_SLACK
+    req_end = dend + partitions.REQUEST_SLACK
 
     too_long_col = '> %d' % (too_long / 60)
 
@@ -68,8 +73,9 @@ def make_report(yesterday=None, start_hour=0, hours=24, percentile=97,
         for req_dict in reqs:
             req = req_dict['request_id']
             raws = models.RawData.objects.filter(request_id=req)\
-                                      .exclude(event='compute.instance.exists')\
-                                      .order_by('when')
+                                      .exclude(event='compute.instance.exists')
+            raws = partitions.bounded(raws, req_start, req_end)\
+                             .order_by('when')
 
             start = None
             err = None
@@ -102,19 +108,9 @@ def make_report(yesterday=None, start_hour=0, hours=24, percentile=97,
                 if raw.image_type:
                     image_type_num |= raw.image_type
 
-            # Get image (base or snapshot) from image_type bit field
-            image = "?"
-            if image_type.isset(image_type_num, image_type.BASE_IMAGE):
-                image = "base"
-            if image_type.isset(image_type_num, image_type.SNAPSHOT_IMAGE):
-                image = "snap"
-
-            #Get os_type from image_type bit field
-            os_type = "?"
-            if image_type.isset(image_type_num, image_type.LINUX_IMAGE):
-                os_type = "linux"
-            if image_type.isset(image_type_num, image_type.WINDOWS_IMAGE):
-                os_type = "windows"
+            # Get image (base or snapshot) and os_type from image_type
+            # bit field
+            image, os_type = image_type.labels(image_type_num)
 
             if not start:
                 continue
@@ -135,7 +131,8 @@ def make_report(yesterday=None, start_hour=0, hours=24, percentile=97,
             attempts[key] = attempts.get(key, 0) + 1
 
             if failure_type:
-                if err:
+                # Headers-only events have no body to look in.
+                if err and err.json:
                     queue, body = json.loads(err.json)
                     payload = body['payload']
                     exc = payload.get('exception')
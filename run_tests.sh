@@ -1,2 +1,18 @@
 #!/bin/bash
-nosetests tests --exclude-dir=stacktach --with-coverage --cover-package=stacktach,worker,verifier --cover-erase
+nosetests tests --exclude-dir=stacktach --with-coverage --cover-package=stacktach,worker,verifier --cover-erase || exit 1
+
+# The stacktach app tests need a database. Django's runner migrates a test
+# one, so the query plan checks EXPLAIN against the real indexes. With no
+# local_settings.py or STACKTACH_DB_NAME, use sqlite in a scratch directory.
+export DJANGO_SETTINGS_MODULE=settings
+if [ ! -f local_settings.py ] && [ -z "$STACKTACH_DB_NAME" ]; then
+    scratch=$(mktemp -d)
+    trap 'rm -rf "$scratch"' EXIT
+    export STACKTACH_DB_ENGINE=django.db.backends.sqlite3
+    export STACKTACH_DB_NAME=$scratch/stacktach.db
+    export STACKTACH_DB_USERNAME=
+    export STACKTACH_DB_PASSWORD=
+    # Where the templates are, with the trailing slash settings.py expects.
+    export STACKTACH_INSTALL_DIR=$(cd "$(dirname "$0")" && pwd)/
+fi
+python manage.py test stacktach
@@ -11,6 +11,10 @@ try:
     db_password = STACKTACH_DB_PASSWORD
     db_port = STACKTACH_DB_PORT
     install_dir = os.path.expanduser(STACKTACH_INSTALL_DIR)
+    bigint_times = globals().get('STACKTACH_BIGINT_TIMES', False)
+    rawdata_partitions = globals().get('STACKTACH_RAWDATA_PARTITIONS')
+    rawdata_archive_dir = globals().get('STACKTACH_RAWDATA_ARCHIVE_DIR')
+    compress_rawdata = globals().get('STACKTACH_COMPRESS_RAWDATA', False)
 except ImportError:
     db_engine = os.environ.get('STACKTACH_DB_ENGINE',
                                'django.db.backends.mysql')
@@ -20,6 +24,24 @@ except ImportError:
     db_password = os.environ['STACKTACH_DB_PASSWORD']
     db_port = os.environ.get('STACKTACH_DB_PORT', "")
     install_dir = os.environ['STACKTACH_INSTALL_DIR']
+    bigint_times = os.environ.get('STACKTACH_BIGINT_TIMES',
+                                  '').lower() in ('1', 'true')
+    rawdata_partitions = os.environ.get('STACKTACH_RAWDATA_PARTITIONS')
+    rawdata_archive_dir = os.environ.get('STACKTACH_RAWDATA_ARCHIVE_DIR')
+    compress_rawdata = os.environ.get('STACKTACH_COMPRESS_RAWDATA',
+                                      '').lower() in ('1', 'true')
+
+# Store the time columns as BIGINT microseconds rather than DECIMAL(20,6).
+# See stacktach/fields.py before changing it on an existing database.
+BIGINT_TIMES = bigint_times
+# 'daily' or 'monthly' to partition RawData on MySQL. Needs BIGINT_TIMES.
+# See stacktach/partitions.py.
+RAWDATA_PARTITIONS = rawdata_partitions or None
+# Where util/archive_rawdata.py keeps RawData moved out of the database.
+# See stacktach/archive.py.
+RAWDATA_ARCHIVE_DIR = rawdata_archive_dir or None
+# zlib compress new RawData bodies. Existing ones are read either way.
+COMPRESS_RAWDATA = compress_rawdata
 
 DEBUG = False
 TEMPLATE_DEBUG = DEBUG
@@ -0,0 +1,351 @@
+# Copyright (c) 2013 - Rackspace Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""Cold archive of old RawData.
+
+util/archive_rawdata.py moves RawData older than some number of days out
+of the database into append-only segment files in RAWDATA_ARCHIVE_DIR:
+
+    rawdata.<sequence>.seg  zlib compressed blocks of rows, each line
+                            "<id>\t<json object of the row's columns>"
+    rawdata.<sequence>.idx  one fixed size record per block: the first
+                            and last id in it, its offset and its length
+
+The index has one record per block rather than per row, so the whole of
+it can be kept in memory, and finding a row means decompressing a
+single block. Blocks are synced to disk before their index records,
+and both before the rows are deleted from the database, so a crash can
+leave unindexed bytes at the end of a segment or rows archived twice,
+but can't lose a row.
+
+RawDataImageMeta isn't archived, it is a copy of part of the json.
+Other tables keep the ids of archived RawData; do_show and expand look
+those up here once they're gone from the database.
+"""
+
+import bisect
+import errno
+import fcntl
+import json
+import os
+import struct
+import time
+import zlib
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Max
+
+from stacktach import datetime_to_decimal as dt
+from stacktach import db
+from stacktach import fields
+from stacktach import models
+
+RAWDATA_ARCHIVE_DIR = getattr(settings, 'RAWDATA_ARCHIVE_DIR', None)
+
+PREFIX = 'rawdata.'
+SEGMENT_SUFFIX = '.seg'
+INDEX_SUFFIX = '.idx'
+LOCK_FILE = 'archive.lock'
+# First id, last id, offset and length of a block.
+INDEX_RECORD = struct.Struct('<qqQI')
+
+COLUMNS = [f.attname for f in models.RawData._meta.fields
+           if f.attname not in ('id', 'when')]
+
+
+def row_to_dict(raw, deployments):
+    """The archived form of a RawData; deployments maps ids to names."""
+    row = {'id': raw.id,
+           'when': fields.micros(raw, 'when'),
+           'deployment': deployments.get(raw.deployment_id),
+           'json': raw.json}
+    for column in COLUMNS:
+        row[column] = getattr(raw, column)
+    return row
+
+
+def dict_to_rawdata(row):
+    """An unsaved RawData with the columns of an archived row. Its
+    deployment is still read from the database, which keeps them."""
+    kwargs = dict((column, row.get(column)) for column in COLUMNS)
+    return models.RawData(id=row['id'],
+                          when=dt.micros_to_decimal(row['when']),
+                          json=row['json'], **kwargs)
+
+
+def _sequence(filename, suffix):
+    if not filename.startswith(PREFIX) or not filename.endswith(suffix):
+        return None
+    try:
+        return int(filename[len(PREFIX):-len(suffix)])
+    except ValueError:
+        return None
+
+
+def _path(directory, sequence, suffix):
+    return os.path.join(directory,
+                        "%s%012d%s" % (PREFIX, sequence, suffix))
+
+
+def _sync(f):
+    f.flush()
+    os.fsync(f.fileno())
+
+
+class ArchiveWriter(object):
+    """Appends blocks to the newest segment until it reaches
+    segment_bytes, then starts another. Only one writer can have a
+    directory open at a time."""
+    def __init__(self, directory, segment_bytes=256 * 1024 * 1024,
+                 level=6):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.level = level
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.lock = open(os.path.join(directory, LOCK_FILE), 'a')
+        try:
+            fcntl.flock(self.lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError, e:
+            self.lock.close()
+            if e.errno in (errno.EAGAIN, errno.EACCES):
+                raise IOError(e.errno, "%s is being written by another "
+                                       "archiver" % directory)
+            raise
+        sequences = [_sequence(filename, SEGMENT_SUFFIX)
+                     for filename in os.listdir(directory)]
+        self.sequence = max([s for s in sequences if s is not None] or [0])
+        self.segment = None
+        self.index = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def _open(self):
+        if self.segment:
+            self.segment.seek(0, os.SEEK_END)
+            if self.segment.tell() < self.segment_bytes:
+                return
+            self._close()
+            self.sequence += 1
+        self.segment = open(_path(self.directory, self.sequence,
+                                  SEGMENT_SUFFIX), 'ab')
+        self.index = open(_path(self.directory, self.sequence,
+                                INDEX_SUFFIX), 'ab')
+        self.segment.seek(0, os.SEEK_END)
+        if self.segment.tell() >= self.segment_bytes:
+            self._open()
+
+    def _close(self):
+        if self.segment:
+            self.segment.close()
+            self.index.close()
+        self.segment = None
+        self.index = None
+
+    def write_block(self, rows):
+        """Write one block of archived rows, as from row_to_dict()."""
+        rows = sorted(rows, key=lambda row: row['id'])
+        text = '\n'.join(["%d\t%s" % (row['id'], json.dumps(row))
+                          for row in rows])
+        data = zlib.compress(text, self.level)
+        self._open()
+        offset = self.segment.tell()
+        self.segment.write(data)
+        _sync(self.segment)
+        self.index.write(INDEX_RECORD.pack(rows[0]['id'], rows[-1]['id'],
+                                           offset, len(data)))
+        _sync(self.index)
+        self.bytes_in += len(text)
+        self.bytes_out += len(data)
+
+    def close(self):
+        self._close()
+        self.lock.close()
+
+
+class Archive(object):
+    """Looks rows up by id. The index records are read once and then
+    only the new ones as the archiver appends more."""
+    def __init__(self, directory):
+        self.directory = directory
+        self.read_to = {}
+        # (first id, last id, sequence, offset, length), sorted.
+        self.blocks = []
+        self.firsts = []
+        # reach[i] is the highest last id of blocks[:i + 1], so a lookup
+        # can stop walking back once no earlier block can hold the id.
+        self.reach = []
+
+    def refresh(self):
+        if not os.path.isdir(self.directory):
+            return
+        added = []
+        for filename in os.listdir(self.directory):
+            sequence = _sequence(filename, INDEX_SUFFIX)
+            if sequence is None:
+                continue
+            path = os.path.join(self.directory, filename)
+            start = self.read_to.get(path, 0)
+            size = os.path.getsize(path)
+            whole = (size - start) // INDEX_RECORD.size * INDEX_RECORD.size
+            if not whole:
+                continue
+            with open(path, 'rb') as f:
+                f.seek(start)
+                data = f.read(whole)
+            for offset in range(0, len(data), INDEX_RECORD.size):
+                first, last, block, length = \
+                    INDEX_RECORD.unpack_from(data, offset)
+                added.append((first, last, sequence, block, length))
+            self.read_to[path] = start + whole
+        if not added:
+            return
+
+        self.blocks = sorted(self.blocks + added)
+        self.firsts = [block[0] for block in self.blocks]
+        self.reach = []
+        highest = None
+        for block in self.blocks:
+            highest = max(highest, block[1])
+            self.reach.append(highest)
+
+    def _candidates(self, raw_id):
+        i = bisect.bisect_right(self.firsts, raw_id) - 1
+        while i >= 0 and self.reach[i] >= raw_id:
+            if self.blocks[i][1] >= raw_id:
+                yield self.blocks[i]
+            i -= 1
+
+    def _read_block(self, sequence, offset, length):
+        with open(_path(self.directory, sequence, SEGMENT_SUFFIX), 'rb') as f:
+            f.seek(offset)
+            return zlib.decompress(f.read(length))
+
+    def get(self, raw_id):
+        """The archived row for raw_id as a dict, or None."""
+        self.refresh()
+        prefix = "%d\t" % raw_id
+        for first, last, sequence, offset, length in \
+                self._candidates(raw_id):
+            for line in self._read_block(sequence, offset,
+                                         length).split('\n'):
+                if line.startswith(prefix):
+                    return json.loads(line[len(prefix):])
+        return None
+
+
+_archive = None
+
+
+def load_rawdata(raw_id):
+    """RawData raw_id from RAWDATA_ARCHIVE_DIR, or None if it isn't
+    there (or there's no archive)."""
+    global _archive
+    if not RAWDATA_ARCHIVE_DIR:
+        return None
+    if _archive is None:
+        _archive = Archive(RAWDATA_ARCHIVE_DIR)
+    row = _archive.get(int(raw_id))
+    if row is None:
+        return None
+    return dict_to_rawdata(row)
+
+
+def _delete(ids):
+    """Delete RawData rows without cascading to the rows that refer to
+    them, which keep the ids."""
+    cursor = connection.cursor()
+    placeholders = ', '.join(['%s'] * len(ids))
+    mysql = connection.vendor == 'mysql'
+    if mysql:
+        cursor.execute("SET foreign_key_checks = 0")
+    try:
+        for model in [models.RawDataBody, models.RawDataImageMeta]:
+            cursor.execute("DELETE FROM %s WHERE raw_id IN (%s)" %
+                           (model._meta.db_table, placeholders), ids)
+        cursor.execute("DELETE FROM %s WHERE id IN (%s)" %
+                       (models.RawData._meta.db_table, placeholders), ids)
+    finally:
+        if mysql:
+            cursor.execute("SET foreign_key_checks = 1")
+
+
+class Archiver(object):
+    """Moves RawData older than a cutoff into an ArchiveWriter, batch
+    rows at a time: each batch is written in blocks of block_rows and
+    then deleted in one transaction."""
+    def __init__(self, writer, batch=1000, block_rows=100):
+        self.writer = writer
+        self.batch = batch
+        self.block_rows = block_rows
+        self.rows = 0
+        self.seconds = 0.0
+        self.deployments = dict(models.Deployment.objects
+                                      .values_list('id', 'name'))
+
+    def _archive_batch(self, raws):
+        bodies = models.RawDataBody.load_many([raw.id for raw in raws])
+        for raw in raws:
+            raw.json = bodies.get(raw.id, '')
+        rows = [row_to_dict(raw, self.deployments) for raw in raws]
+        for start in range(0, len(rows), self.block_rows):
+            self.writer.write_block(rows[start:start + self.block_rows])
+        db.transactional(_delete, [raw.id for raw in raws])
+
+    def archive(self, cutoff, limit=None):
+        """Archive RawData with when before cutoff (Decimal seconds),
+        at most limit rows of it. Returns the number archived."""
+        archived = 0
+        start = time.time()
+        # Walk the old rows by id, from the last one archived up to the
+        # newest old one, found once on the when index. Each batch is then
+        # a range on the primary key, rather than a sort of every row
+        # left before cutoff.
+        old = models.RawData.objects.filter(when__lt=cutoff)
+        last_id = 0
+        end_id = old.aggregate(end_id=Max('id'))['end_id'] or 0
+        try:
+            while last_id < end_id and (limit is None or archived < limit):
+                batch = self.batch
+                if limit is not None:
+                    batch = min(batch, limit - archived)
+                raws = list(old.filter(id__gt=last_id, id__lte=end_id)
+                               .order_by('id')[:batch])
+                if not raws:
+                    break
+                self._archive_batch(raws)
+                archived += len(raws)
+                last_id = raws[-1].id
+        finally:
+            self.rows += archived
+            self.seconds += time.time() - start
+        return archived
+
+    def report(self):
+        """Rows archived, bytes read and written, and rows and bytes
+        read per second, so far."""
+        seconds = self.seconds or 1e-9
+        return {'rows': self.rows,
+                'seconds': self.seconds,
+                'bytes_in': self.writer.bytes_in,
+                'bytes_out': self.writer.bytes_out,
+                'rows_per_sec': self.rows / seconds,
+                'bytes_per_sec': self.writer.bytes_in / seconds}
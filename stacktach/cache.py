@@ -0,0 +1,176 @@
+# Copyright (c) 2013 - Rackspace Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""Small in-process caches used by the worker to skip database lookups.
+
+Each worker process (and each post_process thread) keeps its own
+cache, so entries can go stale when several consumers share a
+deployment. The ttl bounds how stale an entry can get.
+"""
+
+import collections
+import time
+
+
+class LRUCache(object):
+    """A bounded least-recently-used cache with a time-to-live.
+
+    on_evict(key, value) is called for every entry that is pushed out
+    because the cache is full or because it expired, but not for
+    entries removed with pop() or clear()."""
+    def __init__(self, size, ttl=None, on_evict=None):
+        self.size = size
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def _evict(self, key, value):
+        if self.on_evict:
+            self.on_evict(key, value)
+
+    def get(self, key, default=None, now=None):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            return default
+
+        value, added = entry
+        if self.ttl is not None:
+            if now is None:
+                now = time.time()
+            if now - added >= self.ttl:
+                self.misses += 1
+                self._evict(key, value)
+                return default
+
+        # Re-inserting moves the key to the most recently used end.
+        self.entries[key] = entry
+        self.hits += 1
+        return value
+
+    def put(self, key, value, now=None):
+        if now is None:
+            now = time.time()
+        self.entries.pop(key, None)
+        self.entries[key] = (value, now)
+        while len(self.entries) > self.size:
+            old_key, (old_value, added) = self.entries.popitem(last=False)
+            self._evict(old_key, old_value)
+
+    def pop(self, key, default=None):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return default
+        return entry[0]
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        return {'size': len(self.entries), 'hits': self.hits,
+                'misses': self.misses}
+
+
+class WriteBackCache(LRUCache):
+    """An LRUCache of model objects whose saves are coalesced.
+
+    Callers mark an object dirty instead of saving it. Dirty objects
+    are saved by flush(), at most once per flush_interval seconds
+    however often they changed, or when they are evicted.
+
+    Saves happen inside the caller's transaction, so call commit() or
+    rollback() once it ends. A rollback keeps the changes of earlier,
+    committed transactions dirty, but drops those to objects the
+    failed transaction marked, since they may refer to rows it made."""
+    def __init__(self, size, ttl=None, flush_interval=0, save=None):
+        super(WriteBackCache, self).__init__(size, ttl=ttl,
+                                             on_evict=self._write)
+        self.flush_interval = flush_interval
+        self.save = save
+        self.dirty = {}
+        # Saved, and marked dirty, since the last commit().
+        self.written = {}
+        self.touched = set()
+        self.last_flush = time.time()
+        self.writes = 0
+
+    def _write(self, key, value):
+        if self.dirty.pop(key, None) is not None:
+            self.save(value)
+            self.written[key] = value
+            self.writes += 1
+
+    def mark_dirty(self, key, value):
+        self.dirty[key] = value
+        self.touched.add(key)
+
+    def due(self, now=None):
+        """Whether flush() would save anything now."""
+        if now is None:
+            now = time.time()
+        return (bool(self.dirty) and
+                now - self.last_flush >= self.flush_interval)
+
+    def flush(self, force=False, now=None):
+        if now is None:
+            now = time.time()
+        if not force and now - self.last_flush < self.flush_interval:
+            return
+        self.last_flush = now
+        dirty = self.dirty
+        self.dirty = {}
+        for key, value in dirty.items():
+            self.save(value)
+            self.written[key] = value
+            self.writes += 1
+
+    def commit(self):
+        self.written = {}
+        self.touched = set()
+
+    def rollback(self):
+        # What was saved since the commit was rolled back with it.
+        dirty = self.written
+        dirty.update(self.dirty)
+        for key in self.touched:
+            dirty.pop(key, None)
+        # Cached objects may have been changed by the failed transaction.
+        self.clear()
+        self.dirty = dirty
+
+    def clear(self):
+        super(WriteBackCache, self).clear()
+        self.dirty = {}
+        self.written = {}
+        self.touched = set()
+
+    def stats(self):
+        stats = super(WriteBackCache, self).stats()
+        stats['dirty'] = len(self.dirty)
+        stats['writes'] = self.writes
+        return stats
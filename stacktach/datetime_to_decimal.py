@@ -4,11 +4,47 @@ import decimal
 import time
 
 
+# Our own context, rather than setting the precision of the global one
+# on every call.
+CONTEXT = decimal.Context(prec=30)
+MILLION = decimal.Decimal("1000000.0")
+
+
+def dt_to_micros(utc):
+    """Microseconds since the epoch."""
+    return calendar.timegm(utc.utctimetuple()) * 1000000 + utc.microsecond
+
+
+def micros_to_decimal(micros):
+    """The same Decimal dt_to_decimal() gives for that instant."""
+    secs, micro = divmod(micros, 1000000)
+    if not micro:
+        return decimal.Decimal(secs)
+    if secs >= 0:
+        # Building the string is much cheaper than Decimal arithmetic
+        # and gives the same digits.
+        return decimal.Decimal("%d.%s" % (secs, ("%06d" % micro).rstrip('0')))
+    return CONTEXT.add(decimal.Decimal(secs),
+                       CONTEXT.divide(decimal.Decimal(micro), MILLION))
+
+
 def dt_to_decimal(utc):
-    decimal.getcontext().prec = 30
-    return decimal.Decimal(str(calendar.timegm(utc.utctimetuple()))) + \
-           (decimal.Decimal(str(utc.microsecond)) /
-           decimal.Decimal("1000000.0"))
+    return micros_to_decimal(dt_to_micros(utc))
+
+
+def decimal_to_micros(dec):
+    """The inverse of micros_to_decimal(). Digits past the sixth
+    decimal place are dropped, as dt_from_decimal() drops them."""
+    return int(CONTEXT.multiply(dec, MILLION))
+
+
+def dt_from_micros(micros):
+    """The same datetime dt_from_decimal() gives for that instant,
+    without going through Decimal."""
+    if micros is None:
+        return "n/a"
+    secs, micro = divmod(micros, 1000000)
+    return datetime.datetime.utcfromtimestamp(secs).replace(microsecond=micro)
 
 
 def dt_from_decimal(dec):
@@ -1,46 +1,197 @@
+import operator
+import random
+import sys
+import time
+
+from django.db import DatabaseError
+from django.db import IntegrityError
+from django.db import transaction
+from django.db.models import F
+from django.db.models import Q
+
+from stacktach import fields
 from stacktach import stacklog
 from stacktach import models
+from stacktach import sketch
+
+DEADLOCK_RETRIES = 3
+DEADLOCK_BACKOFF = 0.05
+# MySQL's ER_LOCK_DEADLOCK and ER_LOCK_WAIT_TIMEOUT.
+DEADLOCK_ERRORS = [1213, 1205]
+
+# Called with no arguments whenever transactional() commits or rolls
+# back.
+COMMIT_HOOKS = []
+ROLLBACK_HOOKS = []
+
+
+def _is_deadlock(e):
+    if e.args and e.args[0] in DEADLOCK_ERRORS:
+        return True
+    return 'deadlock' in str(e).lower()
+
+
+def transactional(func, *args, **kwargs):
+    """Call func(*args, **kwargs) inside a single transaction and return
+    its result.
+
+    When two transactions deadlock InnoDB rolls one of them back, so a
+    deadlock or lock wait timeout retries the whole call, up to
+    DEADLOCK_RETRIES attempts. Inside an already open transaction func
+    is just called, the outer transaction decides."""
+    if transaction.is_managed():
+        return func(*args, **kwargs)
+
+    attempt = 1
+    while True:
+        try:
+            with transaction.commit_on_success():
+                result = func(*args, **kwargs)
+        except Exception, e:
+            exc_info = sys.exc_info()
+            for hook in ROLLBACK_HOOKS:
+                hook()
+            if (not isinstance(e, DatabaseError) or
+                    attempt >= DEADLOCK_RETRIES or not _is_deadlock(e)):
+                raise exc_info[0], exc_info[1], exc_info[2]
+            stacklog.warn('Deadlock on attempt %d, retrying: %s' %
+                          (attempt, e))
+            time.sleep(random.uniform(0, DEADLOCK_BACKOFF * attempt))
+            attempt += 1
+        else:
+            for hook in COMMIT_HOOKS:
+                hook()
+            return result
 
 
 def _safe_get(Model, **kwargs):
+    # Two rows are enough to tell one from many, so this is a single
+    # query rather than a COUNT followed by a SELECT.
     object = None
-    query = Model.objects.filter(**kwargs)
-    count = query.count()
-    if count > 1:
+    results = list(Model.objects.filter(**kwargs)[:2])
+    if len(results) > 1:
         stacklog.warn('Multiple records found for %s get.' % Model.__name__)
-        object = query[0]
-    elif count < 1:
+        object = results[0]
+    elif len(results) < 1:
         stacklog.warn('No records found for %s get.' % Model.__name__)
     else:
-        object = query[0]
+        object = results[0]
     return object
 
 
+def _safe_get_or_create(Model, **kwargs):
+    # With several consumers per deployment two workers can race through
+    # get_or_create and both insert, after which get_or_create raises.
+    # Settle on the oldest row so every worker picks the same one.
+    try:
+        return Model.objects.get_or_create(**kwargs)
+    except Model.MultipleObjectsReturned:
+        stacklog.warn('Multiple records found for %s get_or_create.' %
+                      Model.__name__)
+        return Model.objects.filter(**kwargs).order_by('id')[0], False
+
+
 def get_or_create_deployment(name):
-    return models.Deployment.objects.get_or_create(name=name)
+    return _safe_get_or_create(models.Deployment, name=name)
 
 
-def create_rawdata(**kwargs):
-    imagemeta_fields = ['os_architecture', 'os_version',
-                        'os_distro', 'rax_options']
+IMAGEMETA_FIELDS = ['os_architecture', 'os_version',
+                    'os_distro', 'rax_options']
+
+
+def _split_rawdata_kwargs(kwargs):
     imagemeta_kwargs = \
-        dict((k, v) for k, v in kwargs.iteritems() if k in imagemeta_fields)
+        dict((k, v) for k, v in kwargs.iteritems() if k in IMAGEMETA_FIELDS)
     rawdata_kwargs = \
-        dict((k, v) for k, v in kwargs.iteritems() if k not in imagemeta_fields)
+        dict((k, v) for k, v in kwargs.iteritems()
+             if k not in IMAGEMETA_FIELDS)
+    return rawdata_kwargs, imagemeta_kwargs
+
+
+def create_rawdata(**kwargs):
+    rawdata_kwargs, imagemeta_kwargs = _split_rawdata_kwargs(kwargs)
+    json = rawdata_kwargs.pop('json', '')
     rawdata = models.RawData(**rawdata_kwargs)
     rawdata.save()
+    rawdata.json = json
 
-    imagemeta_kwargs.update({'raw_id': rawdata.id})
-    save(models.RawDataImageMeta(**imagemeta_kwargs))
+    # Headers-only events are stored without a body or image meta.
+    if json:
+        save(models.RawDataBody.create(rawdata.id, json))
+    if imagemeta_kwargs:
+        imagemeta_kwargs.update({'raw_id': rawdata.id})
+        save(models.RawDataImageMeta(**imagemeta_kwargs))
 
     return rawdata
 
+
+def _create_rawdata_batch(kwargs_list):
+    raws = []
+    bodies = []
+    imagemetas = []
+    for kwargs in kwargs_list:
+        rawdata_kwargs, imagemeta_kwargs = _split_rawdata_kwargs(kwargs)
+        json = rawdata_kwargs.pop('json', '')
+        rawdata = models.RawData(**rawdata_kwargs)
+        rawdata.save()
+        rawdata.json = json
+        if json:
+            bodies.append(models.RawDataBody.create(rawdata.id, json))
+        if imagemeta_kwargs:
+            imagemeta_kwargs.update({'raw_id': rawdata.id})
+            imagemetas.append(models.RawDataImageMeta(**imagemeta_kwargs))
+        raws.append(rawdata)
+    if bodies:
+        models.RawDataBody.objects.bulk_create(bodies)
+    if imagemetas:
+        models.RawDataImageMeta.objects.bulk_create(imagemetas)
+    return raws
+
+
+def create_rawdata_batch(kwargs_list):
+    """Store a batch of RawData rows inside a single transaction.
+
+    The RawData ids are needed by the image meta rows and by
+    post-processing, so those rows are still inserted one at a time,
+    but the whole batch is committed once and the RawDataBody and
+    RawDataImageMeta rows go in with a multi-row insert each. If the caller already
+    has a transaction open the rows are committed with it."""
+    if transaction.is_managed():
+        return _create_rawdata_batch(kwargs_list)
+    with transaction.commit_on_success():
+        return _create_rawdata_batch(kwargs_list)
+
+
+def find_stored_message_ids(deployment, message_ids):
+    """Return the subset of message_ids already stored as RawData for
+    this deployment."""
+    if not message_ids:
+        return set()
+    stored = models.RawData.objects.filter(deployment=deployment,
+                                           message_id__in=message_ids)\
+                                   .values_list('message_id', flat=True)
+    return set(stored)
+
+
+def find_recent_message_ids(deployment, since):
+    """message_ids stored for this deployment at or after since, for
+    warming the worker's dedup filter."""
+    return models.RawData.objects.filter(deployment=deployment,
+                                         when__gte=since)\
+                                 .exclude(message_id=None)\
+                                 .values_list('message_id', flat=True)\
+                                 .iterator()
+
+
 def create_lifecycle(**kwargs):
     return models.Lifecycle(**kwargs)
 
 
 def find_lifecycles(**kwargs):
-    return models.Lifecycle.objects.select_related().filter(**kwargs)
+    # Ordered so concurrent workers agree on which of any duplicate
+    # Lifecycles is the live one.
+    return models.Lifecycle.objects.select_related().filter(**kwargs)\
+                                   .order_by('id')
 
 
 def create_timing(**kwargs):
@@ -51,6 +202,76 @@ def find_timings(**kwargs):
     return models.Timing.objects.select_related().filter(**kwargs)
 
 
+def find_open_timing(name, lifecycle):
+    """The newest Timing for this operation that has seen a .start but
+    no .end, or None. The newest, since that is the one the worker's
+    timing cache holds."""
+    timings = models.Timing.objects.filter(name=name, lifecycle=lifecycle,
+                                           is_open=True).order_by('-id')[:1]
+    timings = list(timings)
+    if timings:
+        return timings[0]
+    return None
+
+
+def add_to_timing_summary(name, deployment_id, hour, diff):
+    """Add one closed Timing to its hourly TimingSummary. Only uses
+    relative UPDATEs, so concurrent workers can't lose each other's
+    counts."""
+    query = models.TimingSummary.objects.filter(name=name,
+                                                deployment=deployment_id,
+                                                hour=hour)
+    # F() expressions are sent as they are, so diff goes in as stored.
+    total = F('total') + fields.to_db(diff)
+    if not query.update(count=F('count') + 1, total=total):
+        sid = transaction.savepoint()
+        try:
+            models.TimingSummary(name=name, deployment_id=deployment_id,
+                                 hour=hour, count=1, total=diff, min=diff,
+                                 max=diff).save(force_insert=True)
+            transaction.savepoint_commit(sid)
+            return
+        except IntegrityError:
+            # Another worker created it first.
+            transaction.savepoint_rollback(sid)
+            query.update(count=F('count') + 1, total=total)
+    query.filter(min__gt=diff).update(min=diff)
+    query.filter(max__lt=diff).update(max=diff)
+
+
+def add_to_timing_sketch(name, deployment_id, hour, image, os_type, diff):
+    """Add one closed Timing to its hourly TimingSketch. The row is
+    locked while the sketch is updated."""
+    key = dict(name=name, deployment=deployment_id, hour=hour, image=image,
+               os_type=os_type)
+    for attempt in range(2):
+        rows = list(models.TimingSketch.objects.select_for_update()
+                                               .filter(**key)[:1])
+        if rows:
+            row = rows[0]
+            latencies = sketch.LatencySketch.from_json(row.sketch)
+            latencies.add(diff)
+            row.sketch = latencies.to_json()
+            row.save(force_update=True)
+            return
+
+        latencies = sketch.LatencySketch()
+        latencies.add(diff)
+        sid = transaction.savepoint()
+        try:
+            models.TimingSketch(name=name, deployment_id=deployment_id,
+                                hour=hour, image=image, os_type=os_type,
+                                sketch=latencies.to_json())\
+                  .save(force_insert=True)
+            transaction.savepoint_commit(sid)
+            return
+        except IntegrityError:
+            transaction.savepoint_rollback(sid)
+            if attempt:
+                raise
+            # Another worker created it first, add to theirs.
+
+
 def create_request_tracker(**kwargs):
     return models.RequestTracker(**kwargs)
 
@@ -64,11 +285,11 @@ def create_instance_usage(**kwargs):
 
 
 def get_or_create_instance_usage(**kwargs):
-    return models.InstanceUsage.objects.get_or_create(**kwargs)
+    return _safe_get_or_create(models.InstanceUsage, **kwargs)
 
 
 def get_or_create_instance_delete(**kwargs):
-    return models.InstanceDeletes.objects.get_or_create(**kwargs)
+    return _safe_get_or_create(models.InstanceDeletes, **kwargs)
 
 
 def get_instance_usage(**kwargs):
@@ -87,5 +308,46 @@ def create_instance_exists(**kwargs):
     return models.InstanceExists(**kwargs)
 
 
+def create_instance_exists_batch(exists):
+    """Insert unsaved InstanceExists in one statement. The objects
+    don't get their ids back."""
+    models.InstanceExists.objects.bulk_create(exists)
+
+
+def _launches_filter(launches):
+    # One (instance, launched_at) range per launch, so each is a seek on
+    # the (instance, launched_at) index. Sorted to keep the SQL stable.
+    return reduce(operator.or_,
+                  [Q(instance=instance,
+                     launched_at__range=(launched_at, launched_at + 1))
+                   for instance, launched_at in sorted(launches)])
+
+
+def find_instance_usages(launches):
+    """InstanceUsages launched within a second of any of launches,
+    (instance, launched_at) pairs, in one query."""
+    return models.InstanceUsage.objects.filter(_launches_filter(launches))\
+                                       .order_by('id')
+
+
+def find_instance_deletes(launches):
+    """InstanceDeletes launched within a second of any of launches."""
+    return models.InstanceDeletes.objects\
+                                 .filter(_launches_filter(launches))\
+                                 .order_by('id')
+
+
 def save(obj):
-    obj.save()
\ No newline at end of file
+    obj.save()
+
+
+def update(obj):
+    """Save a row known to exist, without the existence check save()
+    runs first."""
+    obj.save(force_update=True)
+
+
+def update_fields(obj, fields):
+    """Write just these columns of a row known to exist."""
+    values = dict((field, getattr(obj, field)) for field in fields)
+    type(obj).objects.filter(id=obj.id).update(**values)
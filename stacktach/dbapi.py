@@ -18,7 +18,6 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
 # IN THE SOFTWARE.
 
-import decimal
 import functools
 import json
 
@@ -31,7 +30,9 @@ from django.http import HttpResponseNotFound
 from django.http import HttpResponseServerError
 from django.shortcuts import get_object_or_404
 
+from stacktach import archive
 from stacktach import datetime_to_decimal as dt
+from stacktach import fields
 from stacktach import models
 from stacktach import stacklog
 from stacktach import utils
@@ -126,7 +127,12 @@ def get_usage_delete(request, delete_id):
 
 
 def _exists_extra_values(exist):
-    values = {'received': str(dt.dt_from_decimal(exist.raw.when))}
+    try:
+        raw = exist.raw
+    except models.RawData.DoesNotExist:
+        raw = archive.load_rawdata(exist.raw_id)
+    received = dt.dt_from_micros(raw and fields.micros(raw, 'when'))
+    values = {'received': str(received)}
     return values
 
 
@@ -301,11 +307,21 @@ def get_db_objects(klass, request, default_order_by, direction='desc',
     return objects.order_by(order_by)[start:end]
 
 
+def _time_fields(klass):
+    return [f.name for f in klass._meta.fields
+            if isinstance(f, fields.TimestampField)]
+
+
 def _convert_model(model, extra_values_func=None):
-    model_dict = model_to_dict(model)
-    for key in model_dict:
-        if isinstance(model_dict[key], decimal.Decimal):
-            model_dict[key] = str(dt.dt_from_decimal(model_dict[key]))
+    # Times are converted from microseconds, which is what a row read
+    # from BIGINT columns holds, so no Decimals are made for them.
+    time_fields = _time_fields(type(model))
+    model_dict = model_to_dict(model, exclude=time_fields)
+    for key in time_fields:
+        value = fields.micros(model, key)
+        if value is not None:
+            value = str(dt.dt_from_micros(value))
+        model_dict[key] = value
     if extra_values_func:
         model_dict.update(extra_values_func(model))
     return model_dict
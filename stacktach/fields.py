@@ -0,0 +1,161 @@
+# Copyright (c) 2013 - Rackspace Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""Storage for the time columns.
+
+Every time (and duration) in the models is seconds since the epoch as a
+Decimal. By default the columns are DECIMAL(20,6). With BIGINT_TIMES in
+the settings they are BIGINT microseconds instead, which index and
+compare faster; migration 0012 converts the existing rows, so choose the
+setting before migrating. To switch an existing database, migrate back
+to 0011 with the old setting and forward again with the new one.
+
+Model instances, filters, save(), update() and bulk_create() still deal
+in Decimal seconds either way. Code that reads columns without a model
+instance (values(), aggregates, raw SQL) or builds F() expressions has
+to use from_db() and to_db().
+
+BlobField holds the compressed RawData bodies.
+"""
+
+import decimal
+import sys
+
+from django.conf import settings
+from django.db import models
+from south.modelsinspector import add_introspection_rules
+
+from stacktach import datetime_to_decimal as dt
+
+BIGINT_TIMES = getattr(settings, 'BIGINT_TIMES', False)
+
+_INTEGERS = (int, long)
+
+
+def to_db(value):
+    """Seconds, as a Decimal or int, to the value stored in a column."""
+    if value is None or not BIGINT_TIMES:
+        return value
+    return dt.decimal_to_micros(decimal.Decimal(value))
+
+
+def from_db(value):
+    """A column value, as read by values() or an aggregate, to Decimal
+    seconds."""
+    if value is None:
+        return value
+    if BIGINT_TIMES:
+        return dt.micros_to_decimal(int(value))
+    return decimal.Decimal(value)
+
+
+def micros(obj, name):
+    """obj.name in microseconds, without building the Decimal when the
+    row was read from BIGINT columns."""
+    value = obj.__dict__.get(name)
+    if value is None or isinstance(value, _INTEGERS):
+        return value
+    return dt.decimal_to_micros(value)
+
+
+class _MicrosDescriptor(object):
+    """Holds what the database returned and only builds the Decimal
+    when the attribute is read, so rows that are serialised through
+    micros() never need one. Anything assigned other than the raw
+    column value is converted as DecimalField would convert it; ints
+    are taken to be microseconds, so assign times as Decimals."""
+    def __init__(self, field):
+        self.field = field
+
+    def __get__(self, obj, type=None):
+        if obj is None:
+            raise AttributeError('Can only be accessed via an instance.')
+        value = obj.__dict__[self.field.name]
+        if isinstance(value, _INTEGERS):
+            value = dt.micros_to_decimal(value)
+            obj.__dict__[self.field.name] = value
+        return value
+
+    def __set__(self, obj, value):
+        if not isinstance(value, _INTEGERS):
+            value = self.field.to_python(value)
+        obj.__dict__[self.field.name] = value
+
+
+class TimestampField(models.DecimalField):
+    """A DecimalField(max_digits=20, decimal_places=6) of seconds, stored
+    as BIGINT microseconds when BIGINT_TIMES is set."""
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('max_digits', 20)
+        kwargs.setdefault('decimal_places', 6)
+        super(TimestampField, self).__init__(*args, **kwargs)
+
+    def get_internal_type(self):
+        if BIGINT_TIMES:
+            return 'BigIntegerField'
+        return 'DecimalField'
+
+    def contribute_to_class(self, cls, name):
+        super(TimestampField, self).contribute_to_class(cls, name)
+        if BIGINT_TIMES:
+            setattr(cls, self.name, _MicrosDescriptor(self))
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if not prepared:
+            value = self.get_prep_value(value)
+        return to_db(value)
+
+    def get_db_prep_save(self, value, connection):
+        if not BIGINT_TIMES:
+            return super(TimestampField, self).get_db_prep_save(value,
+                                                               connection)
+        return to_db(self.to_python(value))
+
+
+class BlobField(models.Field):
+    """Bytes, in a BLOB column (LONGBLOB on MySQL, bytea on PostgreSQL).
+    Always read back as a str."""
+    __metaclass__ = models.SubfieldBase
+
+    def db_type(self, connection):
+        if connection.vendor == 'mysql':
+            return 'longblob'
+        if connection.vendor == 'postgresql':
+            return 'bytea'
+        return 'blob'
+
+    def to_python(self, value):
+        if value is None or isinstance(value, str):
+            return value
+        if isinstance(value, unicode):
+            # sqlite hands back text copied into the column as unicode.
+            return value.encode('utf-8')
+        return str(value)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if value is None:
+            return None
+        # Each backend module imports its driver as Database.
+        driver = sys.modules[type(connection).__module__].Database
+        return driver.Binary(value)
+
+
+add_introspection_rules([], [r"^stacktach\.fields\.TimestampField",
+                             r"^stacktach\.fields\.BlobField"])
@@ -31,6 +31,23 @@ flags = {'base' : BASE_IMAGE,
          'rhel' : OS_RHEL}
 
 
+def labels(num):
+    """The (image, os_type) labels used by the reports: 'base' or
+    'snap' and 'linux' or 'windows', with '?' when unknown."""
+    image = "?"
+    if isset(num, BASE_IMAGE):
+        image = "base"
+    if isset(num, SNAPSHOT_IMAGE):
+        image = "snap"
+
+    os_type = "?"
+    if isset(num, LINUX_IMAGE):
+        os_type = "linux"
+    if isset(num, WINDOWS_IMAGE):
+        os_type = "windows"
+    return image, os_type
+
+
 def readable(num):
     result = []
     for k, v in sorted(flags.iteritems(), key=itemgetter(1)):
@@ -13,9 +13,17 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import zlib
+
 from django import forms
+from django.conf import settings
 from django.db import models
 
+from stacktach.fields import BlobField
+from stacktach.fields import TimestampField
+
+COMPRESS_RAWDATA = getattr(settings, 'COMPRESS_RAWDATA', False)
+
 
 class Deployment(models.Model):
     name = models.CharField(max_length=50)
@@ -25,10 +33,12 @@ class Deployment(models.Model):
 
 
 class RawData(models.Model):
-    deployment = models.ForeignKey(Deployment)
+    # Migration 0015 indexes (deployment, when), (instance, when),
+    # (request_id, when) and (event, when), the shapes the views and
+    # reports query in, instead of those columns on their own.
+    deployment = models.ForeignKey(Deployment, db_index=False)
     tenant = models.CharField(max_length=50, null=True, blank=True,
                               db_index=True)
-    json = models.TextField()
     routing_key = models.CharField(max_length=50, null=True,
                                    blank=True, db_index=True)
     state = models.CharField(max_length=20, null=True,
@@ -40,24 +50,34 @@ class RawData(models.Model):
     task = models.CharField(max_length=30, null=True,
                              blank=True, db_index=True)
     image_type = models.IntegerField(null=True, default=0, db_index=True)
-    when = models.DecimalField(max_digits=20, decimal_places=6,
-                                               db_index=True)
+    when = TimestampField(db_index=True)
     publisher = models.CharField(max_length=100, null=True,
                                  blank=True, db_index=True)
-    event = models.CharField(max_length=50, null=True,
-                                 blank=True, db_index=True)
+    event = models.CharField(max_length=50, null=True, blank=True)
     service = models.CharField(max_length=50, null=True,
                                  blank=True, db_index=True)
     host = models.CharField(max_length=100, null=True,
                                  blank=True, db_index=True)
-    instance = models.CharField(max_length=50, null=True,
-                                blank=True, db_index=True)
-    request_id = models.CharField(max_length=50, null=True,
-                                blank=True, db_index=True)
+    instance = models.CharField(max_length=50, null=True, blank=True)
+    request_id = models.CharField(max_length=50, null=True, blank=True)
+    message_id = models.CharField(max_length=50, null=True,
+                                  blank=True, db_index=True)
 
     def __repr__(self):
         return "%s %s %s" % (self.event, self.instance, self.state)
 
+    def _get_json(self):
+        """The notification, read from RawDataBody the first time it is
+        needed. '' for events stored without one."""
+        if getattr(self, '_json', None) is None:
+            self._json = RawDataBody.load(self.id)
+        return self._json
+
+    def _set_json(self, json):
+        self._json = json
+
+    json = property(_get_json, _set_json)
+
 
 class RawDataImageMeta(models.Model):
     raw = models.ForeignKey(RawData, null=False)
@@ -67,6 +87,45 @@ class RawDataImageMeta(models.Model):
     rax_options = models.TextField(null=True, blank=True)
 
 
+class RawDataBody(models.Model):
+    """The json of a RawData, in its own table so that RawData queries,
+    and select_related() from the tables that refer to RawData, don't
+    read it. zlib compressed when COMPRESS_RAWDATA is set. raw_id isn't
+    a ForeignKey, as partitioned tables can't have them."""
+    raw_id = models.IntegerField(primary_key=True)
+    compressed = models.BooleanField(default=False)
+    data = BlobField()
+
+    @classmethod
+    def create(cls, raw_id, json):
+        if isinstance(json, unicode):
+            json = json.encode('utf-8')
+        if COMPRESS_RAWDATA:
+            return cls(raw_id=raw_id, compressed=True,
+                       data=zlib.compress(json))
+        return cls(raw_id=raw_id, data=json)
+
+    @property
+    def json(self):
+        data = self.data
+        if self.compressed:
+            data = zlib.decompress(data)
+        return data.decode('utf-8')
+
+    @classmethod
+    def load(cls, raw_id):
+        bodies = list(cls.objects.filter(raw_id=raw_id))
+        if not bodies:
+            return ''
+        return bodies[0].json
+
+    @classmethod
+    def load_many(cls, raw_ids):
+        """{raw_id: json} for those of raw_ids that have a body."""
+        return dict((body.raw_id, body.json)
+                    for body in cls.objects.filter(raw_id__in=raw_ids))
+
+
 class Lifecycle(models.Model):
     """The Lifecycle table is the Master for a group of
     Timing detail records. There is one Lifecycle row for
@@ -84,10 +143,11 @@ class Lifecycle(models.Model):
 
 
 class InstanceUsage(models.Model):
+    # instance and launched_at are also indexed together by migration
+    # 0011, for the launch lookup of each exists event.
     instance = models.CharField(max_length=50, null=True,
                                 blank=True, db_index=True)
-    launched_at = models.DecimalField(null=True, max_digits=20,
-                                      decimal_places=6, db_index=True)
+    launched_at = TimestampField(null=True, db_index=True)
     request_id =  models.CharField(max_length=50, null=True,
                                    blank=True, db_index=True)
     instance_type_id =  models.CharField(max_length=50,
@@ -109,12 +169,11 @@ class InstanceUsage(models.Model):
         return raw.deployment
 
 class InstanceDeletes(models.Model):
+    # Indexed together with launched_at by migration 0011, as above.
     instance = models.CharField(max_length=50, null=True,
                                 blank=True, db_index=True)
-    launched_at = models.DecimalField(null=True, max_digits=20,
-                                      decimal_places=6, db_index=True)
-    deleted_at = models.DecimalField(null=True, max_digits=20,
-                                     decimal_places=6, db_index=True)
+    launched_at = TimestampField(null=True, db_index=True)
+    deleted_at = TimestampField(null=True, db_index=True)
     raw = models.ForeignKey(RawData, null=True)
 
 
@@ -123,10 +182,8 @@ class InstanceReconcile(models.Model):
     row_updated = models.DateTimeField(auto_now=True)
     instance = models.CharField(max_length=50, null=True,
                                 blank=True, db_index=True)
-    launched_at = models.DecimalField(null=True, max_digits=20,
-                                      decimal_places=6, db_index=True)
-    deleted_at = models.DecimalField(null=True, max_digits=20,
-                                     decimal_places=6, db_index=True)
+    launched_at = TimestampField(null=True, db_index=True)
+    deleted_at = TimestampField(null=True, db_index=True)
     instance_type_id = models.CharField(max_length=50,
                                         null=True,
                                         blank=True,
@@ -150,23 +207,19 @@ class InstanceExists(models.Model):
     ]
     instance = models.CharField(max_length=50, null=True,
                                 blank=True, db_index=True)
-    launched_at = models.DecimalField(null=True, max_digits=20,
-                                      decimal_places=6, db_index=True)
-    deleted_at = models.DecimalField(null=True, max_digits=20,
-                                     decimal_places=6, db_index=True)
-    audit_period_beginning = models.DecimalField(null=True, max_digits=20,
-                                                 decimal_places=6,
-                                                 db_index=True)
-    audit_period_ending = models.DecimalField(null=True, max_digits=20,
-                                              decimal_places=6, db_index=True)
+    launched_at = TimestampField(null=True, db_index=True)
+    deleted_at = TimestampField(null=True, db_index=True)
+    audit_period_beginning = TimestampField(null=True, db_index=True)
+    audit_period_ending = TimestampField(null=True, db_index=True)
     message_id = models.CharField(max_length=50, null=True,
                                   blank=True, db_index=True)
     instance_type_id = models.CharField(max_length=50,
                                         null=True,
                                         blank=True,
                                         db_index=True)
-    status = models.CharField(max_length=50, db_index=True,
-                              choices=STATUS_CHOICES,
+    # Indexed with audit_period_ending and id, by migration 0015, for
+    # the verifier's queue query.
+    status = models.CharField(max_length=50, choices=STATUS_CHOICES,
                               default=PENDING)
     fail_reason = models.CharField(max_length=300, null=True,
                                    blank=True, db_index=True)
@@ -191,12 +244,47 @@ class Timing(models.Model):
     start_raw = models.ForeignKey(RawData, related_name='+', null=True)
     end_raw = models.ForeignKey(RawData, related_name='+', null=True)
 
-    start_when = models.DecimalField(null=True, max_digits=20,
-                                     decimal_places=6)
-    end_when = models.DecimalField(null=True, max_digits=20, decimal_places=6)
+    start_when = TimestampField(null=True)
+    end_when = TimestampField(null=True)
+
+    diff = TimestampField(null=True, db_index=True)
+
+    # Set between the .start and the .end event. Indexed together with
+    # lifecycle and name by migration 0006.
+    is_open = models.BooleanField(default=False)
+
+
+class TimingSummary(models.Model):
+    """Count, total, min and max of the closed Timings for one
+    operation, deployment and hour. Kept up to date by
+    aggregate_lifecycle so the summary reports don't scan Timing."""
+    name = models.CharField(max_length=50, db_index=True)
+    deployment = models.ForeignKey(Deployment)
+    # Start of the hour, in the same units as RawData.when.
+    hour = TimestampField(db_index=True)
+    count = models.IntegerField(default=0)
+    total = TimestampField(default=0)
+    min = TimestampField(null=True)
+    max = TimestampField(null=True)
+
+    class Meta:
+        unique_together = ('name', 'deployment', 'hour')
+
+
+class TimingSketch(models.Model):
+    """A stacktach.sketch.LatencySketch of the closed Timings for one
+    operation, image, os type, deployment and hour. Sketches merge, so
+    percentiles over any range come from adding these up."""
+    name = models.CharField(max_length=50, db_index=True)
+    deployment = models.ForeignKey(Deployment)
+    hour = TimestampField(db_index=True)
+    # The labels from image_type.labels().
+    image = models.CharField(max_length=10)
+    os_type = models.CharField(max_length=10)
+    sketch = models.TextField()
 
-    diff = models.DecimalField(null=True, max_digits=20, decimal_places=6,
-                               db_index=True)
+    class Meta:
+        unique_together = ('name', 'deployment', 'hour', 'image', 'os_type')
 
 
 class RequestTracker(models.Model):
@@ -206,9 +294,8 @@ class RequestTracker(models.Model):
     request_id = models.CharField(max_length=50, db_index=True)
     lifecycle = models.ForeignKey(Lifecycle)
     last_timing = models.ForeignKey(Timing, null=True, db_index=True)
-    start = models.DecimalField(max_digits=20, decimal_places=6, db_index=True)
-    duration = models.DecimalField(max_digits=20, decimal_places=6,
-                                   db_index=True)
+    start = TimestampField(db_index=True)
+    duration = TimestampField(db_index=True)
 
     # Not used ... but soon hopefully.
     completed = models.BooleanField(default=False, db_index=True)
@@ -219,7 +306,7 @@ class JsonReport(models.Model):
        via stacky/rest. All DateTimes are UTC."""
     period_start = models.DateTimeField(db_index=True)
     period_end = models.DateTimeField(db_index=True)
-    created = models.DecimalField(max_digits=20, decimal_places=6, db_index=True)
+    created = TimestampField(db_index=True)
     name = models.CharField(max_length=50, db_index=True)
     version = models.IntegerField(default=1)
     json = models.TextField()
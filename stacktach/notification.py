@@ -3,31 +3,69 @@ from stacktach import image_type
 
 
 class Notification(object):
+    """The fields StackTach stores for one notification.
+
+    The dict lookups are done once, up front, into slots: that is
+    cheaper in CPython than any per-field lazy property. Only `when`,
+    which needs a timestamp parse, is left until it is first read.
+    Subclasses that store more should extend __slots__ and _parse()."""
+    __slots__ = ('body', 'payload', 'request_id', 'message_id', 'state',
+                 'old_state', 'old_task', 'task', 'image_type', 'publisher',
+                 'event', 'os_architecture', 'os_distro', 'os_version',
+                 'rax_options', 'service', 'host', 'instance', 'tenant',
+                 '_when')
+
     def __init__(self, body):
         self.body = body
+        self._when = None
+        self._parse(body)
+
+    def _parse(self, body):
+        payload = body.get('payload', {})
+        self.payload = payload
         self.request_id = body['_context_request_id']
-        self.payload = body.get('payload', {})
-        self.state = self.payload.get('state', "")
-        self.old_state = self.payload.get('old_state', "")
-        self.old_task = self.payload.get('old_task_state', "")
-        self.task = self.payload.get('new_task_state', "")
-        self.image_type = image_type.get_numeric_code(self.payload)
-        self.publisher = self.body['publisher_id']
-        self.event = self.body['event_type']
-        image_meta = self.payload.get('image_meta', {})
+        self.message_id = body.get('message_id')
+        self.state = payload.get('state', "")
+        self.old_state = payload.get('old_state', "")
+        self.old_task = payload.get('old_task_state', "")
+        self.task = payload.get('new_task_state', "")
+        self.image_type = image_type.get_numeric_code(payload)
+        publisher = body['publisher_id']
+        self.publisher = publisher
+        self.event = body['event_type']
+        image_meta = payload.get('image_meta', {})
         self.os_architecture = image_meta.get('org.openstack__1__architecture',
                                               '')
         self.os_distro = image_meta.get('org.openstack__1__os_distro', '')
         self.os_version = image_meta.get('org.openstack__1__os_version', '')
         self.rax_options = image_meta.get('com.rackspace__1__options', '')
 
+        parts = publisher.split('.', 1)
+        self.service = parts[0]
+        self.host = None
+        if len(parts) > 1:
+            self.host = parts[1]
+
+        # instance UUID's seem to hide in a lot of odd places.
+        instance = payload.get('instance_id', None)
+        instance = payload.get('instance_uuid', instance)
+        if not instance:
+            instance = payload.get('exception', {}).get('kwargs', {}).get('uuid')
+        if not instance:
+            instance = payload.get('instance', {}).get('uuid')
+        self.instance = instance
+
+        tenant = body.get('_context_project_id', None)
+        self.tenant = payload.get('tenant_id', tenant)
+
     @property
     def when(self):
-        when = self.body.get('timestamp', None)
-        if not when:
-            when = self.body['_context_timestamp']  # Old way of doing it
-        when = utils.str_time_to_unix(when)
-        return when
+        if self._when is None:
+            when = self.body.get('timestamp', None)
+            if not when:
+                when = self.body['_context_timestamp']  # Old way of doing it
+            self._when = utils.str_time_to_unix(when)
+        return self._when
 
     def rawdata_kwargs(self, deployment, routing_key, json):
         return {
@@ -47,6 +85,7 @@ class Notification(object):
             'host': self.host,
             'instance': self.instance,
             'request_id': self.request_id,
+            'message_id': self.message_id,
             'tenant': self.tenant,
             'os_architecture': self.os_architecture,
             'os_distro': self.os_distro,
@@ -54,32 +93,18 @@ class Notification(object):
             'rax_options': self.rax_options
         }
 
-    @property
-    def instance(self):
-        # instance UUID's seem to hide in a lot of odd places.
-        instance = self.payload.get('instance_id', None)
-        instance = self.payload.get('instance_uuid', instance)
-        if not instance:
-            instance = self.payload.get('exception', {}).get('kwargs', {}).get('uuid')
-        if not instance:
-            instance = self.payload.get('instance', {}).get('uuid')
-        return instance
 
-    @property
-    def host(self):
-        host = None
-        parts = self.publisher.split('.')
-        if len(parts) > 1:
-            host = ".".join(parts[1:])
-        return host
+class Registry(object):
+    """Builds the Notification for a message body, using the class
+    registered for its event_type or the default one. views.NOTIFICATIONS
+    holds one Registry per routing key."""
+    def __init__(self, default=Notification):
+        self.default = default
+        self.classes = {}
 
-    @property
-    def service(self):
-        parts = self.publisher.split('.')
-        return parts[0]
+    def register(self, event_type, cls):
+        self.classes[event_type] = cls
 
-    @property
-    def tenant(self):
-        tenant = self.body.get('_context_project_id', None)
-        tenant = self.payload.get('tenant_id', tenant)
-        return tenant
+    def __call__(self, body):
+        cls = self.classes.get(body.get('event_type'), self.default)
+        return cls(body)
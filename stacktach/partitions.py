@@ -0,0 +1,245 @@
+# Copyright (c) 2013 - Rackspace Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""Daily or monthly MySQL partitions of RawData.
+
+With RAWDATA_PARTITIONS set to 'daily' or 'monthly' (which needs
+BIGINT_TIMES, so `when` is an integer MySQL can partition on), migration
+0013 partitions stacktach_rawdata by RANGE on `when`. Old rows are then
+removed by dropping whole partitions, which takes moments, instead of a
+DELETE that locks the table for hours. util/manage_partitions.py, run
+daily from cron, creates the partitions ahead of time and drops the
+expired ones.
+
+RawDataImageMeta and RawDataBody have no `when`, so they are
+partitioned by RANGE on raw_id instead (RawDataBody by migration 0014):
+each run closes the open partition at the highest raw id, and a
+partition is only dropped once every RawData row it could refer to is
+gone.
+
+Partitioned tables can't have foreign keys, so the migration drops the
+ones to and from RawData. Rows elsewhere (InstanceExists.raw and so on)
+can outlive the RawData they point at.
+
+MySQL only reads the partitions a query's `when` range can touch, so
+RawData queries that have a time window should say so with bounded().
+"""
+
+import datetime
+
+from django.conf import settings
+from django.db import connection
+
+from stacktach import datetime_to_decimal as dt
+
+SCHEMES = ('daily', 'monthly')
+RAWDATA_TABLE = 'stacktach_rawdata'
+IMAGEMETA_TABLE = 'stacktach_rawdataimagemeta'
+BODY_TABLE = 'stacktach_rawdatabody'
+# Tables partitioned on raw_id, following RawData.
+RAW_ID_TABLES = [IMAGEMETA_TABLE, BODY_TABLE]
+# Catches anything past the last dated partition, so inserts never fail.
+MAXVALUE_PARTITION = 'pmax'
+
+RAWDATA_PARTITIONS = getattr(settings, 'RAWDATA_PARTITIONS', None)
+
+# How far either side of a report's window to look for the rest of a
+# request's events.
+REQUEST_SLACK = 60 * 60 * 24
+
+
+def bounded(query, start, end=None):
+    """Limit a RawData query to start < when <= end, so that on a
+    partitioned table only the partitions for that window are read."""
+    query = query.filter(when__gt=start)
+    if end is not None:
+        query = query.filter(when__lte=end)
+    return query
+
+
+def period_start(when, scheme):
+    if scheme == 'monthly':
+        return datetime.datetime(when.year, when.month, 1)
+    return datetime.datetime(when.year, when.month, when.day)
+
+
+def next_period(start, scheme):
+    if scheme == 'monthly':
+        if start.month == 12:
+            return datetime.datetime(start.year + 1, 1, 1)
+        return datetime.datetime(start.year, start.month + 1, 1)
+    return start + datetime.timedelta(days=1)
+
+
+def previous_period(start, scheme):
+    if scheme == 'monthly':
+        if start.month == 1:
+            return datetime.datetime(start.year - 1, 12, 1)
+        return datetime.datetime(start.year, start.month - 1, 1)
+    return start - datetime.timedelta(days=1)
+
+
+def partition_name(start, scheme):
+    if scheme == 'monthly':
+        return start.strftime('p%Y%m')
+    return start.strftime('p%Y%m%d')
+
+
+def _partition_sql(name, bound):
+    return "PARTITION %s VALUES LESS THAN (%d)" % (name, bound)
+
+
+def _maxvalue_sql():
+    return "PARTITION %s VALUES LESS THAN MAXVALUE" % MAXVALUE_PARTITION
+
+
+class PartitionManager(object):
+    def __init__(self, scheme, cursor=None):
+        if scheme not in SCHEMES:
+            raise ValueError("Partition scheme must be one of %s, not %r" %
+                             (', '.join(SCHEMES), scheme))
+        self.scheme = scheme
+        self.cursor = cursor or connection.cursor()
+
+    def _execute(self, sql, params=None):
+        self.cursor.execute(sql, params or [])
+
+    def partitions(self, table):
+        """[(name, bound)] of table's partitions in order. The bound
+        is None for the MAXVALUE partition."""
+        self._execute("SELECT PARTITION_NAME, PARTITION_DESCRIPTION "
+                      "FROM information_schema.PARTITIONS "
+                      "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s "
+                      "AND PARTITION_NAME IS NOT NULL "
+                      "ORDER BY PARTITION_ORDINAL_POSITION", [table])
+        partitions = []
+        for name, description in self.cursor.fetchall():
+            bound = None
+            if description != 'MAXVALUE':
+                bound = int(description)
+            partitions.append((name, bound))
+        return partitions
+
+    def _periods(self, start, count):
+        periods = []
+        for i in range(count):
+            end = next_period(start, self.scheme)
+            periods.append((partition_name(start, self.scheme),
+                            dt.dt_to_micros(end)))
+            start = end
+        return periods
+
+    def partition_tables(self, now, ahead=7):
+        """Partition both tables, for migration 0013. Existing RawData
+        goes into one partition ending at the start of the current
+        period, which is dropped once all of it has expired."""
+        current = period_start(now, self.scheme)
+        older = partition_name(previous_period(current, self.scheme),
+                               self.scheme)
+        rawdata = [_partition_sql(older, dt.dt_to_micros(current))]
+        rawdata += [_partition_sql(name, bound) for name, bound
+                    in self._periods(current, ahead + 1)]
+        rawdata.append(_maxvalue_sql())
+        self._execute("ALTER TABLE %s DROP PRIMARY KEY, "
+                      "ADD PRIMARY KEY (id, `when`)" % RAWDATA_TABLE)
+        self._execute("ALTER TABLE %s PARTITION BY RANGE (`when`) (%s)" %
+                      (RAWDATA_TABLE, ', '.join(rawdata)))
+
+        self._execute("ALTER TABLE %s DROP PRIMARY KEY, "
+                      "ADD PRIMARY KEY (id, raw_id)" % IMAGEMETA_TABLE)
+        self.partition_by_raw_id(IMAGEMETA_TABLE, now)
+
+    def unpartition_tables(self):
+        for table in [RAWDATA_TABLE, IMAGEMETA_TABLE]:
+            self._execute("ALTER TABLE %s REMOVE PARTITIONING" % table)
+            self._execute("ALTER TABLE %s DROP PRIMARY KEY, "
+                          "ADD PRIMARY KEY (id)" % table)
+
+    def partition_by_raw_id(self, table, now):
+        """Partition one of RAW_ID_TABLES, whose primary key must
+        already include raw_id, with everything so far in one
+        partition."""
+        self._execute("ALTER TABLE %s PARTITION BY RANGE (raw_id) (%s)" %
+                      (table, _maxvalue_sql()))
+        self._close(table, period_start(now, self.scheme))
+
+    def _split_maxvalue(self, table, partitions):
+        new = ', '.join([_partition_sql(name, bound)
+                         for name, bound in partitions] + [_maxvalue_sql()])
+        self._execute("ALTER TABLE %s REORGANIZE PARTITION %s INTO (%s)" %
+                      (table, MAXVALUE_PARTITION, new))
+
+    def _close(self, table, current):
+        """Close the open partition of one of RAW_ID_TABLES at the
+        highest raw id so far, naming it for the current period."""
+        name = partition_name(current, self.scheme)
+        if name in [n for n, bound in self.partitions(table)]:
+            return None
+        self._execute("SELECT MAX(id) FROM %s" % RAWDATA_TABLE)
+        max_id = self.cursor.fetchone()[0] or 0
+        self._split_maxvalue(table, [(name, max_id + 1)])
+        return name
+
+    def create(self, now, ahead=7):
+        """Make sure there are RawData partitions up to ahead periods
+        past the current one. Returns the names of those created."""
+        existing = self.partitions(RAWDATA_TABLE)
+        last = max([bound for name, bound in existing
+                    if bound is not None] or [0])
+        current = period_start(now, self.scheme)
+        new = [(name, bound) for name, bound
+               in self._periods(current, ahead + 1) if bound > last]
+        if new:
+            self._split_maxvalue(RAWDATA_TABLE, new)
+        created = [name for name, bound in new]
+        for table in RAW_ID_TABLES:
+            closed = self._close(table, current)
+            if closed:
+                created.append(closed)
+        return created
+
+    def drop_expired(self, now, keep):
+        """Drop the RawData partitions that end before the start of the
+        period keep periods ago, then the RAW_ID_TABLES ones that only
+        refer to RawData which is gone. Returns the names of those
+        dropped."""
+        cutoff = period_start(now, self.scheme)
+        for i in range(keep):
+            cutoff = previous_period(cutoff, self.scheme)
+        cutoff = dt.dt_to_micros(cutoff)
+        expired = [name for name, bound in self.partitions(RAWDATA_TABLE)
+                   if bound is not None and bound <= cutoff]
+        if expired:
+            self._execute("ALTER TABLE %s DROP PARTITION %s" %
+                          (RAWDATA_TABLE, ', '.join(expired)))
+
+        self._execute("SELECT MIN(id) FROM %s" % RAWDATA_TABLE)
+        min_id = self.cursor.fetchone()[0]
+        dropped = expired
+        if min_id is None:
+            return dropped
+        for table in RAW_ID_TABLES:
+            orphaned = [name for name, bound in self.partitions(table)
+                        if bound is not None and bound <= min_id]
+            if orphaned:
+                self._execute("ALTER TABLE %s DROP PARTITION %s" %
+                              (table, ', '.join(orphaned)))
+            dropped = dropped + orphaned
+        return dropped
@@ -0,0 +1,137 @@
+# Copyright (c) 2013 - Rackspace Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""Mergeable latency sketch used for percentile reports.
+
+Values are counted in logarithmic buckets, each (1 + accuracy) /
+(1 - accuracy) times wider than the one below it, so any quantile is
+answered to within the relative accuracy (1% by default) however many
+values were added. Two sketches with the same accuracy merge by adding
+their bucket counts, which is what lets hourly, per-deployment sketches
+be combined into a report over any range.
+"""
+
+import json
+import math
+
+ACCURACY = 0.01
+
+# Anything shorter than this is counted as zero.
+MIN_VALUE = 1e-6
+
+
+class LatencySketch(object):
+    def __init__(self, accuracy=ACCURACY):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zeros = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def _bucket(self, value):
+        return int(math.ceil(math.log(value) / self.log_gamma))
+
+    def _value(self, bucket):
+        # The point of the bucket with the least relative error.
+        return 2 * self.gamma ** bucket / (self.gamma + 1)
+
+    def add(self, value, count=1):
+        value = float(value)
+        if value < 0:
+            raise ValueError("Can't add negative value %r" % value)
+        if value < MIN_VALUE:
+            self.zeros += count
+        else:
+            bucket = self._bucket(value)
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+        self.count += count
+        self.total += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        if other.accuracy != self.accuracy:
+            raise ValueError("Can't merge sketches with accuracy %r and %r" %
+                             (self.accuracy, other.accuracy))
+        for bucket, count in other.buckets.iteritems():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or
+                                      other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or
+                                      other.max > self.max):
+            self.max = other.max
+
+    def quantile(self, q):
+        """The value below which a fraction q (0 to 1) of the values
+        fall, or None if the sketch is empty."""
+        if not self.count:
+            return None
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if rank < seen:
+            return 0.0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if rank < seen:
+                value = self._value(bucket)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def average(self):
+        if not self.count:
+            return None
+        return self.total / self.count
+
+    def to_json(self):
+        return json.dumps({'accuracy': self.accuracy,
+                           'buckets': self.buckets,
+                           'zeros': self.zeros,
+                           'count': self.count,
+                           'total': self.total,
+                           'min': self.min,
+                           'max': self.max})
+
+    @classmethod
+    def from_json(cls, data):
+        fields = json.loads(data)
+        sketch = cls(accuracy=fields['accuracy'])
+        # json turns the integer keys into strings.
+        sketch.buckets = dict((int(bucket), count) for bucket, count
+                              in fields['buckets'].iteritems())
+        sketch.zeros = fields['zeros']
+        sketch.count = fields['count']
+        sketch.total = fields['total']
+        sketch.min = fields['min']
+        sketch.max = fields['max']
+        return sketch
@@ -2,12 +2,19 @@ import decimal
 import datetime
 import json
 
+from django.db.models import Max
+from django.db.models import Min
 from django.db.models import Q
+from django.db.models import Sum
 from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
 
+import archive
 import datetime_to_decimal as dt
+import fields
 import models
+import partitions
+import sketch
 import utils
 
 SECS_PER_HOUR = 60 * 60
@@ -47,11 +54,11 @@ def get_timings_for_uuid(uuid):
         for t in timings:
             state = "?"
             show_time = 'n/a'
-            if t.start_raw:
+            if t.start_raw_id:
                 state = 'S'
-            if t.end_raw:
+            if t.end_raw_id:
                 state = 'E'
-            if t.start_raw and t.end_raw:
+            if t.start_raw_id and t.end_raw_id:
                 state = "."
                 show_time = sec_to_time(t.diff)
             results.append([state, t.name, show_time])
@@ -115,7 +122,7 @@ def do_uuid(request):
     results = [["#", "?", "When", "Deployment", "Event", "Host", "State",
                 "State'", "Task'"]]
     for e in related:
-        when = dt.dt_from_decimal(e.when)
+        when = dt.dt_from_micros(fields.micros(e, 'when'))
         results.append([e.id, routing_key_type(e.routing_key), str(when),
                         e.deployment.name, e.event, e.host, e.state,
                         e.old_state, e.old_task])
@@ -150,37 +157,104 @@ def do_timings(request):
     return rsp(json.dumps(results))
 
 
+def _hour_window(request, query):
+    """Limit a query of hourly rollups to the hours that overlap the
+    optional end_when_min/end_when_max window."""
+    if request.GET.get('end_when_min') is not None:
+        min_when = decimal.Decimal(request.GET['end_when_min'])
+        min_hour = int(min_when) // SECS_PER_HOUR * SECS_PER_HOUR
+        query = query.filter(hour__gte=min_hour)
+    if request.GET.get('end_when_max') is not None:
+        max_when = decimal.Decimal(request.GET['end_when_max'])
+        query = query.filter(hour__lte=max_when)
+    return query
+
+
+def _summary_row(summary):
+    # Aggregates come back as stored, not through the model fields.
+    num = summary['n']
+    return [int(num), sec_to_time(float(fields.from_db(summary['min']))),
+            sec_to_time(float(fields.from_db(summary['max']))),
+            sec_to_time(int(fields.from_db(summary['total']) / num))]
+
+
 def do_summary(request):
-    events = get_event_names()
-    interesting = []
-    for e in events:
-        ev = e['event']
-        if ev.endswith('.start'):
-            interesting.append(ev[:-len('.start')])
+    summaries = _hour_window(request, models.TimingSummary.objects.all())
+    summaries = summaries.values('name')\
+                         .annotate(n=Sum('count'), total=Sum('total'),
+                                   min=Min('min'), max=Max('max'))\
+                         .order_by('name')
 
     results = [["Event", "N", "Min", "Max", "Avg"]]
+    for summary in summaries:
+        if summary['n']:
+            results.append([summary['name']] + _summary_row(summary))
+    return rsp(json.dumps(results))
 
-    for name in interesting:
-        timings = models.Timing.objects.filter(name=name) \
-                               .exclude(Q(start_raw=None) | Q(end_raw=None)) \
-                               .exclude(diff__lt=0)
-        if not timings:
-            continue
 
-        total, _min, _max = 0.0, None, None
-        num = len(timings)
-        for t in timings:
-            seconds = float(t.diff)
-            total += seconds
-            if _min is None:
-                _min = seconds
-            if _max is None:
-                _max = seconds
-            _min = min(_min, seconds)
-            _max = max(_max, seconds)
-
-        results.append([name, int(num), sec_to_time(_min),
-                        sec_to_time(_max), sec_to_time(int(total / num))])
+def do_timings_hourly(request):
+    name = request.GET['name']
+    summaries = _hour_window(request, models.TimingSummary.objects.all())
+    summaries = summaries.filter(name=name)\
+                         .values('hour', 'deployment__name')\
+                         .annotate(n=Sum('count'), total=Sum('total'),
+                                   min=Min('min'), max=Max('max'))\
+                         .order_by('hour', 'deployment__name')
+
+    results = [["Hour", "Deployment", "N", "Min", "Max", "Avg"]]
+    for summary in summaries:
+        if summary['n']:
+            hour = str(dt.dt_from_decimal(fields.from_db(summary['hour'])))
+            results.append([hour, summary['deployment__name']] +
+                           _summary_row(summary))
+    return rsp(json.dumps(results))
+
+
+def do_timings_percentiles(request):
+    try:
+        percentiles = [float(p) for p in
+                       request.GET.get('percentiles', '50,90,99').split(',')]
+    except ValueError:
+        msg = "percentiles must be a comma separated list of numbers"
+        return error_response(400, 'Bad Request', msg)
+    if [p for p in percentiles if p < 0 or p > 100]:
+        msg = "percentiles must be between 0 and 100"
+        return error_response(400, 'Bad Request', msg)
+
+    sketches = _hour_window(request, models.TimingSketch.objects.all())
+    if request.GET.get('name') is not None:
+        sketches = sketches.filter(name=request.GET['name'])
+    if request.GET.get('deployments') is not None:
+        try:
+            deployments = [int(d) for d in
+                           request.GET['deployments'].split(',')]
+        except ValueError:
+            msg = "deployments must be a comma separated list of ids"
+            return error_response(400, 'Bad Request', msg)
+        sketches = sketches.filter(deployment__in=deployments)
+
+    merged = {}
+    for name, image, os_type, data in sketches.values_list('name', 'image',
+                                                           'os_type',
+                                                           'sketch'):
+        latencies = sketch.LatencySketch.from_json(data)
+        key = (name, image, os_type)
+        if key in merged:
+            merged[key].merge(latencies)
+        else:
+            merged[key] = latencies
+
+    results = [["Event", "Image", "OS Type", "N", "Min", "Max", "Avg"] +
+               ["%g%%" % p for p in percentiles]]
+    for key in sorted(merged):
+        latencies = merged[key]
+        row = list(key) + [latencies.count,
+                           sec_to_time(latencies.min),
+                           sec_to_time(latencies.max),
+                           sec_to_time(latencies.average())]
+        for p in percentiles:
+            row.append(sec_to_time(latencies.quantile(p / 100.0)))
+        results.append(row)
     return rsp(json.dumps(results))
 
 
@@ -195,7 +269,7 @@ def do_request(request):
     results = [["#", "?", "When", "Deployment", "Event", "Host",
                 "State", "State'", "Task'"]]
     for e in events:
-        when = dt.dt_from_decimal(e.when)
+        when = dt.dt_from_micros(fields.micros(e, 'when'))
         results.append([e.id, routing_key_type(e.routing_key), str(when),
                         e.deployment.name, e.event, e.host, e.state,
                         e.old_state, e.old_task])
@@ -208,12 +282,14 @@ def do_show(request, event_id):
     event = None
     try:
         event = models.RawData.objects.get(id=event_id)
-    except models.RawData.ObjectDoesNotExist:
-        return results
+    except models.RawData.DoesNotExist:
+        event = archive.load_rawdata(event_id)
+        if event is None:
+            return results
 
     results.append(["Key", "Value"])
     results.append(["#", event.id])
-    when = dt.dt_from_decimal(event.when)
+    when = dt.dt_from_micros(fields.micros(event, 'when'))
     results.append(["When", str(when)])
     results.append(["Deployment", event.deployment.name])
     results.append(["Category", event.routing_key])
@@ -226,8 +302,11 @@ def do_show(request, event_id):
     results.append(["Req ID", event.request_id])
 
     final = [results, ]
-    j = json.loads(event.json)
-    final.append(json.dumps(j, indent=2))
+    if event.json:
+        j = json.loads(event.json)
+        final.append(json.dumps(j, indent=2))
+    else:
+        final.append("Only the headers of this event were stored.")
     final.append(event.instance)
 
     return rsp(json.dumps(final))
@@ -268,8 +347,7 @@ def do_watch(request, deployment_id):
     else:
         since = now - datetime.timedelta(seconds=2)
         since = dt.dt_to_decimal(since)
-    base_events = base_events.filter(when__gt=since)
-    events = base_events.filter(when__lte=dec_now)
+    events = partitions.bounded(base_events, since, dec_now)
 
     c = [10, 1, 15, 20, max_event_width, 36]
 
@@ -280,7 +358,7 @@ def do_watch(request, deployment_id):
         if not uuid:
             uuid = "-"
         typ = routing_key_type(raw.routing_key)
-        when = dt.dt_from_decimal(raw.when)
+        when = dt.dt_from_micros(fields.micros(raw, 'when'))
         results.append([raw.id, typ,
                        str(when.date()), str(when.time()),
                        deployment_map[raw.deployment.id].name,
@@ -297,7 +375,8 @@ def do_kpi(request, tenant_id=None):
             message = "Could not find raws for tenant %s" % tenant_id
             return error_response(404, 'Not Found', message)
 
-    yesterday = datetime.datetime.utcnow() - datetime.timedelta(days=1)
+    yesterday = datetime.datetime.utcnow() - \
+                datetime.timedelta(seconds=utils.KPI_WINDOW)
     yesterday = dt.dt_to_decimal(yesterday)
     trackers = models.RequestTracker.objects.select_related()\
                                     .exclude(last_timing=None)\
@@ -0,0 +1,80 @@
+# Copyright (c) 2013 - Rackspace Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""Decides how much of each notification gets written to RawData.
+
+A policy is a list of rules, checked in order. The first rule whose
+event_type and routing_key patterns (fnmatch style, both optional)
+match the notification decides what is stored:
+
+    full     the whole notification (the default)
+    headers  only the indexed RawData columns, no json and no image meta
+    sample   1 in every sample_rate matching notifications, in full
+    drop     nothing
+"""
+
+import fnmatch
+
+FULL = 'full'
+HEADERS = 'headers'
+SAMPLE = 'sample'
+DROP = 'drop'
+
+POLICIES = [FULL, HEADERS, SAMPLE, DROP]
+
+
+class StoragePolicy(object):
+    def __init__(self, rules=None):
+        self.rules = []
+        for rule in rules or []:
+            store = rule.get('store', FULL)
+            if store not in POLICIES:
+                raise ValueError("Unknown storage policy '%s'" % store)
+            sample_rate = int(rule.get('sample_rate', 1))
+            if sample_rate < 1:
+                raise ValueError("sample_rate must be at least 1")
+            self.rules.append({'event_type': rule.get('event_type', '*'),
+                               'routing_key': rule.get('routing_key', '*'),
+                               'store': store,
+                               'sample_rate': sample_rate,
+                               'seen': 0})
+
+    def _match(self, routing_key, event):
+        for rule in self.rules:
+            if fnmatch.fnmatchcase(event or '', rule['event_type']) and \
+                    fnmatch.fnmatchcase(routing_key or '',
+                                        rule['routing_key']):
+                return rule
+        return None
+
+    def decide(self, routing_key, event):
+        """Returns FULL, HEADERS or DROP for this notification.
+        Sampling is resolved here, so SAMPLE is never returned."""
+        rule = self._match(routing_key, event)
+        if rule is None:
+            return FULL
+
+        store = rule['store']
+        if store == SAMPLE:
+            rule['seen'] += 1
+            if (rule['seen'] - 1) % rule['sample_rate'] == 0:
+                return FULL
+            return DROP
+        return store
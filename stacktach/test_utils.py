@@ -197,4 +197,6 @@ def create_raw(deployment, when, event, instance=INSTANCE_ID_1,
     }
     raw = RawData(**raw_values)
     raw.save()
+    if json:
+        RawDataBody.create(raw.id, json).save()
     return raw
\ No newline at end of file
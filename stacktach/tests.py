@@ -19,13 +19,41 @@
 # IN THE SOFTWARE.
 
 from datetime import datetime
+import os
+import re
+import tempfile
 import unittest
+
+from django.db import connection
+from django.db.backends import util as backend_util
+from django.test.client import RequestFactory
+from south.db import db as south_db
+
 import db
+from stacktach import stacklog
+from stacktach import stacky_server
+from stacktach import views
 from stacktach.datetime_to_decimal import dt_to_decimal
+from stacktach.models import InstanceExists
+from stacktach.models import Lifecycle
 from stacktach.models import RawDataImageMeta
 from stacktach.models import RawData
+from stacktach.models import RawDataBody
+from stacktach.models import Timing
 from stacktach.models import get_model_fields
 
+# dbverifier opens its log as it is imported.
+stacklog.set_default_logger_location(os.path.join(tempfile.gettempdir(),
+                                                  'stacktach-%s.log'))
+from verifier import dbverifier
+
+UUID = '08f685d9-6352-4dbc-8271-96cc54bf14cd'
+UUID2 = '5ab3f3b5-53a2-4bc4-9b6e-2bc8fd2b27a4'
+REQUEST_ID = 'req-3c45db9b-4b53-4a5c-a5a6-6da6d1e2e6f7'
+# A sort step in sqlite, MySQL or PostgreSQL EXPLAIN output.
+SORTED = re.compile(r'TEMP B-TREE FOR ORDER BY|Using filesort|'
+                    r'^\s*(->\s*)?Sort\b', re.M)
+
 
 class RawDataImageMetaDbTestCase(unittest.TestCase):
     def test_create_raw_data_should_populate_rawdata_and_rawdata_imagemeta(self):
@@ -38,7 +66,8 @@ class RawDataImageMetaDbTestCase(unittest.TestCase):
             'old_task': '', 'task': '', 'image_type': 1,
             'publisher': '', 'event': 'compute.instance.exists',
             'service': '', 'host': '', 'instance': '1234-5678-9012-3456',
-            'request_id': '1234', 'os_architecture': 'x86', 'os_version': '1',
+            'request_id': '1234', 'message_id': '5678',
+            'os_architecture': 'x86', 'os_version': '1',
             'os_distro': 'windows', 'rax_options': '2'}
 
         rawdata = db.create_rawdata(**kwargs)
@@ -48,6 +77,9 @@ class RawDataImageMetaDbTestCase(unittest.TestCase):
                 self.assertEquals(getattr(rawdata, field.name),
                                   kwargs[field.name])
 
+        body = RawDataBody.objects.get(raw_id=rawdata.id)
+        self.assertEquals(body.json, kwargs['json'])
+
         raw_image_meta = RawDataImageMeta.objects.all()[0]
         self.assertEquals(raw_image_meta.raw, rawdata)
         self.assertEquals(raw_image_meta.os_architecture,
@@ -55,3 +87,178 @@ class RawDataImageMetaDbTestCase(unittest.TestCase):
         self.assertEquals(raw_image_meta.os_version, kwargs['os_version'])
         self.assertEquals(raw_image_meta.os_distro, kwargs['os_distro'])
         self.assertEquals(raw_image_meta.rax_options, kwargs['rax_options'])
+
+
+class OverlappingTimingTestCase(unittest.TestCase):
+    """Two overlapping .starts and then an .end close the same Timing
+    whether the timing cache has it or not."""
+    def tearDown(self):
+        views.configure_caches()
+
+    def _aggregate(self, instance, event):
+        deployment = db.get_or_create_deployment('deployment1')[0]
+        raw = db.create_rawdata(
+            deployment=deployment, when=dt_to_decimal(datetime.utcnow()),
+            tenant='1', json='', routing_key='monitor.info',
+            state='active', old_state='', old_task='', task='',
+            image_type=0, publisher='', event=event, service='compute',
+            host='', instance=instance, request_id='req-1')
+        db.transactional(views.aggregate_lifecycle, raw)
+        return raw
+
+    def _overlap(self, instance, evict=False):
+        self._aggregate(instance, 'compute.instance.reboot.start')
+        second = self._aggregate(instance, 'compute.instance.reboot.start')
+        if evict:
+            views.TIMING_CACHE.clear()
+        self._aggregate(instance, 'compute.instance.reboot.end')
+        closed = Timing.objects.get(lifecycle__instance=instance,
+                                    is_open=False)
+        self.assertEqual(closed.start_raw_id, second.id)
+        self.assertEqual(Timing.objects.filter(lifecycle__instance=instance,
+                                               is_open=True).count(), 1)
+
+    def test_without_cache(self):
+        self._overlap('overlap-1')
+
+    def test_with_cache(self):
+        views.configure_caches(timing_cache_size=10)
+        self._overlap('overlap-2')
+
+    def test_with_cache_evicted(self):
+        views.configure_caches(timing_cache_size=10)
+        self._overlap('overlap-3', evict=True)
+
+
+class _CapturingCursor(backend_util.CursorWrapper):
+    def execute(self, sql, params=()):
+        self.db.captured.append((sql, params))
+        return self.cursor.execute(sql, params)
+
+
+class HotQueryPlanTestCase(unittest.TestCase):
+    """Run each hot query through the code that sends it, EXPLAIN the
+    SQL it ran and check it uses the index built for it. The plan is
+    in the failure message."""
+    def setUp(self):
+        self.cursor = connection.cursor()
+        if connection.vendor == 'postgresql':
+            # Otherwise an empty table is always read sequentially.
+            self.cursor.execute('SET enable_seqscan = off')
+        self.now = dt_to_decimal(datetime.utcnow())
+        self.deployment = db.get_or_create_deployment('deployment1')[0]
+        self.requests = RequestFactory()
+
+    def tearDown(self):
+        if connection.vendor == 'postgresql':
+            self.cursor.execute('SET enable_seqscan = on')
+
+    def _queries(self, table, func, *args):
+        """Call func(*args) and return the SQL and params of each query
+        it ran against table with a WHERE clause."""
+        connection.captured = []
+        connection.make_debug_cursor = \
+            lambda cursor: _CapturingCursor(cursor, connection)
+        connection.use_debug_cursor = True
+        try:
+            func(*args)
+        finally:
+            connection.use_debug_cursor = None
+        table = connection.ops.quote_name(table)
+        return [(sql, params) for sql, params in connection.captured
+                if ('FROM %s' % table) in sql and 'WHERE' in sql]
+
+    def _plan(self, sql, params):
+        explain = 'EXPLAIN '
+        if connection.vendor == 'sqlite':
+            explain = 'EXPLAIN QUERY PLAN '
+        self.cursor.execute(explain + sql, params)
+        # MySQL names the index under key, or possible_keys if it picks
+        # none for an empty table; the others in the plan text.
+        return '\n'.join(' '.join(str(column) for column in row)
+                          for row in self.cursor.fetchall())
+
+    def assertUsesIndex(self, table, columns, func, *args, **kwargs):
+        """Check every query func(*args) runs on table uses the index on
+        columns and, unless sorts is set, returns rows in the order
+        asked for without sorting them."""
+        name = south_db.create_index_name(table, columns)
+        queries = self._queries(table, func, *args)
+        self.assertTrue(queries, "No query on %s" % table)
+        for sql, params in queries:
+            plan = self._plan(sql, params)
+            self.assertTrue(name in plan,
+                            "%s not used by:\n%s\nPlan:\n%s" %
+                            (name, sql, plan))
+            if not kwargs.get('sorts'):
+                self.assertFalse(SORTED.search(plan),
+                                 "Sorted by:\n%s\nPlan:\n%s" % (sql, plan))
+
+    def _raw(self, event='compute.instance.update'):
+        return db.create_rawdata(
+            deployment=self.deployment, when=self.now, tenant='1',
+            json='', routing_key='monitor.info', state='active',
+            old_state='', old_task='', task='', image_type=0,
+            publisher='', event=event, service='compute', host='',
+            instance=UUID, request_id=REQUEST_ID)
+
+    def test_uuid(self):
+        request = self.requests.get('/stacky/uuid/', {'uuid': UUID})
+        self.assertUsesIndex('stacktach_rawdata', ['instance', 'when'],
+                             stacky_server.do_uuid, request)
+
+    def test_request(self):
+        request = self.requests.get('/stacky/request/',
+                                    {'request_id': REQUEST_ID})
+        self.assertUsesIndex('stacktach_rawdata', ['request_id', 'when'],
+                             stacky_server.do_request, request)
+
+    def test_watch(self):
+        # do_watch sizes its columns from the event names, so it needs
+        # at least one.
+        self._raw()
+        request = self.requests.get('/stacky/watch/1/')
+        self.assertUsesIndex('stacktach_rawdata', ['deployment_id', 'when'],
+                             stacky_server.do_watch, request,
+                             str(self.deployment.id))
+
+    def test_watch_event(self):
+        self._raw()
+        request = self.requests.get('/stacky/watch/0/',
+                                    {'event_name': 'compute.instance.update'})
+        self.assertUsesIndex('stacktach_rawdata', ['event', 'when'],
+                             stacky_server.do_watch, request, '0')
+
+    def test_latest_raw(self):
+        request = self.requests.get('/%s/latest_raw' % self.deployment.id)
+        request.session = {}
+        self.assertUsesIndex('stacktach_rawdata', ['deployment_id', 'when'],
+                             views.latest_raw, request,
+                             str(self.deployment.id))
+
+    def test_find_open_timing(self):
+        lifecycle = Lifecycle(instance=UUID)
+        lifecycle.save()
+        self.assertUsesIndex('stacktach_timing',
+                             ['lifecycle_id', 'name', 'is_open'],
+                             db.find_open_timing, 'compute.instance.reboot',
+                             lifecycle)
+
+    def test_find_instance_usages(self):
+        launches = set([(UUID, self.now), (UUID2, self.now - 3600)])
+        self.assertUsesIndex('stacktach_instanceusage',
+                             ['instance', 'launched_at'],
+                             lambda: list(db.find_instance_usages(launches)),
+                             sorts=True)
+        self.assertUsesIndex('stacktach_instancedeletes',
+                             ['instance', 'launched_at'],
+                             lambda: list(db.find_instance_deletes(launches)),
+                             sorts=True)
+
+    def test_verifier_list_exists(self):
+        # The slice verify_for_range() takes of it.
+        exists = dbverifier._list_exists(ending_max=datetime.utcnow(),
+                                         status=InstanceExists.PENDING)
+        self.assertUsesIndex('stacktach_instanceexists',
+                             ['status', 'audit_period_ending', 'id'],
+                             lambda: list(exists[0:1000]))
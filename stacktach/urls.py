@@ -10,6 +10,10 @@ urlpatterns = patterns('',
     url(r'stacky/uuid/$', 'stacktach.stacky_server.do_uuid'),
     url(r'stacky/timings/$', 'stacktach.stacky_server.do_timings'),
     url(r'stacky/timings/uuid/$', 'stacktach.stacky_server.do_timings_uuid'),
+    url(r'stacky/timings/hourly/$',
+        'stacktach.stacky_server.do_timings_hourly'),
+    url(r'stacky/timings/percentiles/$',
+        'stacktach.stacky_server.do_timings_percentiles'),
     url(r'stacky/summary/$', 'stacktach.stacky_server.do_summary'),
     url(r'stacky/request/$', 'stacktach.stacky_server.do_request'),
     url(r'stacky/reports/$', 'stacktach.stacky_server.do_jsonreports'),
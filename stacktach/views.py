@@ -1,21 +1,29 @@
 # Copyright 2012 - Dark Secret Software Inc.
 
 import datetime
+import decimal
 import json
 import pprint
 
 from django import db
 from django.shortcuts import render_to_response
 
+from stacktach import archive
+from stacktach import cache
 from stacktach import datetime_to_decimal as dt
 from stacktach import db as stackdb
+from stacktach import image_type
 from stacktach import models
+from stacktach import notification
+from stacktach import partitions
 from stacktach import stacklog
+from stacktach import storage_policy
 from stacktach import utils
-from stacktach.notification import Notification
 
 STACKDB = stackdb
 
+SECS_PER_HOUR = 60 * 60
+
 
 def log_warn(msg):
     global LOG
@@ -28,8 +36,135 @@ def log_warn(msg):
 # routing_key : handler
 
 NOTIFICATIONS = {
-    'monitor.info': Notification,
-    'monitor.error': Notification}
+    'monitor.info': notification.Registry(),
+    'monitor.error': notification.Registry()}
+
+
+def register_notification(event_type, cls, routing_keys=None):
+    """Parse event_type notifications with cls, a Notification
+    subclass, on routing_keys or on every routing key."""
+    if routing_keys is None:
+        routing_keys = NOTIFICATIONS.keys()
+    for routing_key in routing_keys:
+        NOTIFICATIONS[routing_key].register(event_type, cls)
+
+# Set by the worker from its deployment config.
+STORAGE_POLICY = storage_policy.StoragePolicy()
+
+# instance -> Lifecycle write-back cache, see configure_caches().
+LIFECYCLE_CACHE = None
+TIMING_CACHE = None
+TRACKER_CACHE = None
+NO_TRACKER_CACHE = None
+USAGE_CACHE = None
+# Exists events waiting to be stored together, see flush_exists().
+PENDING_EXISTS = None
+EXISTS_BATCH_SIZE = 0
+
+
+def _update(obj):
+    STACKDB.update(obj)
+
+
+def configure_caches(lifecycle_cache_size=0, lifecycle_cache_ttl=300,
+                     lifecycle_flush_interval=0, timing_cache_size=0,
+                     timing_cache_ttl=300, tracker_cache_size=0,
+                     tracker_negative_ttl=60, usage_cache_size=0,
+                     usage_cache_ttl=300, exists_batch_size=0):
+    """Set up the aggregation caches. Only safe when post_process is
+    called from a single thread. A size of 0 turns a cache off."""
+    global LIFECYCLE_CACHE, TIMING_CACHE, TRACKER_CACHE, NO_TRACKER_CACHE
+    global USAGE_CACHE, PENDING_EXISTS, EXISTS_BATCH_SIZE
+    LIFECYCLE_CACHE = None
+    if lifecycle_cache_size:
+        LIFECYCLE_CACHE = cache.WriteBackCache(
+            lifecycle_cache_size, ttl=lifecycle_cache_ttl,
+            flush_interval=lifecycle_flush_interval, save=_update)
+    TIMING_CACHE = None
+    if timing_cache_size:
+        # (instance, operation) -> the open Timing. Timings are saved
+        # as they change, so there is nothing to write back.
+        TIMING_CACHE = cache.LRUCache(timing_cache_size,
+                                      ttl=timing_cache_ttl)
+    TRACKER_CACHE = None
+    NO_TRACKER_CACHE = None
+    if tracker_cache_size:
+        # Trackers older than the kpi window aren't reported any more,
+        # so there is no point keeping them longer than that.
+        TRACKER_CACHE = cache.LRUCache(tracker_cache_size,
+                                       ttl=utils.KPI_WINDOW)
+        # request_ids with no tracker. Kept briefly, since the api
+        # event may still be on its way through another worker.
+        NO_TRACKER_CACHE = cache.LRUCache(tracker_cache_size,
+                                          ttl=tracker_negative_ttl)
+    USAGE_CACHE = None
+    if usage_cache_size:
+        # (instance, request_id) -> InstanceUsage. Changes are written
+        # through, so like the timing cache nothing is held back.
+        USAGE_CACHE = cache.LRUCache(usage_cache_size, ttl=usage_cache_ttl)
+    PENDING_EXISTS = None
+    EXISTS_BATCH_SIZE = exists_batch_size
+    if exists_batch_size:
+        PENDING_EXISTS = []
+
+
+def flush_caches(force=False):
+    """Save the changes the caches are holding back. Call it inside the
+    transaction that made them; force ignores the flush interval."""
+    flush_exists()
+    if LIFECYCLE_CACHE is not None:
+        LIFECYCLE_CACHE.flush(force=force)
+
+
+def caches_due():
+    """Whether flush_caches() has anything to save now, so an idle
+    worker can skip opening a transaction for it."""
+    if PENDING_EXISTS:
+        return True
+    return LIFECYCLE_CACHE is not None and LIFECYCLE_CACHE.due()
+
+
+def commit_caches():
+    """Called when a transaction commits. The Lifecycle changes it made
+    are now safe to keep across a later rollback."""
+    if LIFECYCLE_CACHE is not None:
+        LIFECYCLE_CACHE.commit()
+
+
+def reset_caches():
+    """Forget everything cached, and the unsaved changes made by the
+    failed transaction. Called when a transaction is rolled back, since
+    cached objects may refer to rows that no longer exist. Lifecycle
+    changes from transactions that committed are still written back."""
+    if LIFECYCLE_CACHE is not None:
+        LIFECYCLE_CACHE.rollback()
+    if TIMING_CACHE is not None:
+        TIMING_CACHE.clear()
+    if TRACKER_CACHE is not None:
+        TRACKER_CACHE.clear()
+        NO_TRACKER_CACHE.clear()
+    if USAGE_CACHE is not None:
+        USAGE_CACHE.clear()
+    if PENDING_EXISTS is not None:
+        del PENDING_EXISTS[:]
+
+
+stackdb.COMMIT_HOOKS.append(commit_caches)
+stackdb.ROLLBACK_HOOKS.append(reset_caches)
+
+
+def cache_stats():
+    stats = {}
+    if LIFECYCLE_CACHE is not None:
+        stats['lifecycle_cache'] = LIFECYCLE_CACHE.stats()
+    if TIMING_CACHE is not None:
+        stats['timing_cache'] = TIMING_CACHE.stats()
+    if TRACKER_CACHE is not None:
+        stats['tracker_cache'] = TRACKER_CACHE.stats()
+        stats['no_tracker_cache'] = NO_TRACKER_CACHE.stats()
+    if USAGE_CACHE is not None:
+        stats['usage_cache'] = USAGE_CACHE.stats()
+    return stats
 
 
 def start_kpi_tracking(lifecycle, raw):
@@ -47,6 +182,29 @@ def start_kpi_tracking(lifecycle, raw):
                                              last_timing=None,
                                              duration=str(0.0))
     STACKDB.save(tracker)
+    if TRACKER_CACHE is not None:
+        TRACKER_CACHE.put(raw.request_id, tracker)
+        NO_TRACKER_CACHE.pop(raw.request_id)
+
+
+def _find_request_tracker(request_id):
+    if TRACKER_CACHE is not None:
+        tracker = TRACKER_CACHE.get(request_id)
+        if tracker is not None:
+            return tracker
+        if NO_TRACKER_CACHE.get(request_id):
+            return None
+
+    trackers = STACKDB.find_request_trackers(request_id=request_id)
+    if len(trackers) == 0:
+        if NO_TRACKER_CACHE is not None:
+            NO_TRACKER_CACHE.put(request_id, True)
+        return None
+
+    tracker = trackers[0]
+    if TRACKER_CACHE is not None:
+        TRACKER_CACHE.put(request_id, tracker)
+    return tracker
 
 
 def update_kpi(timing, raw):
@@ -60,16 +218,30 @@ def update_kpi(timing, raw):
 
     Until then, we'll take the lazy route and be aware of these
     potential fence-post issues."""
-    trackers = STACKDB.find_request_trackers(request_id=raw.request_id)
-    if len(trackers) == 0:
+    tracker = _find_request_tracker(raw.request_id)
+    if tracker is None:
         return
 
-    tracker = trackers[0]
     tracker.last_timing = timing
     tracker.duration = timing.end_when - tracker.start
     STACKDB.save(tracker)
 
 
+def update_timing_summary(timing, raw):
+    """Add a closed Timing to the hourly rollups used by the stacky
+    summary and percentile reports."""
+    if timing.diff < 0:
+        # Clock skew between hosts, the reports skip these.
+        return
+    hour = int(timing.end_when) // SECS_PER_HOUR * SECS_PER_HOUR
+    hour = decimal.Decimal(hour)
+    STACKDB.add_to_timing_summary(timing.name, raw.deployment_id, hour,
+                                  timing.diff)
+    image, os_type = image_type.labels(raw.image_type)
+    STACKDB.add_to_timing_sketch(timing.name, raw.deployment_id, hour,
+                                 image, os_type, timing.diff)
+
+
 def aggregate_lifecycle(raw):
     """Roll up the raw event into a Lifecycle object
     and a bunch of Timing objects.
@@ -83,18 +255,35 @@ def aggregate_lifecycle(raw):
     if not raw.instance:
         return
 
-    # While we hope only one lifecycle ever exists it's quite
-    # likely we get multiple due to the workers and threads.
+    if (LIFECYCLE_CACHE is not None or TIMING_CACHE is not None or
+            TRACKER_CACHE is not None):
+        # The cached Lifecycles, Timings and trackers keep raw, so don't
+        # let them keep the body create_rawdata left on it as well.
+        # raw.json reads it back if it is needed.
+        raw.json = None
+
     lifecycle = None
-    lifecycles = STACKDB.find_lifecycles(instance=raw.instance)
-    if len(lifecycles) > 0:
-        lifecycle = lifecycles[0]
+    if LIFECYCLE_CACHE is not None:
+        lifecycle = LIFECYCLE_CACHE.get(raw.instance)
+    if not lifecycle:
+        # While we hope only one lifecycle ever exists it's quite
+        # likely we get multiple due to the workers and threads.
+        lifecycles = STACKDB.find_lifecycles(instance=raw.instance)
+        if len(lifecycles) > 0:
+            lifecycle = lifecycles[0]
     if not lifecycle:
         lifecycle = STACKDB.create_lifecycle(instance=raw.instance)
     lifecycle.last_raw = raw
     lifecycle.last_state = raw.state
     lifecycle.last_task_state = raw.old_task
-    STACKDB.save(lifecycle)
+    if LIFECYCLE_CACHE is not None and lifecycle.id:
+        # Only the last_* columns changed, let the cache coalesce it.
+        LIFECYCLE_CACHE.mark_dirty(raw.instance, lifecycle)
+    else:
+        # New lifecycles are saved now, Timings need the id.
+        STACKDB.save(lifecycle)
+    if LIFECYCLE_CACHE is not None:
+        LIFECYCLE_CACHE.put(raw.instance, lifecycle)
 
     event = raw.event
     parts = event.split('.')
@@ -110,22 +299,20 @@ def aggregate_lifecycle(raw):
     # through, but that's not as easy as it seems since we don't
     # have a unique key for each request (request_id won't work
     # since the call could come multiple times via a retry loop).
-    # So, we're just going to look for Timing objects that have
-    # start_raw but no end_raw. This could give incorrect data
-    # when/if we get two overlapping foo.start calls (which
-    # *shouldn't* happen).
+    # So, we're just going to look for the newest Timing that is still
+    # open (has seen a .start but no .end). This could give incorrect
+    # data when/if we get two overlapping foo.start calls (which
+    # *shouldn't* happen). The timing cache holds the newest one too, so
+    # the cache doesn't change which Timing a .end closes.
     start = step == 'start'
+    key = (raw.instance, name)
     timing = None
-    timings = STACKDB.find_timings(name=name, lifecycle=lifecycle)
     if not start:
-        for t in timings:
-            try:
-                if t.end_raw == None and t.start_raw != None:
-                    timing = t
-                    break
-            except models.RawData.DoesNotExist:
-                # Our raw data was removed.
-                pass
+        if TIMING_CACHE is not None:
+            timing = TIMING_CACHE.get(key)
+            TIMING_CACHE.pop(key)
+        if timing is None:
+            timing = STACKDB.find_open_timing(name=name, lifecycle=lifecycle)
 
     if timing is None:
         timing = STACKDB.create_timing(name=name, lifecycle=lifecycle)
@@ -143,16 +330,21 @@ def aggregate_lifecycle(raw):
 
         timing.diff_when = None
         timing.diff_ms = 0
+        timing.is_open = True
     else:
         timing.end_raw = raw
         timing.end_when = raw.when
+        timing.is_open = False
 
         # We could have missed start so watch out ...
         if timing.start_when:
             timing.diff = timing.end_when - timing.start_when
             # Looks like a valid pair ...
             update_kpi(timing, raw)
+            update_timing_summary(timing, raw)
     STACKDB.save(timing)
+    if start and TIMING_CACHE is not None:
+        TIMING_CACHE.put(key, timing)
 
 
 INSTANCE_EVENT = {
@@ -170,13 +362,43 @@ INSTANCE_EVENT = {
 }
 
 
+# The InstanceUsage columns the usage events fill in.
+USAGE_FIELDS = ['launched_at', 'instance_type_id', 'tenant', 'rax_options',
+                'os_architecture', 'os_version', 'os_distro']
+
+
+def _get_instance_usage(instance, request_id):
+    key = (instance, request_id)
+    if USAGE_CACHE is not None:
+        usage = USAGE_CACHE.get(key)
+        if usage is not None:
+            return usage
+
+    (usage, new) = STACKDB.get_or_create_instance_usage(instance=instance,
+                                                        request_id=request_id)
+    if USAGE_CACHE is not None:
+        USAGE_CACHE.put(key, usage)
+    return usage
+
+
+def _usage_values(usage):
+    return dict((field, getattr(usage, field)) for field in USAGE_FIELDS)
+
+
+def _save_instance_usage(usage, saved):
+    """Write the columns that differ from saved, the values usage had
+    when it was read, if any do."""
+    changed = [field for field in USAGE_FIELDS
+               if getattr(usage, field) != saved[field]]
+    if changed:
+        STACKDB.update_fields(usage, changed)
+
+
 def _process_usage_for_new_launch(raw, body):
     payload = body['payload']
-    values = {}
-    values['instance'] = payload['instance_id']
-    values['request_id'] = body['_context_request_id']
-
-    (usage, new) = STACKDB.get_or_create_instance_usage(**values)
+    usage = _get_instance_usage(payload['instance_id'],
+                                body['_context_request_id'])
+    saved = _usage_values(usage)
 
     if raw.event in [INSTANCE_EVENT['create_start'],
                      INSTANCE_EVENT['rebuild_start']]:
@@ -199,7 +421,7 @@ def _process_usage_for_new_launch(raw, body):
                                            '')
     usage.os_version = image_meta.get('org.openstack__1__os_version', '')
     usage.os_distro = image_meta.get('org.openstack__1__os_distro', '')
-    STACKDB.save(usage)
+    _save_instance_usage(usage, saved)
 
 
 def _process_usage_for_updates(raw, body):
@@ -209,10 +431,9 @@ def _process_usage_for_updates(raw, body):
         if 'message' in payload and payload['message'] != 'Success':
             return
 
-    instance_id = payload['instance_id']
-    request_id = body['_context_request_id']
-    (usage, new) = STACKDB.get_or_create_instance_usage(instance=instance_id,
-                                                        request_id=request_id)
+    usage = _get_instance_usage(payload['instance_id'],
+                                body['_context_request_id'])
+    saved = _usage_values(usage)
 
     if raw.event in [INSTANCE_EVENT['create_end'],
                      INSTANCE_EVENT['rebuild_end'],
@@ -233,7 +454,7 @@ def _process_usage_for_updates(raw, body):
     usage.os_version = image_meta.get('org.openstack__1__os_version', '')
     usage.os_distro = image_meta.get('org.openstack__1__os_distro', '')
 
-    STACKDB.save(usage)
+    _save_instance_usage(usage, saved)
 
 
 def _process_delete(raw, body):
@@ -255,53 +476,120 @@ def _process_delete(raw, body):
     STACKDB.save(delete)
 
 
-def _process_exists(raw, body):
+def _exists_values(raw, body):
+    """The InstanceExists columns for an exists event, without its
+    usage and delete, or None if it has no launched_at."""
     payload = body['payload']
-    instance_id = payload['instance_id']
     launched_at_str = payload.get('launched_at')
-    if launched_at_str is not None and launched_at_str != '':
-        launched_at = utils.str_time_to_unix(payload['launched_at'])
-        launched_range = (launched_at, launched_at+1)
-        usage = STACKDB.get_instance_usage(instance=instance_id,
-                                           launched_at__range=launched_range)
-        values = {}
-        values['message_id'] = body['message_id']
-        values['instance'] = instance_id
-        values['launched_at'] = launched_at
-        beginning = utils.str_time_to_unix(payload['audit_period_beginning'])
-        values['audit_period_beginning'] = beginning
-        ending = utils.str_time_to_unix(payload['audit_period_ending'])
-        values['audit_period_ending'] = ending
-        values['instance_type_id'] = payload['instance_type_id']
+    if launched_at_str is None or launched_at_str == '':
+        stacklog.warn("Ignoring exists without launched_at. RawData(%s)" %
+                      raw.id)
+        return None
+
+    values = {}
+    values['message_id'] = body['message_id']
+    values['instance'] = payload['instance_id']
+    values['launched_at'] = utils.str_time_to_unix(launched_at_str)
+    beginning = utils.str_time_to_unix(payload['audit_period_beginning'])
+    values['audit_period_beginning'] = beginning
+    ending = utils.str_time_to_unix(payload['audit_period_ending'])
+    values['audit_period_ending'] = ending
+    values['instance_type_id'] = payload['instance_type_id']
+    values['raw'] = raw
+    values['tenant'] = payload['tenant_id']
+    image_meta = payload.get('image_meta', {})
+    values['rax_options'] = image_meta.get('com.rackspace__1__options', '')
+    os_arch = image_meta.get('org.openstack__1__architecture', '')
+    values['os_architecture'] = os_arch
+    os_version = image_meta.get('org.openstack__1__os_version', '')
+    values['os_version'] = os_version
+    values['os_distro'] = image_meta.get('org.openstack__1__os_distro', '')
+
+    deleted_at = payload.get('deleted_at')
+    if deleted_at and deleted_at != '':
+        # We only want to pre-populate the 'delete' if we know this is in
+        #     fact an exist event for a deleted instance. Otherwise, there
+        #     is a chance we may populate it for a previous period's exist.
+        values['deleted_at'] = utils.str_time_to_unix(deleted_at)
+    return values
+
+
+def _process_exists(raw, body):
+    values = _exists_values(raw, body)
+    if values is None:
+        return
+
+    if PENDING_EXISTS is not None:
+        PENDING_EXISTS.append(values)
+        if len(PENDING_EXISTS) >= EXISTS_BATCH_SIZE:
+            flush_exists()
+        return
+
+    instance_id = values['instance']
+    launched_at = values['launched_at']
+    launched_range = (launched_at, launched_at+1)
+    usage = STACKDB.get_instance_usage(instance=instance_id,
+                                       launched_at__range=launched_range)
+    if usage:
+        values['usage'] = usage
+
+    if 'deleted_at' in values:
+        filter = {'instance': instance_id,
+                  'launched_at__range': launched_range}
+        delete = STACKDB.get_instance_delete(**filter)
+        if delete:
+            values['delete'] = delete
+
+    exists = STACKDB.create_instance_exists(**values)
+    STACKDB.save(exists)
+
+
+def _match_launch(rows, values):
+    """The first of rows (from one batched query) for the instance of
+    values and launched within a second of it."""
+    launched_at = values['launched_at']
+    for row in rows.get(values['instance'], []):
+        if launched_at <= row.launched_at <= launched_at + 1:
+            return row
+    return None
+
+
+def _group_by_instance(rows):
+    grouped = {}
+    for row in rows:
+        grouped.setdefault(row.instance, []).append(row)
+    return grouped
+
+
+def flush_exists():
+    """Store the pending exists events with one query for their usages,
+    one for their deletes and one insert."""
+    if not PENDING_EXISTS:
+        return
+    pending = PENDING_EXISTS[:]
+    del PENDING_EXISTS[:]
+
+    launches = set((values['instance'], values['launched_at'])
+                   for values in pending)
+    usages = _group_by_instance(STACKDB.find_instance_usages(launches))
+
+    deletes = {}
+    deleted = set((values['instance'], values['launched_at'])
+                  for values in pending if 'deleted_at' in values)
+    if deleted:
+        deletes = _group_by_instance(STACKDB.find_instance_deletes(deleted))
+
+    exists = []
+    for values in pending:
+        usage = _match_launch(usages, values)
         if usage:
             values['usage'] = usage
-        values['raw'] = raw
-        values['tenant'] = payload['tenant_id']
-        image_meta = payload.get('image_meta', {})
-        values['rax_options'] = image_meta.get('com.rackspace__1__options', '')
-        os_arch = image_meta.get('org.openstack__1__architecture', '')
-        values['os_architecture'] = os_arch
-        os_version = image_meta.get('org.openstack__1__os_version', '')
-        values['os_version'] = os_version
-        values['os_distro'] = image_meta.get('org.openstack__1__os_distro', '')
-
-        deleted_at = payload.get('deleted_at')
-        if deleted_at and deleted_at != '':
-            # We only want to pre-populate the 'delete' if we know this is in
-            #     fact an exist event for a deleted instance. Otherwise, there
-            #     is a chance we may populate it for a previous period's exist.
-            filter = {'instance': instance_id,
-                      'launched_at__range': launched_range}
-            delete = STACKDB.get_instance_delete(**filter)
-            deleted_at = utils.str_time_to_unix(deleted_at)
-            values['deleted_at'] = deleted_at
+        if 'deleted_at' in values:
+            delete = _match_launch(deletes, values)
             if delete:
                 values['delete'] = delete
-
-        exists = STACKDB.create_instance_exists(**values)
-        STACKDB.save(exists)
-    else:
-        stacklog.warn("Ignoring exists without launched_at. RawData(%s)" % raw.id)
+        exists.append(STACKDB.create_instance_exists(**values))
+    STACKDB.create_instance_exists_batch(exists)
 
 
 USAGE_PROCESS_MAPPING = {
@@ -324,24 +612,99 @@ def aggregate_usage(raw, body):
         return
 
     if raw.event in USAGE_PROCESS_MAPPING:
+        if raw.event != INSTANCE_EVENT['exists']:
+            # Pending exists may be waiting on a usage or delete this
+            # event is about to change.
+            flush_exists()
         USAGE_PROCESS_MAPPING[raw.event](raw, body)
 
 
+def _apply_storage_policy(routing_key, values):
+    event = values.get('event')
+    # Usage events are billing records, they are always kept whole.
+    if event in USAGE_PROCESS_MAPPING:
+        return values
+
+    store = STORAGE_POLICY.decide(routing_key, event)
+    if store == storage_policy.DROP:
+        return None
+    if store == storage_policy.HEADERS:
+        values = dict((k, v) for k, v in values.iteritems()
+                      if k not in stackdb.IMAGEMETA_FIELDS)
+        values['json'] = ''
+    return values
+
+
+def _rawdata_values(deployment, routing_key, body, json_args):
+    notification = NOTIFICATIONS[routing_key](body)
+    if not notification:
+        return None
+    values = notification.rawdata_kwargs(deployment, routing_key, json_args)
+    if not values:
+        return None
+    return _apply_storage_policy(routing_key, values)
+
+
 def process_raw_data(deployment, args, json_args):
     """This is called directly by the worker to add the event to the db."""
     db.reset_queries()
 
     routing_key, body = args
     record = None
-    notification = NOTIFICATIONS[routing_key](body)
-    if notification:
-        values = notification.rawdata_kwargs(deployment, routing_key, json_args)
-        if not values:
-            return record
+    values = _rawdata_values(deployment, routing_key, body, json_args)
+    if values:
         record = STACKDB.create_rawdata(**values)
     return record
 
 
+def _skip_stored(deployment, values_list, positions):
+    message_ids = [v['message_id'] for v in values_list
+                   if v.get('message_id')]
+    seen = STACKDB.find_stored_message_ids(deployment, message_ids)
+    kept_values = []
+    kept_positions = []
+    for values, index in zip(values_list, positions):
+        message_id = values.get('message_id')
+        if message_id and message_id in seen:
+            continue
+        if message_id:
+            seen.add(message_id)
+        kept_values.append(values)
+        kept_positions.append(index)
+    return kept_values, kept_positions
+
+
+def process_raw_data_batch(deployment, messages, skip_stored=False):
+    """Batched version of process_raw_data(). messages is a list of
+    (args, json_args) tuples. Returns a list the same length as messages
+    holding the stored RawData, or None for skipped messages.
+
+    With skip_stored, messages whose message_id is already stored for
+    this deployment (or repeated earlier in the batch) are skipped, so a
+    batch can safely be replayed."""
+    db.reset_queries()
+
+    values_list = []
+    positions = []
+    for index, (args, json_args) in enumerate(messages):
+        routing_key, body = args
+        values = _rawdata_values(deployment, routing_key, body, json_args)
+        if values:
+            values_list.append(values)
+            positions.append(index)
+
+    if skip_stored and values_list:
+        values_list, positions = _skip_stored(deployment, values_list,
+                                              positions)
+
+    records = [None] * len(messages)
+    if values_list:
+        raws = STACKDB.create_rawdata_batch(values_list)
+        for index, raw in zip(positions, raws):
+            records[index] = raw
+    return records
+
+
 def post_process(raw, body):
     aggregate_lifecycle(raw)
     aggregate_usage(raw, body)
@@ -416,10 +779,18 @@ def details(request, deployment_id, column, row_id):
 
 def expand(request, deployment_id, row_id):
     c = _default_context(request, deployment_id)
-    row = models.RawData.objects.get(pk=row_id)
-    payload = json.loads(row.json)
-    pp = pprint.PrettyPrinter()
-    c['payload'] = pp.pformat(payload)
+    try:
+        row = models.RawData.objects.get(pk=row_id)
+    except models.RawData.DoesNotExist:
+        row = archive.load_rawdata(row_id)
+        if row is None:
+            raise
+    if row.json:
+        payload = json.loads(row.json)
+        pp = pprint.PrettyPrinter()
+        c['payload'] = pp.pformat(payload)
+    else:
+        c['payload'] = "Only the headers of this event were stored."
     return render_to_response('expand.html', c)
 
 
@@ -429,7 +800,7 @@ def latest_raw(request, deployment_id):
     c = _default_context(request, deployment_id)
     then = datetime.datetime.utcnow() - datetime.timedelta(hours=1)
     thend = dt.dt_to_decimal(then)
-    query = models.RawData.objects.select_related().filter(when__gt=thend)
+    query = partitions.bounded(models.RawData.objects.select_related(), thend)
     if deployment_id > 0:
         query = query.filter(deployment=deployment_id)
     rows = query.order_by('-when')[:20]
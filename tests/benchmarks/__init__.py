@@ -0,0 +1,137 @@
+# Copyright (c) 2013 - Rackspace Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""Micro-benchmarks for the worker hot path.
+
+These aren't run by nose. Run them from the top of the tree, e.g.:
+
+    python -m tests.benchmarks.bench_worker
+"""
+
+import json
+import os
+import sys
+import time
+
+
+def setup_sys_path():
+    sys.path = [os.path.abspath(os.path.dirname('stacktach'))] + sys.path
+
+
+def setup_environment():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'settings')
+    os.environ.setdefault('STACKTACH_DB_ENGINE', '')
+    os.environ.setdefault('STACKTACH_DB_NAME', '')
+    os.environ.setdefault('STACKTACH_DB_HOST', '')
+    os.environ.setdefault('STACKTACH_DB_USERNAME', '')
+    os.environ.setdefault('STACKTACH_DB_PASSWORD', '')
+    os.environ.setdefault('STACKTACH_INSTALL_DIR', '')
+
+
+setup_sys_path()
+setup_environment()
+
+from stacktach import stacklog
+
+stacklog.set_default_logger_location("%s.log")
+
+
+def sample_notification(event_type='compute.instance.update',
+                        timestamp='2013-06-12 06:30:52.790476'):
+    """A compute notification about the size of the ones nova sends."""
+    image_meta = {
+        'org.openstack__1__architecture': 'x64',
+        'org.openstack__1__os_distro': 'org.centos',
+        'org.openstack__1__os_version': '6.3',
+        'com.rackspace__1__options': '0',
+        'auto_disk_config': 'True',
+        'base_image_ref': '5e91ad7f-afe4-4a83-bd5f-84673462cae1',
+        'image_type': 'base',
+        'min_disk': '20',
+        'min_ram': '512',
+    }
+    payload = {
+        'instance_id': '08f685d9-6352-4dbc-8271-96cc54bf14cd',
+        'instance_type_id': '2',
+        'instance_type': '512MB Standard Instance',
+        'tenant_id': '5813279',
+        'user_id': '172983',
+        'state': 'active',
+        'old_state': 'building',
+        'old_task_state': 'spawning',
+        'new_task_state': None,
+        'state_description': '',
+        'launched_at': '2013-06-12 06:30:52.000000',
+        'deleted_at': '',
+        'created_at': '2013-06-12 06:27:09',
+        'terminated_at': '',
+        'audit_period_beginning': '2013-06-12 00:00:00',
+        'audit_period_ending': '2013-06-12 06:30:52',
+        'bandwidth': {'public': {'bw_in': 0, 'bw_out': 0},
+                      'private': {'bw_in': 0, 'bw_out': 0}},
+        'display_name': 'server-08f685d9',
+        'hostname': 'server-08f685d9',
+        'host': 'c-10-1-1-1',
+        'memory_mb': 512,
+        'disk_gb': 20,
+        'root_gb': 20,
+        'ephemeral_gb': 0,
+        'vcpus': 1,
+        'architecture': None,
+        'os_type': 'linux',
+        'image_ref_url': 'http://127.0.0.1:9292/images/'
+                         '5e91ad7f-afe4-4a83-bd5f-84673462cae1',
+        'kernel_id': '',
+        'ramdisk_id': '',
+        'reservation_id': 'r-pxhj7axh',
+        'image_meta': image_meta,
+        'metadata': dict(('key%d' % i, 'value%d' % i) for i in range(20)),
+        'fixed_ips': [{'address': '10.1.1.%d' % i, 'type': 'fixed',
+                       'floating_ips': [], 'label': 'public',
+                       'meta': {}, 'version': 4} for i in range(4)],
+    }
+    return {
+        'event_type': event_type,
+        'message_id': '7f28f81b-29a2-43f2-9ba1-ccb3e53ab6c8',
+        'priority': 'INFO',
+        'publisher_id': 'compute.c-10-1-1-1',
+        'timestamp': timestamp,
+        '_context_request_id': 'req-611a4d70-9e47-4b27-a95e-27996cc40c06',
+        '_context_timestamp': '2013-06-12T06:30:51.123456',
+        '_context_project_id': '5813279',
+        '_context_user_id': '172983',
+        '_context_roles': ['identity:user-admin', 'compute:default'],
+        '_context_is_admin': False,
+        '_context_read_deleted': 'no',
+        '_context_remote_address': '10.1.0.1',
+        '_context_auth_token': 'a' * 32,
+        'payload': payload,
+    }
+
+
+def bench(name, func, number=10000):
+    """Time func() number times and print the per-call cost."""
+    start = time.time()
+    for i in xrange(number):
+        func()
+    elapsed = time.time() - start
+    per_call = elapsed / number * 1000000
+    print "%-40s %8d calls %10.2f us/call" % (name, number, per_call)
+    return per_call
@@ -0,0 +1,144 @@
+# Copyright (c) 2013 - Rackspace Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""Consumer throughput against the kombu in-memory transport.
+
+The database, and the transaction around each message or batch, are
+stubbed out, so this measures the consumer loop, the json handling and
+the cost of acking. The memory transport has no
+multiple=True ack, so one is emulated here. --ack-cost-us adds a fixed
+cost to every basic_ack call to stand in for the frame write a real
+broker connection pays.
+
+    python -m tests.benchmarks.bench_consumer --count 20000
+"""
+
+import argparse
+import datetime
+import time
+
+import kombu
+from kombu.transport import memory
+
+from tests.benchmarks import sample_notification
+
+from stacktach import datetime_to_decimal as dt
+from stacktach import db
+from stacktach import views
+import worker.worker as worker
+from worker.worker import json
+
+
+class FakeRaw(object):
+    def __init__(self):
+        self.when = dt.dt_to_decimal(datetime.datetime.utcnow())
+
+
+ACKS = [0]
+
+
+def _patch_basic_ack(ack_cost):
+    def basic_ack(self, delivery_tag, multiple=False):
+        ACKS[0] += 1
+        if ack_cost:
+            time.sleep(ack_cost)
+        if multiple:
+            # Tags are uuids here, but _delivered keeps delivery order.
+            for tag in list(self.qos._delivered.keys()):
+                self.qos.ack(tag)
+                if tag == delivery_tag:
+                    break
+        else:
+            self.qos.ack(delivery_tag)
+    memory.Channel.basic_ack = basic_ack
+
+
+def run(count, **kwargs):
+    connection = kombu.Connection('memory://')
+    consumer = worker.NovaConsumer('bench', connection, None, False, {},
+                                   **kwargs)
+    channel = connection.default_channel
+    ACKS[0] = 0
+
+    exchange = consumer._create_exchange('nova', 'topic')
+    queue = consumer._create_queue('monitor.info', exchange, 'monitor.info')
+    producer = kombu.Producer(channel)
+    body = json.dumps(sample_notification())
+    for i in xrange(count):
+        producer.publish(body, exchange=exchange, routing_key='monitor.info',
+                         declare=[queue], content_type='application/json',
+                         content_encoding='utf-8')
+
+    seen = [0]
+
+    def process_raw_data(deployment, args, json_args):
+        seen[0] += 1
+        return FakeRaw()
+
+    def process_raw_data_batch(deployment, messages, skip_stored=False):
+        seen[0] += len(messages)
+        return [FakeRaw() for message in messages]
+
+    def transactional(func, *args, **kwargs):
+        return func(*args, **kwargs)
+
+    db.transactional = transactional
+    views.process_raw_data = process_raw_data
+    views.process_raw_data_batch = process_raw_data_batch
+    views.post_process = lambda raw, body: None
+
+    start = time.time()
+    consuming = consumer.consume()
+    for _ in consuming:
+        if seen[0] >= count:
+            break
+    elapsed = time.time() - start
+
+    # The memory transport is process global, so cancel this consumer
+    # before the next run or it will keep being handed messages.
+    consuming.close()
+    connection.release()
+    return count / elapsed, ACKS[0]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=10000)
+    parser.add_argument('--ack-cost-us', type=int, default=50)
+    args = parser.parse_args()
+    _patch_basic_ack(args.ack_cost_us / 1000000.0)
+
+    print "%d messages, %dus per basic_ack" % (args.count, args.ack_cost_us)
+    scenarios = [
+        ('ack each message', {}),
+        ('prefetch 100, ack each message', {'prefetch_count': 100}),
+        ('prefetch 100, ack every 50', {'prefetch_count': 100,
+                                        'ack_every': 50}),
+        ('prefetch 500, ack every 250', {'prefetch_count': 500,
+                                         'ack_every': 250}),
+        ('batch 100', {'prefetch_count': 500, 'batch_size': 100}),
+    ]
+    for name, kwargs in scenarios:
+        rate, acks = run(args.count, **kwargs)
+        print "%-35s %10.0f msgs/sec %8d acks" % (name, rate, acks)
+
+
+if __name__ == '__main__':
+    main()
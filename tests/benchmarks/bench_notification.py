@@ -0,0 +1,63 @@
+# Copyright (c) 2013 - Rackspace Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""Per-message cost of parsing a notification.
+
+    python -m tests.benchmarks.bench_notification
+"""
+
+from tests.benchmarks import bench
+from tests.benchmarks import sample_notification
+
+from stacktach import views
+
+ROUTING_KEY = 'monitor.info'
+BODY = sample_notification()
+
+
+def parse():
+    views.NOTIFICATIONS[ROUTING_KEY](BODY)
+
+
+def instance_only():
+    # What replay.py needs to partition an event.
+    views.NOTIFICATIONS[ROUTING_KEY](BODY).instance
+
+
+def rawdata_kwargs():
+    notification = views.NOTIFICATIONS[ROUTING_KEY](BODY)
+    notification.rawdata_kwargs(1, ROUTING_KEY, '')
+
+
+def rawdata_kwargs_reread():
+    notification = views.NOTIFICATIONS[ROUTING_KEY](BODY)
+    notification.rawdata_kwargs(1, ROUTING_KEY, '')
+    notification.rawdata_kwargs(1, ROUTING_KEY, '')
+
+
+def main():
+    bench('parse', parse)
+    bench('parse + instance', instance_only)
+    bench('parse + rawdata_kwargs', rawdata_kwargs)
+    bench('parse + rawdata_kwargs twice', rawdata_kwargs_reread)
+
+
+if __name__ == '__main__':
+    main()
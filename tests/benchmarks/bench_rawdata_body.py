@@ -0,0 +1,130 @@
+# Copyright (c) 2013 - Rackspace Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""RawData with the json inline against a separate, compressed body table.
+
+Builds both layouts in an in-memory sqlite database and compares the
+bytes a listing query (the watch and uuid views, which never show the
+json) has to read, the time that query takes, and the time to fetch a
+single body for the show view:
+
+    python -m tests.benchmarks.bench_rawdata_body
+
+Table sizes come from sqlite's dbstat table, which needs sqlite 3.9
+or later built with it. In memory there is no I/O, so the listing
+times only show the split costs nothing in CPU; the saving is the bytes
+that no longer come off disk or sit in the buffer pool.
+"""
+
+import json
+import sqlite3
+import zlib
+
+from tests.benchmarks import bench
+from tests.benchmarks import sample_notification
+
+ROWS = 20000
+LISTED = 1000
+
+COLUMNS = ('deployment_id integer, event varchar(50), publisher '
+           'varchar(100), service varchar(50), host varchar(100), '
+           'instance varchar(50), request_id varchar(50), '
+           'state varchar(20), task varchar(30), "when" bigint')
+LIST_COLUMNS = ('id, deployment_id, event, publisher, service, host, '
+                'instance, request_id, state, task, "when"')
+
+
+def _connect():
+    conn = sqlite3.connect(':memory:')
+    conn.text_factory = str
+    conn.execute('CREATE TABLE wide (id integer PRIMARY KEY, %s, '
+                 'json text)' % COLUMNS)
+    conn.execute('CREATE TABLE narrow (id integer PRIMARY KEY, %s)' %
+                 COLUMNS)
+    conn.execute('CREATE TABLE body (raw_id integer PRIMARY KEY, '
+                 'compressed bool, data blob)')
+
+    body = sample_notification()
+    for i in xrange(ROWS):
+        body['message_id'] = 'msg-%d' % i
+        text = json.dumps(['monitor.info', body])
+        row = (i, 1, body['event_type'], body['publisher_id'], 'compute',
+               'c-10-1-1-1', 'inst-%d' % (i % 500), 'req-%d' % i, 'active',
+               '', 1371000000000000 + i)
+        conn.execute('INSERT INTO wide VALUES (%s)' % ', '.join('?' * 12),
+                     row + (text,))
+        conn.execute('INSERT INTO narrow VALUES (%s)' % ', '.join('?' * 11),
+                     row)
+        conn.execute('INSERT INTO body VALUES (?, 1, ?)',
+                     (i, sqlite3.Binary(zlib.compress(text, 6))))
+    return conn
+
+
+def _table_bytes(conn):
+    try:
+        return dict(conn.execute('SELECT name, SUM(pgsize) FROM dbstat '
+                                 'GROUP BY name'))
+    except sqlite3.OperationalError:
+        return None
+
+
+def main():
+    conn = _connect()
+    start = ROWS / 2
+    window = (start, start + LISTED)
+
+    sizes = _table_bytes(conn)
+    if sizes:
+        wide, narrow, body = sizes['wide'], sizes['narrow'], sizes['body']
+        print "%d rows, listing %d of them" % (ROWS, LISTED)
+        print "bytes a listing reads (table bytes / row * rows listed)"
+        print "  json inline       %10d" % (wide * LISTED / ROWS)
+        print "  body table        %10d" % (narrow * LISTED / ROWS)
+        print "  %.1fx fewer" % (float(wide) / narrow)
+        print "bytes stored"
+        print "  json inline       %10d" % wide
+        print "  compressed bodies %10d" % (narrow + body)
+        print "  %.1fx smaller" % (float(wide) / (narrow + body))
+
+    print "listing query and fetch"
+    old = bench('  json inline',
+                lambda: conn.execute('SELECT %s FROM wide WHERE id >= ? '
+                                     'AND id < ?' % LIST_COLUMNS,
+                                     window).fetchall(),
+                number=200)
+    new = bench('  body table',
+                lambda: conn.execute('SELECT %s FROM narrow WHERE id >= ? '
+                                     'AND id < ?' % LIST_COLUMNS,
+                                     window).fetchall(),
+                number=200)
+    print "  %.2fx the time" % (new / old)
+
+    print "one body, as the show view reads it"
+    bench('  json inline',
+          lambda: conn.execute('SELECT json FROM wide WHERE id = ?',
+                               (start,)).fetchone()[0])
+    bench('  body table',
+          lambda: zlib.decompress(str(conn.execute(
+              'SELECT data FROM body WHERE raw_id = ?',
+              (start,)).fetchone()[0])))
+
+
+if __name__ == '__main__':
+    main()
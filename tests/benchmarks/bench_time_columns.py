@@ -0,0 +1,103 @@
+# Copyright (c) 2013 - Rackspace Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""DECIMAL(20,6) seconds against BIGINT microsecond time columns.
+
+Builds the two layouts of an indexed RawData.when in an in-memory
+sqlite database, then times a range query over each and serialising
+the rows it returns the way dbapi does:
+
+    python -m tests.benchmarks.bench_time_columns
+
+sqlite keeps DECIMAL columns as REAL, so the query side flatters the
+DECIMAL layout compared to MySQL, where it is a wider packed index key.
+"""
+
+import decimal
+import random
+import sqlite3
+
+from tests.benchmarks import bench
+
+from stacktach import datetime_to_decimal as dt
+
+ROWS = 200000
+START = 1371000000
+SPAN = 86400
+WINDOW = 600
+
+
+def _connect():
+    # Django's sqlite backend reads DECIMAL columns back through a
+    # converter, as below.
+    sqlite3.register_converter('decimal', decimal.Decimal)
+    conn = sqlite3.connect(':memory:', detect_types=sqlite3.PARSE_DECLTYPES)
+    conn.execute('CREATE TABLE dec_raw (id INTEGER PRIMARY KEY, '
+                 '"when" decimal NOT NULL)')
+    conn.execute('CREATE TABLE int_raw (id INTEGER PRIMARY KEY, '
+                 '"when" bigint NOT NULL)')
+
+    random.seed(0)
+    micros = sorted(START * 1000000 + random.randint(0, SPAN * 1000000)
+                    for i in xrange(ROWS))
+    conn.executemany('INSERT INTO dec_raw ("when") VALUES (?)',
+                     ((str(dt.micros_to_decimal(m)),) for m in micros))
+    conn.executemany('INSERT INTO int_raw ("when") VALUES (?)',
+                     ((m,) for m in micros))
+    conn.execute('CREATE INDEX dec_raw_when ON dec_raw ("when")')
+    conn.execute('CREATE INDEX int_raw_when ON int_raw ("when")')
+    return conn
+
+
+def main():
+    conn = _connect()
+    low = START + SPAN / 2
+    dec_range = (str(low), str(low + WINDOW))
+    int_range = (low * 1000000, (low + WINDOW) * 1000000)
+    dec_query = 'SELECT id, "when" FROM dec_raw WHERE "when" BETWEEN ? AND ?'
+    int_query = 'SELECT id, "when" FROM int_raw WHERE "when" BETWEEN ? AND ?'
+    rows = len(conn.execute(int_query, int_range).fetchall())
+    print "%d rows, range query returns %d" % (ROWS, rows)
+
+    print "range query and fetch"
+    old = bench('  DECIMAL(20,6)',
+                lambda: conn.execute(dec_query, dec_range).fetchall(),
+                number=200)
+    new = bench('  BIGINT micros',
+                lambda: conn.execute(int_query, int_range).fetchall(),
+                number=200)
+    print "  %.1fx faster" % (old / new)
+
+    dec_rows = conn.execute(dec_query, dec_range).fetchall()
+    int_rows = conn.execute(int_query, int_range).fetchall()
+    print "serialising the rows"
+    old = bench('  dt_from_decimal',
+                lambda: [str(dt.dt_from_decimal(when))
+                         for id, when in dec_rows],
+                number=200)
+    new = bench('  dt_from_micros',
+                lambda: [str(dt.dt_from_micros(when))
+                         for id, when in int_rows],
+                number=200)
+    print "  %.1fx faster" % (old / new)
+
+
+if __name__ == '__main__':
+    main()
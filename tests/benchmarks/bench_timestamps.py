@@ -0,0 +1,60 @@
+# Copyright (c) 2013 - Rackspace Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""Cost of parsing a nova timestamp.
+
+    python -m tests.benchmarks.bench_timestamps
+"""
+
+import calendar
+import decimal
+
+from tests.benchmarks import bench
+
+from stacktach import utils
+
+TIMESTAMP = '2013-06-12 06:30:52.790476'
+NO_MICROS = '2013-06-12 06:30:52'
+
+
+def strptime_cascade(when):
+    # What str_time_to_unix did before the fast path: strptime, then
+    # Decimal arithmetic after resetting the global context.
+    utc = utils._strptime(when)
+    decimal.getcontext().prec = 30
+    return decimal.Decimal(str(calendar.timegm(utc.utctimetuple()))) + \
+           (decimal.Decimal(str(utc.microsecond)) /
+           decimal.Decimal("1000000.0"))
+
+
+def main():
+    for when in [TIMESTAMP, NO_MICROS]:
+        print when
+        old = bench('  strptime + Decimal arithmetic',
+                    lambda: strptime_cascade(when))
+        new = bench('  str_time_to_unix',
+                    lambda: utils.str_time_to_unix(when))
+        bench('  str_time_to_epoch_micros',
+              lambda: utils.str_time_to_epoch_micros(when))
+        print "  %.1fx faster" % (old / new)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+# Copyright (c) 2013 - Rackspace Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+from tests.benchmarks import bench
+from tests.benchmarks import sample_notification
+
+import worker.worker as worker
+from worker.worker import json
+
+ROUTING_KEY = 'monitor.info'
+BODY = json.dumps(sample_notification())
+
+
+def envelope_reserialised():
+    args = (ROUTING_KEY, json.loads(BODY))
+    return json.dumps(args)
+
+
+def envelope_verbatim():
+    args = (ROUTING_KEY, json.loads(BODY))
+    return worker.raw_json(ROUTING_KEY, BODY)
+
+
+def main():
+    print "Notification body: %d bytes, json module: %s" % \
+        (len(BODY), json.__name__)
+    old = bench('loads + dumps envelope', envelope_reserialised)
+    new = bench('loads + verbatim envelope', envelope_verbatim)
+    print "Saved %.2f us/message (%.0f%%)" % (old - new,
+                                             (old - new) / old * 100)
+
+
+if __name__ == '__main__':
+    main()
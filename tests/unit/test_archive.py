@@ -0,0 +1,261 @@
+# Copyright (c) 2013 - Rackspace Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+import decimal
+import os
+import shutil
+import tempfile
+import unittest
+
+from django.db.models import Max
+import mox
+
+from stacktach import archive
+from stacktach import db
+from stacktach import models
+
+
+def make_row(raw_id, json='{}'):
+    return {'id': raw_id, 'when': 1371018652790476, 'deployment': 'east',
+            'deployment_id': 1, 'json': json, 'event': 'test.start',
+            'instance': 'inst', 'request_id': 'req'}
+
+
+class ArchiveTestCase(unittest.TestCase):
+    def setUp(self):
+        self.mox = mox.Mox()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.mox.UnsetStubs()
+        shutil.rmtree(self.directory)
+
+    def _write(self, *blocks, **kwargs):
+        writer = archive.ArchiveWriter(self.directory, **kwargs)
+        for ids in blocks:
+            writer.write_block([make_row(raw_id) for raw_id in ids])
+        writer.close()
+        return writer
+
+    def test_write_and_get(self):
+        self._write([3, 1, 2], [4, 5])
+        reader = archive.Archive(self.directory)
+        for raw_id in range(1, 6):
+            self.assertEqual(reader.get(raw_id)['id'], raw_id)
+        self.assertEqual(reader.get(6), None)
+        self.assertEqual(reader.get(0), None)
+        self.assertEqual(len(reader.blocks), 2)
+        self.assertEqual(reader.blocks[0][:2], (1, 3))
+
+    def test_get_id_prefix(self):
+        self._write([1, 10, 100])
+        reader = archive.Archive(self.directory)
+        self.assertEqual(reader.get(10)['id'], 10)
+        self.assertEqual(reader.get(11), None)
+
+    def test_get_overlapping_blocks(self):
+        # A later run can archive ids below the last one archived.
+        self._write([1, 50], [10, 20], [30, 40])
+        reader = archive.Archive(self.directory)
+        self.assertEqual(reader.get(50)['id'], 50)
+        self.assertEqual(reader.get(20)['id'], 20)
+        self.assertEqual(reader.get(40)['id'], 40)
+        self.assertEqual(reader.get(45), None)
+
+    def test_refresh_reads_new_records(self):
+        self._write([1, 2])
+        reader = archive.Archive(self.directory)
+        self.assertEqual(reader.get(3), None)
+        self._write([3, 4])
+        self.assertEqual(reader.get(3)['id'], 3)
+        self.assertEqual(len(reader.blocks), 2)
+
+    def test_refresh_skips_partial_record(self):
+        self._write([1, 2])
+        index = os.path.join(self.directory, 'rawdata.000000000000.idx')
+        with open(index, 'ab') as f:
+            f.write('\x00' * 5)
+        reader = archive.Archive(self.directory)
+        self.assertEqual(reader.get(1)['id'], 1)
+        self.assertEqual(len(reader.blocks), 1)
+
+    def test_refresh_no_directory(self):
+        reader = archive.Archive(os.path.join(self.directory, 'missing'))
+        self.assertEqual(reader.get(1), None)
+
+    def test_segments_rotate(self):
+        writer = self._write([1, 2], [3, 4], segment_bytes=1)
+        self.assertEqual(writer.sequence, 1)
+        self._write([5, 6], segment_bytes=1)
+        files = sorted(os.listdir(self.directory))
+        self.assertEqual(files, ['archive.lock',
+                                 'rawdata.000000000000.idx',
+                                 'rawdata.000000000000.seg',
+                                 'rawdata.000000000001.idx',
+                                 'rawdata.000000000001.seg',
+                                 'rawdata.000000000002.idx',
+                                 'rawdata.000000000002.seg'])
+        reader = archive.Archive(self.directory)
+        for raw_id in range(1, 7):
+            self.assertEqual(reader.get(raw_id)['id'], raw_id)
+
+    def test_one_writer_at_a_time(self):
+        writer = archive.ArchiveWriter(self.directory)
+        self.assertRaises(IOError, archive.ArchiveWriter, self.directory)
+        writer.close()
+        archive.ArchiveWriter(self.directory).close()
+
+    def test_bytes_counted(self):
+        writer = self._write([1, 2])
+        self.assertTrue(writer.bytes_in > 0)
+        self.assertTrue(writer.bytes_out > 0)
+        segment = os.path.join(self.directory, 'rawdata.000000000000.seg')
+        self.assertEqual(os.path.getsize(segment), writer.bytes_out)
+
+    def test_row_round_trip(self):
+        raw = models.RawData(id=7, deployment_id=1, json='{"a": 1}',
+                             when=decimal.Decimal('1371018652.790476'),
+                             event='test.start', request_id='req')
+        row = archive.row_to_dict(raw, {1: 'east'})
+        self.assertEqual(row['when'], 1371018652790476)
+        self.assertEqual(row['deployment'], 'east')
+
+        loaded = archive.dict_to_rawdata(row)
+        self.assertEqual(loaded.id, 7)
+        self.assertEqual(loaded.when, decimal.Decimal('1371018652.790476'))
+        self.assertEqual(loaded.deployment_id, 1)
+        self.assertEqual(loaded.json, '{"a": 1}')
+        self.assertEqual(loaded.event, 'test.start')
+        self.assertEqual(loaded.request_id, 'req')
+
+    def test_load_rawdata(self):
+        self._write([1, 2])
+        self.mox.StubOutWithMock(archive, 'RAWDATA_ARCHIVE_DIR')
+        archive.RAWDATA_ARCHIVE_DIR = self.directory
+        self.mox.StubOutWithMock(archive, '_archive')
+        archive._archive = None
+
+        raw = archive.load_rawdata('2')
+        self.assertEqual(raw.id, 2)
+        self.assertEqual(raw.deployment_id, 1)
+        self.assertEqual(archive.load_rawdata(3), None)
+
+    def test_load_rawdata_no_archive(self):
+        self.mox.StubOutWithMock(archive, 'RAWDATA_ARCHIVE_DIR')
+        archive.RAWDATA_ARCHIVE_DIR = None
+        self.assertEqual(archive.load_rawdata(1), None)
+
+
+class ArchiverTestCase(unittest.TestCase):
+    def setUp(self):
+        self.mox = mox.Mox()
+        self.mox.StubOutWithMock(models, 'Deployment',
+                                 use_mock_anything=True)
+        models.Deployment.objects = self.mox.CreateMockAnything()
+        self.mox.StubOutWithMock(models, 'RawData', use_mock_anything=True)
+        models.RawData.objects = self.mox.CreateMockAnything()
+        self.mox.StubOutWithMock(archive, '_delete')
+        self.mox.StubOutWithMock(db, 'transactional')
+        self.mox.StubOutWithMock(models.RawDataBody, 'load_many')
+        self.writer = self.mox.CreateMockAnything()
+        self.writer.bytes_in = 1000
+        self.writer.bytes_out = 100
+
+    def tearDown(self):
+        self.mox.UnsetStubs()
+
+    def _raw(self, raw_id):
+        raw = self.mox.CreateMockAnything()
+        raw.id = raw_id
+        raw.deployment_id = 1
+        raw.__dict__['when'] = 1371018652790476
+        for column in archive.COLUMNS:
+            if column != 'deployment_id':
+                setattr(raw, column, None)
+        return raw
+
+    def _expect_old(self, cutoff, end_id):
+        self.old = self.mox.CreateMockAnything()
+        models.RawData.objects.filter(when__lt=cutoff).AndReturn(self.old)
+        self.old.aggregate(end_id=mox.IsA(Max)).AndReturn({'end_id': end_id})
+
+    def _expect_batch(self, last_id, end_id, batch, raws):
+        query = self.mox.CreateMockAnything()
+        self.old.filter(id__gt=last_id, id__lte=end_id).AndReturn(query)
+        query.order_by('id').AndReturn(query)
+        query.__getslice__(0, batch).AndReturn(raws)
+
+    def test_archive(self):
+        models.Deployment.objects.values_list('id', 'name')\
+                                 .AndReturn([(1, 'east')])
+        raws = [self._raw(raw_id) for raw_id in range(1, 6)]
+        self._expect_old(100, 5)
+        self._expect_batch(0, 5, 3, raws[:3])
+        models.RawDataBody.load_many([1, 2, 3]).AndReturn({1: '{"a": 1}'})
+        self.writer.write_block(mox.Func(lambda rows: [row['json'] for row
+                                                       in rows] ==
+                                                      ['{"a": 1}', '']))
+        self.writer.write_block(mox.Func(lambda rows: [row['id'] for row
+                                                       in rows] == [3]))
+        db.transactional(archive._delete, [1, 2, 3])
+        self._expect_batch(3, 5, 3, raws[3:])
+        models.RawDataBody.load_many([4, 5]).AndReturn({})
+        self.writer.write_block(mox.Func(lambda rows: [row['id'] for row
+                                                       in rows] == [4, 5]))
+        db.transactional(archive._delete, [4, 5])
+        self.mox.ReplayAll()
+
+        archiver = archive.Archiver(self.writer, batch=3, block_rows=2)
+        self.assertEqual(archiver.archive(100), 5)
+        report = archiver.report()
+        self.assertEqual(report['rows'], 5)
+        self.assertEqual(report['bytes_in'], 1000)
+        self.assertEqual(report['bytes_out'], 100)
+        self.assertTrue(report['rows_per_sec'] > 0)
+        self.mox.VerifyAll()
+
+    def test_archive_nothing_old(self):
+        models.Deployment.objects.values_list('id', 'name')\
+                                 .AndReturn([(1, 'east')])
+        self._expect_old(100, None)
+        self.mox.ReplayAll()
+
+        archiver = archive.Archiver(self.writer)
+        self.assertEqual(archiver.archive(100), 0)
+        self.mox.VerifyAll()
+
+    def test_archive_limit(self):
+        models.Deployment.objects.values_list('id', 'name')\
+                                 .AndReturn([(1, 'east')])
+        raws = [self._raw(raw_id) for raw_id in range(1, 4)]
+        self._expect_old(100, 9)
+        self._expect_batch(0, 9, 2, raws[:2])
+        models.RawDataBody.load_many([1, 2]).AndReturn({})
+        self.writer.write_block(mox.IgnoreArg())
+        db.transactional(archive._delete, [1, 2])
+        self._expect_batch(2, 9, 1, raws[2:])
+        models.RawDataBody.load_many([3]).AndReturn({})
+        self.writer.write_block(mox.IgnoreArg())
+        db.transactional(archive._delete, [3])
+        self.mox.ReplayAll()
+
+        archiver = archive.Archiver(self.writer, batch=2, block_rows=2)
+        self.assertEqual(archiver.archive(100, limit=3), 3)
+        self.mox.VerifyAll()
@@ -0,0 +1,164 @@
+# Copyright (c) 2013 - Rackspace Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+import unittest
+
+from stacktach import cache
+
+
+class LRUCacheTestCase(unittest.TestCase):
+    def test_get_miss_and_hit(self):
+        lru = cache.LRUCache(2)
+        self.assertEqual(lru.get('a'), None)
+        lru.put('a', 1)
+        self.assertEqual(lru.get('a'), 1)
+        self.assertEqual(lru.stats(), {'size': 1, 'hits': 1, 'misses': 1})
+
+    def test_put_evicts_least_recently_used(self):
+        evicted = []
+        lru = cache.LRUCache(2, on_evict=lambda k, v: evicted.append((k, v)))
+        lru.put('a', 1)
+        lru.put('b', 2)
+        lru.get('a')
+        lru.put('c', 3)
+        self.assertEqual(evicted, [('b', 2)])
+        self.assertTrue('a' in lru)
+        self.assertTrue('c' in lru)
+        self.assertEqual(len(lru), 2)
+
+    def test_get_expired(self):
+        evicted = []
+        lru = cache.LRUCache(2, ttl=10,
+                             on_evict=lambda k, v: evicted.append((k, v)))
+        lru.put('a', 1, now=100)
+        self.assertEqual(lru.get('a', now=109), 1)
+        self.assertEqual(lru.get('a', now=110), None)
+        self.assertEqual(evicted, [('a', 1)])
+        self.assertFalse('a' in lru)
+        self.assertEqual(lru.misses, 1)
+
+    def test_pop_and_clear_dont_evict(self):
+        evicted = []
+        lru = cache.LRUCache(2, on_evict=lambda k, v: evicted.append((k, v)))
+        lru.put('a', 1)
+        lru.put('b', 2)
+        self.assertEqual(lru.pop('a'), 1)
+        self.assertEqual(lru.pop('a'), None)
+        lru.clear()
+        self.assertEqual(len(lru), 0)
+        self.assertEqual(evicted, [])
+
+
+class WriteBackCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.saved = []
+
+    def _cache(self, size=2, flush_interval=0):
+        return cache.WriteBackCache(size, flush_interval=flush_interval,
+                                    save=self.saved.append)
+
+    def test_flush_saves_dirty_once(self):
+        wb = self._cache()
+        wb.put('a', 'A')
+        wb.mark_dirty('a', 'A')
+        wb.mark_dirty('a', 'A')
+        wb.flush()
+        wb.flush()
+        self.assertEqual(self.saved, ['A'])
+        self.assertEqual(wb.stats()['writes'], 1)
+        self.assertEqual(wb.stats()['dirty'], 0)
+
+    def test_flush_waits_for_interval(self):
+        wb = self._cache(flush_interval=5)
+        wb.last_flush = 100
+        wb.put('a', 'A')
+        wb.mark_dirty('a', 'A')
+        wb.flush(now=104)
+        self.assertEqual(self.saved, [])
+        wb.flush(now=105)
+        self.assertEqual(self.saved, ['A'])
+
+    def test_due(self):
+        wb = self._cache(flush_interval=5)
+        wb.last_flush = 100
+        self.assertFalse(wb.due(now=106))
+        wb.mark_dirty('a', 'A')
+        self.assertFalse(wb.due(now=104))
+        self.assertTrue(wb.due(now=105))
+
+    def test_flush_force(self):
+        wb = self._cache(flush_interval=5)
+        wb.last_flush = 100
+        wb.mark_dirty('a', 'A')
+        wb.flush(force=True, now=101)
+        self.assertEqual(self.saved, ['A'])
+
+    def test_evicting_dirty_entry_saves_it(self):
+        wb = self._cache(size=1)
+        wb.put('a', 'A')
+        wb.mark_dirty('a', 'A')
+        wb.put('b', 'B')
+        self.assertEqual(self.saved, ['A'])
+        wb.put('c', 'C')
+        self.assertEqual(self.saved, ['A'])
+
+    def test_clear_drops_dirty(self):
+        wb = self._cache()
+        wb.put('a', 'A')
+        wb.mark_dirty('a', 'A')
+        wb.clear()
+        wb.flush(force=True)
+        self.assertEqual(self.saved, [])
+        self.assertEqual(len(wb), 0)
+
+    def test_rollback_keeps_committed_dirty(self):
+        wb = self._cache()
+        wb.put('a', 'A')
+        wb.mark_dirty('a', 'A')
+        wb.commit()
+        wb.put('b', 'B')
+        wb.mark_dirty('b', 'B')
+        wb.rollback()
+        self.assertEqual(len(wb), 0)
+        wb.flush(force=True)
+        self.assertEqual(self.saved, ['A'])
+
+    def test_rollback_restores_rolled_back_writes(self):
+        wb = self._cache(size=1)
+        wb.put('a', 'A')
+        wb.mark_dirty('a', 'A')
+        wb.commit()
+        # Both saves are undone by the rollback.
+        wb.put('b', 'B')
+        wb.flush(force=True)
+        self.assertEqual(self.saved, ['A'])
+        wb.rollback()
+        wb.flush(force=True)
+        self.assertEqual(self.saved, ['A', 'A'])
+
+    def test_rollback_drops_changes_since_commit(self):
+        wb = self._cache()
+        wb.put('a', 'A')
+        wb.mark_dirty('a', 'A')
+        wb.commit()
+        wb.mark_dirty('a', 'A')
+        wb.rollback()
+        wb.flush(force=True)
+        self.assertEqual(self.saved, [])
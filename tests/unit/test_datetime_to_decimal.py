@@ -37,3 +37,17 @@ class DatetimeToDecimalTestCase(unittest.TestCase):
         expected_datetime = datetime.datetime.utcfromtimestamp(expected_decimal)
         actual_datetime = datetime_to_decimal.dt_from_decimal(expected_decimal)
         self.assertEqual(actual_datetime, expected_datetime)
+
+    def test_micros_round_trip(self):
+        dec = decimal.Decimal('1356093296.123')
+        micros = datetime_to_decimal.decimal_to_micros(dec)
+        self.assertEqual(micros, 1356093296123000)
+        self.assertEqual(datetime_to_decimal.micros_to_decimal(micros), dec)
+
+    def test_dt_from_micros(self):
+        for value in ['1356093296.123', '1356093296', '1371018652.790476']:
+            dec = decimal.Decimal(value)
+            micros = datetime_to_decimal.decimal_to_micros(dec)
+            self.assertEqual(datetime_to_decimal.dt_from_micros(micros),
+                             datetime_to_decimal.dt_from_decimal(dec))
+        self.assertEqual(datetime_to_decimal.dt_from_micros(None), "n/a")
@@ -19,6 +19,7 @@
 # IN THE SOFTWARE.
 
 import datetime
+import decimal
 import json
 import unittest
 
@@ -26,6 +27,8 @@ from django.db.models import FieldDoesNotExist
 from django.db import transaction
 import mox
 
+from stacktach import archive
+from stacktach import datetime_to_decimal as dt
 from stacktach import dbapi
 from stacktach import models
 from stacktach import utils as stacktach_utils
@@ -681,3 +684,43 @@ class DBAPITestCase(unittest.TestCase):
         msg = "'messages' missing from request body"
         self.assertEqual(body.get('message'), msg)
         self.mox.VerifyAll()
+
+    def test_convert_model(self):
+        usage = models.InstanceUsage(id=1, instance=INSTANCE_ID_1,
+                                     launched_at=decimal.Decimal('1.5'))
+        usage_dict = dbapi._convert_model(usage)
+        self.assertEqual(usage_dict['launched_at'],
+                         str(dt.dt_from_decimal(decimal.Decimal('1.5'))))
+        self.assertEqual(usage_dict['instance'], INSTANCE_ID_1)
+        self.assertEqual(usage_dict['id'], 1)
+
+    def test_convert_model_null_time(self):
+        delete = models.InstanceDeletes(id=1, instance=INSTANCE_ID_1,
+                                        launched_at=decimal.Decimal('1.5'))
+        delete_dict = dbapi._convert_model(delete)
+        self.assertEqual(delete_dict['deleted_at'], None)
+
+    def test_exists_extra_values(self):
+        exist = self.mox.CreateMockAnything()
+        exist.raw = models.RawData(id=1, when=decimal.Decimal('1.5'))
+        values = dbapi._exists_extra_values(exist)
+        self.assertEqual(values['received'],
+                         str(dt.dt_from_decimal(decimal.Decimal('1.5'))))
+
+    def test_exists_extra_values_archived_raw(self):
+        class ArchivedExists(object):
+            raw_id = 1
+
+            @property
+            def raw(self):
+                raise models.RawData.DoesNotExist()
+
+        self.mox.StubOutWithMock(archive, 'load_rawdata')
+        raw = models.RawData(id=1, when=decimal.Decimal('1.5'))
+        archive.load_rawdata(1).AndReturn(raw)
+        self.mox.ReplayAll()
+
+        values = dbapi._exists_extra_values(ArchivedExists())
+        self.assertEqual(values['received'],
+                         str(dt.dt_from_decimal(decimal.Decimal('1.5'))))
+        self.mox.VerifyAll()
@@ -0,0 +1,77 @@
+# Copyright (c) 2013 - Rackspace Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+import decimal
+import unittest
+
+from stacktach import fields
+
+
+class Row(object):
+    pass
+
+
+class TimestampFieldTestCase(unittest.TestCase):
+    def setUp(self):
+        self.bigint_times = fields.BIGINT_TIMES
+        self.field = fields.TimestampField(null=True)
+        self.field.name = 'when'
+
+    def tearDown(self):
+        fields.BIGINT_TIMES = self.bigint_times
+
+    def test_decimal_storage(self):
+        fields.BIGINT_TIMES = False
+        when = decimal.Decimal('1371018652.790476')
+        self.assertEqual(self.field.get_internal_type(), 'DecimalField')
+        self.assertEqual(self.field.get_db_prep_value(when, None), when)
+        self.assertEqual(fields.to_db(when), when)
+        self.assertEqual(fields.from_db(when), when)
+
+    def test_bigint_storage(self):
+        fields.BIGINT_TIMES = True
+        when = decimal.Decimal('1371018652.790476')
+        self.assertEqual(self.field.get_internal_type(), 'BigIntegerField')
+        self.assertEqual(self.field.get_db_prep_value(when, None),
+                         1371018652790476)
+        self.assertEqual(self.field.get_db_prep_save('1371018652.790476',
+                                                     None),
+                         1371018652790476)
+        self.assertEqual(self.field.get_db_prep_save(None, None), None)
+        # Lookups with ints are still in seconds.
+        self.assertEqual(self.field.get_db_prep_value(3600, None),
+                         3600000000)
+        self.assertEqual(fields.to_db(86400), 86400000000)
+        self.assertEqual(fields.from_db(1371018652790476L), when)
+        self.assertEqual(fields.from_db(None), None)
+
+    def test_descriptor_converts_when_read(self):
+        Row.when = fields._MicrosDescriptor(self.field)
+        row = Row()
+        row.when = 1371018652790476
+        self.assertEqual(fields.micros(row, 'when'), 1371018652790476)
+        self.assertEqual(row.when, decimal.Decimal('1371018652.790476'))
+        self.assertEqual(fields.micros(row, 'when'), 1371018652790476)
+
+        row.when = '1.5'
+        self.assertEqual(row.when, decimal.Decimal('1.5'))
+        row.when = None
+        self.assertEqual(row.when, None)
+        self.assertEqual(fields.micros(row, 'when'), None)
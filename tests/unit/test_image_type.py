@@ -281,3 +281,14 @@ class ImageTypeTestCase(unittest.TestCase):
     # Test blank argument to isset
     def test_blank_argument_isset(self):
         self.assertFalse(image_type.isset(None, image_type.OS_CENTOS))
+
+    def test_labels(self):
+        num = image_type.SNAPSHOT_IMAGE | image_type.WINDOWS_IMAGE
+        self.assertEqual(image_type.labels(num), ('snap', 'windows'))
+        num = image_type.BASE_IMAGE | image_type.LINUX_IMAGE
+        self.assertEqual(image_type.labels(num), ('base', 'linux'))
+
+    def test_labels_unknown(self):
+        self.assertEqual(image_type.labels(None), ('?', '?'))
+        self.assertEqual(image_type.labels(image_type.FREEBSD_IMAGE),
+                         ('?', '?'))
@@ -20,14 +20,21 @@
 
 from decimal import Decimal
 import unittest
+
+import mox
+
+from stacktach import notification
+from stacktach import utils
 from stacktach.notification import Notification
 from tests.unit.utils import REQUEST_ID_1, TENANT_ID_1, INSTANCE_ID_1
+from tests.unit.utils import MESSAGE_ID_1
 
 
 class NotificationTestCase(unittest.TestCase):
 
     def test_rawdata_kwargs(self):
         message = {
+            'message_id': MESSAGE_ID_1,
             'event_type': 'compute.instance.create.start',
             'publisher_id': 'compute.cpu1-n01.example.com',
             '_context_request_id': REQUEST_ID_1,
@@ -64,6 +71,7 @@ class NotificationTestCase(unittest.TestCase):
         self.assertEquals(kwargs['publisher'], 'compute.cpu1-n01.example.com')
         self.assertEquals(kwargs['event'], 'compute.instance.create.start')
         self.assertEquals(kwargs['request_id'], REQUEST_ID_1)
+        self.assertEquals(kwargs['message_id'], MESSAGE_ID_1)
 
     def test_rawdata_kwargs_missing_image_meta(self):
         message = {
@@ -178,3 +186,63 @@ class NotificationTestCase(unittest.TestCase):
         self.assertEquals(kwargs['publisher'], 'compute.cpu1-n01.example.com')
         self.assertEquals(kwargs['event'], 'compute.instance.create.start')
         self.assertEquals(kwargs['request_id'], REQUEST_ID_1)
+
+    def _message(self, event_type='compute.instance.create.start'):
+        return {
+            'message_id': MESSAGE_ID_1,
+            'event_type': event_type,
+            'publisher_id': 'compute.cpu1-n01.example.com',
+            '_context_request_id': REQUEST_ID_1,
+            'timestamp': '2013-06-12 06:30:52.790476',
+            'payload': {'instance_id': INSTANCE_ID_1},
+        }
+
+    def test_when_is_parsed_once(self):
+        m = mox.Mox()
+        m.StubOutWithMock(utils, 'str_time_to_unix')
+        utils.str_time_to_unix('2013-06-12 06:30:52.790476')\
+             .AndReturn(Decimal('1371018652.790476'))
+        m.ReplayAll()
+        try:
+            n = Notification(self._message())
+            self.assertEquals(n.when, Decimal('1371018652.790476'))
+            n.rawdata_kwargs('1', 'monitor.info', 'json')
+            m.VerifyAll()
+        finally:
+            m.UnsetStubs()
+
+    def test_when_is_lazy(self):
+        message = self._message()
+        del message['timestamp']
+        n = Notification(message)
+        self.assertEquals(n.instance, INSTANCE_ID_1)
+        self.assertRaises(KeyError, getattr, n, 'when')
+
+    def test_no_instance_dict(self):
+        n = Notification(self._message())
+        self.assertFalse(hasattr(n, '__dict__'))
+
+    def test_registry_default(self):
+        registry = notification.Registry()
+        n = registry(self._message())
+        self.assertEquals(type(n), Notification)
+
+    def test_registry_by_event_type(self):
+        class ExistsNotification(Notification):
+            __slots__ = ('audit_period_ending',)
+
+            def _parse(self, body):
+                super(ExistsNotification, self)._parse(body)
+                self.audit_period_ending = \
+                    self.payload.get('audit_period_ending')
+
+        registry = notification.Registry()
+        registry.register('compute.instance.exists', ExistsNotification)
+        message = self._message('compute.instance.exists')
+        message['payload']['audit_period_ending'] = '2013-06-12 00:00:00'
+        exists = registry(message)
+        other = registry(self._message())
+        self.assertEquals(type(exists), ExistsNotification)
+        self.assertEquals(exists.audit_period_ending, '2013-06-12 00:00:00')
+        self.assertEquals(exists.instance, INSTANCE_ID_1)
+        self.assertEquals(type(other), Notification)
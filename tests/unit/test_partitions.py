@@ -0,0 +1,168 @@
+# Copyright (c) 2013 - Rackspace Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+import datetime
+import unittest
+
+import mox
+
+from stacktach import datetime_to_decimal as dt
+from stacktach import partitions
+
+
+def micros(*args):
+    return dt.dt_to_micros(datetime.datetime(*args))
+
+
+class FakeCursor(object):
+    """Records the statements run and answers queries from results."""
+    def __init__(self, results):
+        self.results = list(results)
+        self.statements = []
+
+    def execute(self, sql, params):
+        self.statements.append(sql % tuple(repr(p) for p in params))
+
+    def fetchall(self):
+        return self.results.pop(0)
+
+    def fetchone(self):
+        return self.results.pop(0)
+
+    def alters(self):
+        return [sql for sql in self.statements if sql.startswith('ALTER')]
+
+
+class PartitionsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.mox = mox.Mox()
+
+    def tearDown(self):
+        self.mox.UnsetStubs()
+
+    def test_periods(self):
+        when = datetime.datetime(2013, 12, 31, 6, 30)
+        daily = partitions.period_start(when, 'daily')
+        self.assertEqual(daily, datetime.datetime(2013, 12, 31))
+        self.assertEqual(partitions.next_period(daily, 'daily'),
+                         datetime.datetime(2014, 1, 1))
+        self.assertEqual(partitions.partition_name(daily, 'daily'),
+                         'p20131231')
+
+        monthly = partitions.period_start(when, 'monthly')
+        self.assertEqual(monthly, datetime.datetime(2013, 12, 1))
+        self.assertEqual(partitions.next_period(monthly, 'monthly'),
+                         datetime.datetime(2014, 1, 1))
+        self.assertEqual(partitions.previous_period(
+                             datetime.datetime(2014, 1, 1), 'monthly'),
+                         monthly)
+        self.assertEqual(partitions.partition_name(monthly, 'monthly'),
+                         'p201312')
+
+    def test_bad_scheme(self):
+        self.assertRaises(ValueError, partitions.PartitionManager, 'hourly',
+                          cursor=FakeCursor([]))
+
+    def test_bounded(self):
+        query = self.mox.CreateMockAnything()
+        query.filter(when__gt=10).AndReturn(query)
+        query.filter(when__lte=20).AndReturn(query)
+        self.mox.ReplayAll()
+        self.assertEqual(partitions.bounded(query, 10, 20), query)
+        self.mox.VerifyAll()
+
+    def test_create(self):
+        cursor = FakeCursor([
+            [('p20130611', str(micros(2013, 6, 12))),
+             ('p20130612', str(micros(2013, 6, 13))),
+             ('pmax', 'MAXVALUE')],
+            [('p20130611', '100'), ('pmax', 'MAXVALUE')],
+            (41,),
+            [('p20130612', '42'), ('pmax', 'MAXVALUE')],
+        ])
+        manager = partitions.PartitionManager('daily', cursor=cursor)
+        created = manager.create(datetime.datetime(2013, 6, 12, 6), ahead=2)
+
+        self.assertEqual(created, ['p20130613', 'p20130614', 'p20130612'])
+        self.assertEqual(cursor.alters(), [
+            "ALTER TABLE stacktach_rawdata REORGANIZE PARTITION pmax INTO "
+            "(PARTITION p20130613 VALUES LESS THAN (%d), "
+            "PARTITION p20130614 VALUES LESS THAN (%d), "
+            "PARTITION pmax VALUES LESS THAN MAXVALUE)" %
+            (micros(2013, 6, 14), micros(2013, 6, 15)),
+            "ALTER TABLE stacktach_rawdataimagemeta REORGANIZE PARTITION "
+            "pmax INTO (PARTITION p20130612 VALUES LESS THAN (42), "
+            "PARTITION pmax VALUES LESS THAN MAXVALUE)"])
+
+    def test_create_nothing_to_do(self):
+        cursor = FakeCursor([
+            [('p20130612', str(micros(2013, 6, 13))),
+             ('p20130613', str(micros(2013, 6, 14))),
+             ('pmax', 'MAXVALUE')],
+            [('p20130612', '100'), ('pmax', 'MAXVALUE')],
+            [('p20130612', '100'), ('pmax', 'MAXVALUE')],
+        ])
+        manager = partitions.PartitionManager('daily', cursor=cursor)
+        created = manager.create(datetime.datetime(2013, 6, 12, 6), ahead=1)
+
+        self.assertEqual(created, [])
+        self.assertEqual(cursor.alters(), [])
+
+    def test_drop_expired(self):
+        cursor = FakeCursor([
+            [('p201304', str(micros(2013, 5, 1))),
+             ('p201305', str(micros(2013, 6, 1))),
+             ('p201306', str(micros(2013, 7, 1))),
+             ('pmax', 'MAXVALUE')],
+            (500,),
+            [('p201305', '300'), ('p201306', '600'), ('pmax', 'MAXVALUE')],
+            [('p201306', '600'), ('pmax', 'MAXVALUE')],
+        ])
+        manager = partitions.PartitionManager('monthly', cursor=cursor)
+        dropped = manager.drop_expired(datetime.datetime(2013, 6, 12), 1)
+
+        self.assertEqual(dropped, ['p201304', 'p201305'])
+        self.assertEqual(cursor.alters(), [
+            "ALTER TABLE stacktach_rawdata DROP PARTITION p201304",
+            "ALTER TABLE stacktach_rawdataimagemeta DROP PARTITION p201305"])
+
+    def test_partition_by_raw_id(self):
+        cursor = FakeCursor([[('pmax', 'MAXVALUE')], (41,)])
+        manager = partitions.PartitionManager('monthly', cursor=cursor)
+        manager.partition_by_raw_id(partitions.BODY_TABLE,
+                                    datetime.datetime(2013, 6, 12))
+
+        self.assertEqual(cursor.alters(), [
+            "ALTER TABLE stacktach_rawdatabody PARTITION BY RANGE (raw_id) "
+            "(PARTITION pmax VALUES LESS THAN MAXVALUE)",
+            "ALTER TABLE stacktach_rawdatabody REORGANIZE PARTITION pmax "
+            "INTO (PARTITION p201306 VALUES LESS THAN (42), "
+            "PARTITION pmax VALUES LESS THAN MAXVALUE)"])
+
+    def test_drop_expired_keeps_imagemeta_of_empty_rawdata(self):
+        cursor = FakeCursor([
+            [('p201306', str(micros(2013, 7, 1))), ('pmax', 'MAXVALUE')],
+            (None,),
+        ])
+        manager = partitions.PartitionManager('monthly', cursor=cursor)
+        dropped = manager.drop_expired(datetime.datetime(2013, 6, 12), 1)
+
+        self.assertEqual(dropped, [])
+        self.assertEqual(cursor.alters(), [])
@@ -0,0 +1,89 @@
+# Copyright (c) 2013 - Rackspace Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+import decimal
+import unittest
+
+from stacktach import sketch
+
+
+class LatencySketchTestCase(unittest.TestCase):
+    def _assertClose(self, value, expected):
+        self.assertTrue(abs(value - expected) <= expected * sketch.ACCURACY,
+                        "%r is not within 1%% of %r" % (value, expected))
+
+    def test_empty(self):
+        latencies = sketch.LatencySketch()
+        self.assertEqual(latencies.quantile(0.5), None)
+        self.assertEqual(latencies.average(), None)
+
+    def test_quantiles(self):
+        latencies = sketch.LatencySketch()
+        for value in range(1, 1001):
+            latencies.add(value)
+        self.assertEqual(latencies.count, 1000)
+        self.assertEqual(latencies.quantile(0), 1)
+        self.assertEqual(latencies.quantile(1), 1000)
+        self._assertClose(latencies.quantile(0.5), 500)
+        self._assertClose(latencies.quantile(0.99), 990)
+        self.assertEqual(latencies.average(), 500.5)
+
+    def test_zeros_and_decimals(self):
+        latencies = sketch.LatencySketch()
+        latencies.add(decimal.Decimal('0'))
+        latencies.add(decimal.Decimal('0'))
+        latencies.add(decimal.Decimal('2.5'))
+        self.assertEqual(latencies.quantile(0.5), 0.0)
+        self.assertEqual(latencies.quantile(1), 2.5)
+
+    def test_negative(self):
+        latencies = sketch.LatencySketch()
+        self.assertRaises(ValueError, latencies.add, -1)
+
+    def test_merge(self):
+        low = sketch.LatencySketch()
+        high = sketch.LatencySketch()
+        for value in range(1, 501):
+            low.add(value)
+        for value in range(501, 1001):
+            high.add(value)
+        low.merge(high)
+        self.assertEqual(low.count, 1000)
+        self.assertEqual(low.min, 1)
+        self.assertEqual(low.max, 1000)
+        self._assertClose(low.quantile(0.9), 900)
+
+    def test_merge_different_accuracy(self):
+        latencies = sketch.LatencySketch()
+        other = sketch.LatencySketch(accuracy=0.05)
+        self.assertRaises(ValueError, latencies.merge, other)
+
+    def test_json_round_trip(self):
+        latencies = sketch.LatencySketch()
+        for value in [0, 0.5, 3, 3, 120]:
+            latencies.add(value)
+        copy = sketch.LatencySketch.from_json(latencies.to_json())
+        self.assertEqual(copy.buckets, latencies.buckets)
+        self.assertEqual(copy.zeros, 1)
+        self.assertEqual(copy.count, 5)
+        self.assertEqual(copy.total, 126.5)
+        self.assertEqual(copy.min, 0)
+        self.assertEqual(copy.max, 120)
+        self.assertEqual(copy.quantile(0.5), latencies.quantile(0.5))
@@ -19,6 +19,7 @@
 # IN THE SOFTWARE.
 
 import datetime
+import decimal
 import json
 import unittest
 
@@ -26,17 +27,24 @@ import mox
 
 import utils
 from utils import INSTANCE_ID_1
+from utils import INSTANCE_ID_2
 from utils import OS_VERSION_1
 from utils import OS_ARCH_1
 from utils import OS_DISTRO_1
 from utils import RAX_OPTIONS_1
 from utils import MESSAGE_ID_1
+from utils import MESSAGE_ID_2
 from utils import REQUEST_ID_1
 from utils import TENANT_ID_1
 from utils import INSTANCE_TYPE_ID_1
 from utils import DUMMY_TIME
 from utils import INSTANCE_TYPE_ID_2
+from stacktach import db
+from stacktach import image_type
+from stacktach import models
+from stacktach import notification
 from stacktach import stacklog
+from stacktach import storage_policy
 from stacktach import views
 
 
@@ -108,6 +116,171 @@ class StacktachRawParsingTestCase(unittest.TestCase):
 
         views.NOTIFICATIONS['monitor.info'] = old_info_handler
 
+    def test_process_raw_data_batch(self):
+        deployment = self.mox.CreateMockAnything()
+        args1 = ('monitor.info', {'event_type': 'compute.instance.update'})
+        args2 = ('monitor.info', {'event_type': 'skipped'})
+        args3 = ('monitor.error', {'event_type': 'compute.instance.error'})
+        messages = [(args1, json.dumps(args1)),
+                    (args2, json.dumps(args2)),
+                    (args3, json.dumps(args3))]
+        values1 = {'routing_key': 'monitor.info'}
+        values3 = {'routing_key': 'monitor.error'}
+        notifications = {
+            'compute.instance.update': self.mox.CreateMockAnything(),
+            'skipped': self.mox.CreateMockAnything(),
+            'compute.instance.error': self.mox.CreateMockAnything()
+        }
+        notifications['compute.instance.update']\
+            .rawdata_kwargs(deployment, 'monitor.info', json.dumps(args1))\
+            .AndReturn(values1)
+        notifications['skipped']\
+            .rawdata_kwargs(deployment, 'monitor.info', json.dumps(args2))\
+            .AndReturn(None)
+        notifications['compute.instance.error']\
+            .rawdata_kwargs(deployment, 'monitor.error', json.dumps(args3))\
+            .AndReturn(values3)
+
+        old_handlers = views.NOTIFICATIONS.copy()
+        handler = lambda body: notifications[body['event_type']]
+        views.NOTIFICATIONS['monitor.info'] = handler
+        views.NOTIFICATIONS['monitor.error'] = handler
+
+        raw1 = self.mox.CreateMockAnything()
+        raw3 = self.mox.CreateMockAnything()
+        views.STACKDB.create_rawdata_batch([values1, values3])\
+                     .AndReturn([raw1, raw3])
+        self.mox.ReplayAll()
+        records = views.process_raw_data_batch(deployment, messages)
+        self.assertEqual(records, [raw1, None, raw3])
+        self.mox.VerifyAll()
+
+        views.NOTIFICATIONS.update(old_handlers)
+
+    def test_process_raw_data_batch_skip_stored(self):
+        deployment = self.mox.CreateMockAnything()
+        messages = []
+        values = []
+        notifications = {}
+        for event, message_id in [('stored', 'id1'), ('new', 'id2'),
+                                  ('repeat', 'id2'), ('no_id', None)]:
+            args = ('monitor.info', {'event_type': event})
+            messages.append((args, json.dumps(args)))
+            values.append({'routing_key': 'monitor.info',
+                           'message_id': message_id})
+            notifications[event] = self.mox.CreateMockAnything()
+            notifications[event]\
+                .rawdata_kwargs(deployment, 'monitor.info', json.dumps(args))\
+                .AndReturn(values[-1])
+
+        old_handlers = views.NOTIFICATIONS.copy()
+        handler = lambda body: notifications[body['event_type']]
+        views.NOTIFICATIONS['monitor.info'] = handler
+
+        views.STACKDB.find_stored_message_ids(deployment,
+                                              ['id1', 'id2', 'id2'])\
+                     .AndReturn(set(['id1']))
+        raw2 = self.mox.CreateMockAnything()
+        raw4 = self.mox.CreateMockAnything()
+        views.STACKDB.create_rawdata_batch([values[1], values[3]])\
+                     .AndReturn([raw2, raw4])
+        self.mox.ReplayAll()
+        records = views.process_raw_data_batch(deployment, messages,
+                                               skip_stored=True)
+        self.assertEqual(records, [None, raw2, None, raw4])
+        self.mox.VerifyAll()
+
+        views.NOTIFICATIONS.update(old_handlers)
+
+    def _setup_storage_policy(self, rules, event):
+        deployment = self.mox.CreateMockAnything()
+        args = ('monitor.info', {'event_type': event})
+        json_args = json.dumps(args)
+        raw_values = {
+            'deployment': deployment,
+            'event': event,
+            'routing_key': 'monitor.info',
+            'json': json_args,
+            'os_architecture': 'x64',
+            'os_distro': 'linux',
+            'os_version': '1',
+            'rax_options': '0'
+        }
+        old_info_handler = views.NOTIFICATIONS['monitor.info']
+        old_policy = views.STORAGE_POLICY
+        mock_notification = self.mox.CreateMockAnything()
+        mock_notification.rawdata_kwargs(deployment, 'monitor.info',
+                                         json_args).AndReturn(raw_values)
+        views.NOTIFICATIONS['monitor.info'] = \
+            lambda message_body: mock_notification
+        views.STORAGE_POLICY = storage_policy.StoragePolicy(rules)
+        self.addCleanup(self._restore, old_info_handler, old_policy)
+        return deployment, args, json_args, raw_values
+
+    def _restore(self, old_info_handler, old_policy):
+        views.NOTIFICATIONS['monitor.info'] = old_info_handler
+        views.STORAGE_POLICY = old_policy
+
+    def test_process_raw_data_headers_only(self):
+        rules = [{'event_type': 'compute.instance.update',
+                  'store': 'headers'}]
+        deployment, args, json_args, raw_values = \
+            self._setup_storage_policy(
+                rules, 'compute.instance.update')
+        raw = self.mox.CreateMockAnything()
+        views.STACKDB.create_rawdata(deployment=deployment,
+                                     event='compute.instance.update',
+                                     routing_key='monitor.info',
+                                     json='').AndReturn(raw)
+        self.mox.ReplayAll()
+        self.assertEqual(views.process_raw_data(deployment, args, json_args),
+                         raw)
+        self.mox.VerifyAll()
+
+    def test_process_raw_data_dropped(self):
+        rules = [{'event_type': 'compute.instance.update', 'store': 'drop'}]
+        deployment, args, json_args, raw_values = \
+            self._setup_storage_policy(
+                rules, 'compute.instance.update')
+        self.mox.ReplayAll()
+        self.assertEqual(views.process_raw_data(deployment, args, json_args),
+                         None)
+        self.mox.VerifyAll()
+
+    def test_process_raw_data_usage_event_always_full(self):
+        rules = [{'event_type': '*', 'store': 'drop'}]
+        deployment, args, json_args, raw_values = \
+            self._setup_storage_policy(
+                rules, 'compute.instance.exists')
+        raw = self.mox.CreateMockAnything()
+        views.STACKDB.create_rawdata(**raw_values).AndReturn(raw)
+        self.mox.ReplayAll()
+        self.assertEqual(views.process_raw_data(deployment, args, json_args),
+                         raw)
+        self.mox.VerifyAll()
+
+    def test_register_notification(self):
+        class ExistsNotification(notification.Notification):
+            __slots__ = ()
+
+        old = views.NOTIFICATIONS
+        views.NOTIFICATIONS = {'monitor.info': notification.Registry(),
+                               'monitor.error': notification.Registry()}
+        try:
+            views.register_notification('compute.instance.exists',
+                                        ExistsNotification,
+                                        routing_keys=['monitor.info'])
+            body = {'event_type': 'compute.instance.exists',
+                    'publisher_id': 'compute.c-10-1-1-1',
+                    '_context_request_id': REQUEST_ID_1}
+            info = views.NOTIFICATIONS['monitor.info'](body)
+            error = views.NOTIFICATIONS['monitor.error'](body)
+            self.assertEqual(type(info), ExistsNotification)
+            self.assertEqual(type(error), notification.Notification)
+        finally:
+            views.NOTIFICATIONS = old
+
+
 class StacktachLifecycleTestCase(unittest.TestCase):
     def setUp(self):
         self.mox = mox.Mox()
@@ -115,6 +288,7 @@ class StacktachLifecycleTestCase(unittest.TestCase):
 
     def tearDown(self):
         self.mox.UnsetStubs()
+        views.configure_caches()
 
     def test_start_kpi_tracking_not_update(self):
         raw = self.mox.CreateMockAnything()
@@ -190,6 +364,122 @@ class StacktachLifecycleTestCase(unittest.TestCase):
         self.assertEqual(tracker.duration, end-start)
         self.mox.VerifyAll()
 
+    def test_start_kpi_tracking_cached(self):
+        views.configure_caches(tracker_cache_size=10)
+        views.NO_TRACKER_CACHE.put(REQUEST_ID_1, True)
+        lifecycle = self.mox.CreateMockAnything()
+        tracker = self.mox.CreateMockAnything()
+        when = utils.decimal_utc()
+        raw = utils.create_raw(self.mox, when, 'compute.instance.update',
+                               host='nova.example.com', service='api')
+        views.STACKDB.create_request_tracker(lifecycle=lifecycle,
+                                             request_id=REQUEST_ID_1,
+                                             start=when,
+                                             last_timing=None,
+                                             duration=str(0.0))\
+                                             .AndReturn(tracker)
+        views.STACKDB.save(tracker)
+        self.mox.ReplayAll()
+        views.start_kpi_tracking(lifecycle, raw)
+        self.assertEqual(views.TRACKER_CACHE.get(REQUEST_ID_1), tracker)
+        self.assertFalse(REQUEST_ID_1 in views.NO_TRACKER_CACHE)
+        self.mox.VerifyAll()
+
+    def test_update_kpi_cached_tracker(self):
+        views.configure_caches(tracker_cache_size=10)
+        lifecycle = self.mox.CreateMockAnything()
+        end = utils.decimal_utc()
+        raw = self.mox.CreateMockAnything()
+        raw.request_id = REQUEST_ID_1
+        timing = utils.create_timing(self.mox, 'compute.instance.create',
+                                     lifecycle, end_when=end)
+        start = utils.decimal_utc()
+        tracker = utils.create_tracker(self.mox, REQUEST_ID_1, lifecycle,
+                                       start)
+        views.TRACKER_CACHE.put(REQUEST_ID_1, tracker)
+        views.STACKDB.save(tracker)
+        self.mox.ReplayAll()
+        views.update_kpi(timing, raw)
+        self.assertEqual(tracker.last_timing, timing)
+        self.assertEqual(tracker.duration, end-start)
+        self.mox.VerifyAll()
+
+    def test_update_kpi_caches_tracker(self):
+        views.configure_caches(tracker_cache_size=10)
+        lifecycle = self.mox.CreateMockAnything()
+        end = utils.decimal_utc()
+        raw = self.mox.CreateMockAnything()
+        raw.request_id = REQUEST_ID_1
+        timing = utils.create_timing(self.mox, 'compute.instance.create',
+                                     lifecycle, end_when=end)
+        tracker = utils.create_tracker(self.mox, REQUEST_ID_1, lifecycle,
+                                       utils.decimal_utc())
+        views.STACKDB.find_request_trackers(request_id=REQUEST_ID_1)\
+                     .AndReturn([tracker])
+        views.STACKDB.save(tracker)
+        views.STACKDB.save(tracker)
+        self.mox.ReplayAll()
+        views.update_kpi(timing, raw)
+        views.update_kpi(timing, raw)
+        self.assertEqual(views.cache_stats()['tracker_cache']['hits'], 1)
+        self.mox.VerifyAll()
+
+    def test_update_kpi_no_trackers_cached(self):
+        views.configure_caches(tracker_cache_size=10)
+        raw = self.mox.CreateMockAnything()
+        raw.request_id = REQUEST_ID_1
+        views.STACKDB.find_request_trackers(request_id=REQUEST_ID_1)\
+                     .AndReturn([])
+        self.mox.ReplayAll()
+        views.update_kpi(None, raw)
+        views.update_kpi(None, raw)
+        stats = views.cache_stats()
+        self.assertEqual(stats['no_tracker_cache']['hits'], 1)
+        self.mox.VerifyAll()
+
+    def test_update_kpi_no_trackers_expires(self):
+        views.configure_caches(tracker_cache_size=10, tracker_negative_ttl=0)
+        raw = self.mox.CreateMockAnything()
+        raw.request_id = REQUEST_ID_1
+        views.STACKDB.find_request_trackers(request_id=REQUEST_ID_1)\
+                     .AndReturn([])
+        views.STACKDB.find_request_trackers(request_id=REQUEST_ID_1)\
+                     .AndReturn([])
+        self.mox.ReplayAll()
+        views.update_kpi(None, raw)
+        views.update_kpi(None, raw)
+        self.mox.VerifyAll()
+
+    def test_update_timing_summary(self):
+        lifecycle = self.mox.CreateMockAnything()
+        raw = self.mox.CreateMockAnything()
+        raw.deployment_id = 1
+        raw.image_type = image_type.SNAPSHOT_IMAGE | image_type.LINUX_IMAGE
+        timing = utils.create_timing(self.mox, 'compute.instance.reboot',
+                                     lifecycle,
+                                     end_when=decimal.Decimal('7205.5'),
+                                     diff=decimal.Decimal('2.5'))
+        views.STACKDB.add_to_timing_summary('compute.instance.reboot', 1,
+                                            decimal.Decimal(7200),
+                                            decimal.Decimal('2.5'))
+        views.STACKDB.add_to_timing_sketch('compute.instance.reboot', 1,
+                                           decimal.Decimal(7200), 'snap',
+                                           'linux', decimal.Decimal('2.5'))
+        self.mox.ReplayAll()
+        views.update_timing_summary(timing, raw)
+        self.mox.VerifyAll()
+
+    def test_update_timing_summary_negative_diff(self):
+        lifecycle = self.mox.CreateMockAnything()
+        raw = self.mox.CreateMockAnything()
+        timing = utils.create_timing(self.mox, 'compute.instance.reboot',
+                                     lifecycle,
+                                     end_when=decimal.Decimal('7205.5'),
+                                     diff=decimal.Decimal('-0.1'))
+        self.mox.ReplayAll()
+        views.update_timing_summary(timing, raw)
+        self.mox.VerifyAll()
+
     def test_aggregate_lifecycle_no_instance(self):
         raw = self.mox.CreateMockAnything()
         raw.instance = None
@@ -210,8 +500,6 @@ class StacktachLifecycleTestCase(unittest.TestCase):
                      .AndReturn(lifecycle)
         views.STACKDB.save(lifecycle)
 
-        views.STACKDB.find_timings(name=event_name, lifecycle=lifecycle)\
-                     .AndReturn([])
         timing = utils.create_timing(self.mox, event_name, lifecycle)
         views.STACKDB.create_timing(lifecycle=lifecycle, name=event_name)\
                      .AndReturn(timing)
@@ -226,6 +514,7 @@ class StacktachLifecycleTestCase(unittest.TestCase):
         self.assertEqual(timing.lifecycle, lifecycle)
         self.assertEqual(timing.start_raw, raw)
         self.assertEqual(timing.start_when, when)
+        self.assertTrue(timing.is_open)
 
         self.mox.VerifyAll()
 
@@ -249,11 +538,14 @@ class StacktachLifecycleTestCase(unittest.TestCase):
         timing = utils.create_timing(self.mox, event_name, lifecycle,
                                      start_raw=start_raw,
                                      start_when=start_when)
-        views.STACKDB.find_timings(name=event_name, lifecycle=lifecycle)\
-                     .AndReturn([timing])
+        timing.is_open = True
+        views.STACKDB.find_open_timing(name=event_name, lifecycle=lifecycle)\
+                     .AndReturn(timing)
 
         self.mox.StubOutWithMock(views, "update_kpi")
         views.update_kpi(timing, end_raw)
+        self.mox.StubOutWithMock(views, "update_timing_summary")
+        views.update_timing_summary(timing, end_raw)
         views.STACKDB.save(timing)
 
         self.mox.ReplayAll()
@@ -268,13 +560,76 @@ class StacktachLifecycleTestCase(unittest.TestCase):
         self.assertEqual(timing.end_raw, end_raw)
         self.assertEqual(timing.end_when, end_when)
         self.assertEqual(timing.diff, end_when-start_when)
+        self.assertFalse(timing.is_open)
 
         self.mox.VerifyAll()
 
+    def test_aggregate_lifecycle_end_without_start(self):
+        event_name = 'compute.instance.create'
+        end_when = datetime.datetime.utcnow()
+        end_raw = utils.create_raw(self.mox, end_when,
+                                   '%s.end' % event_name, old_task='build')
+        lifecycle = utils.create_lifecycle(self.mox, INSTANCE_ID_1,
+                                           'active', '', None)
+        views.STACKDB.find_lifecycles(instance=INSTANCE_ID_1)\
+                     .AndReturn([lifecycle])
+        views.STACKDB.save(lifecycle)
+        views.STACKDB.find_open_timing(name=event_name, lifecycle=lifecycle)\
+                     .AndReturn(None)
+        timing = utils.create_timing(self.mox, event_name, lifecycle)
+        views.STACKDB.create_timing(lifecycle=lifecycle, name=event_name)\
+                     .AndReturn(timing)
+        views.STACKDB.save(timing)
+
+        self.mox.ReplayAll()
+        views.aggregate_lifecycle(end_raw)
+        self.assertEqual(timing.end_raw, end_raw)
+        self.assertEqual(timing.diff, None)
+        self.assertFalse(timing.is_open)
+        self.mox.VerifyAll()
+
+    def test_aggregate_lifecycle_timing_cache(self):
+        views.configure_caches(timing_cache_size=10)
+        event_name = 'compute.instance.reboot'
+        start_when = datetime.datetime.utcnow()
+        end_when = datetime.datetime.utcnow()
+        start_raw = utils.create_raw(self.mox, start_when,
+                                     '%s.start' % event_name)
+        end_raw = utils.create_raw(self.mox, end_when,
+                                   '%s.end' % event_name)
+        lifecycle = utils.create_lifecycle(self.mox, INSTANCE_ID_1,
+                                           'active', '', None)
+        views.STACKDB.find_lifecycles(instance=INSTANCE_ID_1)\
+                     .AndReturn([lifecycle])
+        views.STACKDB.save(lifecycle)
+        timing = utils.create_timing(self.mox, event_name, lifecycle)
+        views.STACKDB.create_timing(lifecycle=lifecycle, name=event_name)\
+                     .AndReturn(timing)
+        views.STACKDB.save(timing)
+        views.STACKDB.find_lifecycles(instance=INSTANCE_ID_1)\
+                     .AndReturn([lifecycle])
+        views.STACKDB.save(lifecycle)
+        self.mox.StubOutWithMock(views, "update_kpi")
+        views.update_kpi(timing, end_raw)
+        self.mox.StubOutWithMock(views, "update_timing_summary")
+        views.update_timing_summary(timing, end_raw)
+        views.STACKDB.save(timing)
+
+        self.mox.ReplayAll()
+        views.aggregate_lifecycle(start_raw)
+        views.aggregate_lifecycle(end_raw)
+        self.assertEqual(timing.start_raw, start_raw)
+        self.assertEqual(timing.end_raw, end_raw)
+        self.assertFalse(timing.is_open)
+        self.assertEqual(len(views.TIMING_CACHE), 0)
+        self.assertEqual(views.cache_stats()['timing_cache']['hits'], 1)
+        self.mox.VerifyAll()
+
     def test_aggregate_lifecycle_update(self):
         event = 'compute.instance.update'
         when = datetime.datetime.utcnow()
-        raw = utils.create_raw(self.mox, when, event, old_task='reboot')
+        raw = utils.create_raw(self.mox, when, event, old_task='reboot',
+                               json_str='["monitor.info", {}]')
 
         views.STACKDB.find_lifecycles(instance=INSTANCE_ID_1).AndReturn([])
         lifecycle = self.mox.CreateMockAnything()
@@ -290,7 +645,135 @@ class StacktachLifecycleTestCase(unittest.TestCase):
         self.assertEqual(lifecycle.last_raw, raw)
         self.assertEqual(lifecycle.last_state, 'active')
         self.assertEqual(lifecycle.last_task_state, 'reboot')
+        self.assertEqual(raw.json, '["monitor.info", {}]')
+
+        self.mox.VerifyAll()
+
+    def test_aggregate_lifecycle_cache_miss(self):
+        views.configure_caches(lifecycle_cache_size=10)
+        event = 'compute.instance.update'
+        when = datetime.datetime.utcnow()
+        raw = utils.create_raw(self.mox, when, event, old_task='reboot',
+                               json_str='["monitor.info", {}]')
+        lifecycle = utils.create_lifecycle(self.mox, INSTANCE_ID_1,
+                                           'active', 'reboot', None)
+        lifecycle.id = 1
+        views.STACKDB.find_lifecycles(instance=INSTANCE_ID_1)\
+                     .AndReturn([lifecycle])
+        self.mox.StubOutWithMock(views, "start_kpi_tracking")
+        views.start_kpi_tracking(lifecycle, raw)
+        views.STACKDB.update(lifecycle)
+
+        self.mox.ReplayAll()
+        views.aggregate_lifecycle(raw)
+        self.assertEqual(lifecycle.last_raw, raw)
+        self.assertTrue(INSTANCE_ID_1 in views.LIFECYCLE_CACHE)
+        # The cached Lifecycle doesn't hold on to the body.
+        self.assertEqual(raw.json, None)
+        views.flush_caches(force=True)
+        self.mox.VerifyAll()
+
+    def test_aggregate_lifecycle_cache_hit(self):
+        views.configure_caches(lifecycle_cache_size=10)
+        event = 'compute.instance.update'
+        when = datetime.datetime.utcnow()
+        raw = utils.create_raw(self.mox, when, event, old_task='reboot')
+        lifecycle = utils.create_lifecycle(self.mox, INSTANCE_ID_1,
+                                           'active', None, None)
+        lifecycle.id = 1
+        views.LIFECYCLE_CACHE.put(INSTANCE_ID_1, lifecycle)
+        self.mox.StubOutWithMock(views, "start_kpi_tracking")
+        views.start_kpi_tracking(lifecycle, raw)
+
+        self.mox.ReplayAll()
+        views.aggregate_lifecycle(raw)
+        self.assertEqual(lifecycle.last_raw, raw)
+        self.assertEqual(lifecycle.last_task_state, 'reboot')
+        stats = views.cache_stats()['lifecycle_cache']
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['dirty'], 1)
+        self.mox.VerifyAll()
+
+    def test_aggregate_lifecycle_cache_new_lifecycle_saved(self):
+        views.configure_caches(lifecycle_cache_size=10)
+        event = 'compute.instance.update'
+        when = datetime.datetime.utcnow()
+        raw = utils.create_raw(self.mox, when, event, old_task='reboot')
+        views.STACKDB.find_lifecycles(instance=INSTANCE_ID_1).AndReturn([])
+        lifecycle = self.mox.CreateMockAnything()
+        lifecycle.instance = INSTANCE_ID_1
+        lifecycle.id = None
+        views.STACKDB.create_lifecycle(instance=INSTANCE_ID_1)\
+                     .AndReturn(lifecycle)
+        views.STACKDB.save(lifecycle)
+        self.mox.StubOutWithMock(views, "start_kpi_tracking")
+        views.start_kpi_tracking(lifecycle, raw)
+
+        self.mox.ReplayAll()
+        views.aggregate_lifecycle(raw)
+        self.assertTrue(INSTANCE_ID_1 in views.LIFECYCLE_CACHE)
+        self.assertEqual(views.cache_stats()['lifecycle_cache']['dirty'], 0)
+        self.mox.VerifyAll()
+
+    def test_reset_caches_on_rollback(self):
+        views.configure_caches(lifecycle_cache_size=10)
+        lifecycle = utils.create_lifecycle(self.mox, INSTANCE_ID_1,
+                                           'active', None, None)
+        views.LIFECYCLE_CACHE.put(INSTANCE_ID_1, lifecycle)
+        views.LIFECYCLE_CACHE.mark_dirty(INSTANCE_ID_1, lifecycle)
+        self.assertTrue(views.reset_caches in db.ROLLBACK_HOOKS)
+
+        self.mox.ReplayAll()
+        views.reset_caches()
+        views.flush_caches(force=True)
+        self.assertFalse(INSTANCE_ID_1 in views.LIFECYCLE_CACHE)
+        self.mox.VerifyAll()
+
 
+    def test_caches_due(self):
+        self.assertFalse(views.caches_due())
+        views.configure_caches(lifecycle_cache_size=10,
+                               lifecycle_flush_interval=0,
+                               exists_batch_size=10)
+        self.assertFalse(views.caches_due())
+        views.LIFECYCLE_CACHE.mark_dirty(INSTANCE_ID_1, 'lifecycle')
+        self.assertTrue(views.caches_due())
+        views.LIFECYCLE_CACHE.clear()
+        views.PENDING_EXISTS.append({'instance': INSTANCE_ID_1})
+        self.assertTrue(views.caches_due())
+
+    def test_rollback_keeps_committed_lifecycle_updates(self):
+        views.configure_caches(lifecycle_cache_size=10,
+                               lifecycle_flush_interval=5)
+        self.assertTrue(views.commit_caches in db.COMMIT_HOOKS)
+        event = 'compute.instance.update'
+        when = datetime.datetime.utcnow()
+        lifecycle1 = utils.create_lifecycle(self.mox, INSTANCE_ID_1,
+                                            'building', None, None)
+        lifecycle1.id = 1
+        lifecycle2 = utils.create_lifecycle(self.mox, INSTANCE_ID_2,
+                                            'building', None, None)
+        lifecycle2.id = 2
+        views.LIFECYCLE_CACHE.put(INSTANCE_ID_1, lifecycle1)
+        views.LIFECYCLE_CACHE.put(INSTANCE_ID_2, lifecycle2)
+        self.mox.StubOutWithMock(views, "start_kpi_tracking")
+        raw1 = utils.create_raw(self.mox, when, event, instance=INSTANCE_ID_1)
+        views.start_kpi_tracking(lifecycle1, raw1)
+        raw2 = utils.create_raw(self.mox, when, event, instance=INSTANCE_ID_2)
+        views.start_kpi_tracking(lifecycle2, raw2)
+        # Only the committed update is written, once the interval is up.
+        views.STACKDB.update(lifecycle1)
+
+        self.mox.ReplayAll()
+        views.aggregate_lifecycle(raw1)
+        views.flush_caches()
+        views.commit_caches()
+        views.aggregate_lifecycle(raw2)
+        views.flush_caches()
+        views.reset_caches()
+        self.assertFalse(INSTANCE_ID_1 in views.LIFECYCLE_CACHE)
+        views.flush_caches(force=True)
+        self.assertEqual(lifecycle1.last_raw, raw1)
         self.mox.VerifyAll()
 
 
@@ -303,6 +786,7 @@ class StacktachUsageParsingTestCase(unittest.TestCase):
 
     def tearDown(self):
         self.mox.UnsetStubs()
+        views.configure_caches()
 
     def setup_mock_log(self, name=None):
         if name is None:
@@ -538,14 +1022,92 @@ class StacktachUsageParsingTestCase(unittest.TestCase):
         json_str = json.dumps(notification)
         raw = utils.create_raw(self.mox, when_decimal, event=event,
                                json_str=json_str)
-        usage = self.mox.CreateMockAnything()
+        usage = models.InstanceUsage(id=1, instance=INSTANCE_ID_1,
+                                     request_id=REQUEST_ID_1)
         views.STACKDB.get_or_create_instance_usage(instance=INSTANCE_ID_1,
                                                    request_id=REQUEST_ID_1) \
             .AndReturn((usage, True))
-        views.STACKDB.save(usage)
+        views.STACKDB.update_fields(usage, mox.IgnoreArg())
         self.mox.ReplayAll()
         return raw, usage
 
+    def _usage_notification(self, event):
+        kwargs = {'launched': str(DUMMY_TIME), 'tenant_id': TENANT_ID_1,
+                  'rax_options': RAX_OPTIONS_1, 'os_architecture': OS_ARCH_1,
+                  'os_version': OS_VERSION_1, 'os_distro': OS_DISTRO_1}
+        notification = utils.create_nova_notif(request_id=REQUEST_ID_1,
+                                               **kwargs)
+        raw = utils.create_raw(self.mox, utils.decimal_utc(DUMMY_TIME),
+                               event=event,
+                               json_str=json.dumps(notification))
+        return raw, notification[1]
+
+    def _stored_usage(self):
+        return models.InstanceUsage(id=1, instance=INSTANCE_ID_1,
+                                    request_id=REQUEST_ID_1,
+                                    instance_type_id='1',
+                                    tenant=TENANT_ID_1,
+                                    rax_options=RAX_OPTIONS_1,
+                                    os_architecture=OS_ARCH_1,
+                                    os_version=OS_VERSION_1,
+                                    os_distro=OS_DISTRO_1)
+
+    def test_process_usage_for_updates_writes_changed_fields(self):
+        raw, body = self._usage_notification('compute.instance.create.end')
+        usage = self._stored_usage()
+        views.STACKDB.get_or_create_instance_usage(instance=INSTANCE_ID_1,
+                                                   request_id=REQUEST_ID_1) \
+            .AndReturn((usage, False))
+        views.STACKDB.update_fields(usage, ['launched_at'])
+        self.mox.ReplayAll()
+
+        views._process_usage_for_updates(raw, body)
+
+        self.assertEqual(usage.launched_at, utils.decimal_utc(DUMMY_TIME))
+        self.mox.VerifyAll()
+
+    def test_process_usage_for_updates_unchanged_skips_write(self):
+        raw, body = self._usage_notification('compute.instance.create.end')
+        usage = self._stored_usage()
+        usage.launched_at = utils.decimal_utc(DUMMY_TIME)
+        views.STACKDB.get_or_create_instance_usage(instance=INSTANCE_ID_1,
+                                                   request_id=REQUEST_ID_1) \
+            .AndReturn((usage, False))
+        self.mox.ReplayAll()
+
+        views._process_usage_for_updates(raw, body)
+
+        self.mox.VerifyAll()
+
+    def test_process_usage_end_uses_cached_start(self):
+        views.configure_caches(usage_cache_size=10)
+        start_raw, start_body = \
+            self._usage_notification('compute.instance.create.start')
+        end_raw, end_body = \
+            self._usage_notification('compute.instance.create.end')
+        usage = models.InstanceUsage(id=1, instance=INSTANCE_ID_1,
+                                     request_id=REQUEST_ID_1)
+        views.STACKDB.get_or_create_instance_usage(instance=INSTANCE_ID_1,
+                                                   request_id=REQUEST_ID_1) \
+            .AndReturn((usage, True))
+        views.STACKDB.update_fields(usage, ['instance_type_id', 'tenant',
+                                            'rax_options', 'os_architecture',
+                                            'os_version', 'os_distro'])
+        views.STACKDB.update_fields(usage, ['launched_at'])
+        self.mox.ReplayAll()
+
+        views._process_usage_for_new_launch(start_raw, start_body)
+        views._process_usage_for_updates(end_raw, end_body)
+
+        self.assertEqual(views.USAGE_CACHE.stats()['hits'], 1)
+        self.mox.VerifyAll()
+
+    def test_reset_caches_forgets_usage(self):
+        views.configure_caches(usage_cache_size=10)
+        views.USAGE_CACHE.put((INSTANCE_ID_1, REQUEST_ID_1), 'usage')
+        views.reset_caches()
+        self.assertEqual(len(views.USAGE_CACHE), 0)
+
     def test_process_delete(self):
         delete_time = datetime.datetime.utcnow()
         launch_time = delete_time-datetime.timedelta(days=1)
@@ -644,6 +1206,125 @@ class StacktachUsageParsingTestCase(unittest.TestCase):
         views._process_exists(raw, notif[1])
         self.mox.VerifyAll()
 
+    def _exists_notification(self, instance, message_id, launch_time,
+                             delete_time=None):
+        audit_ending = launch_time + datetime.timedelta(hours=23)
+        audit_beginning = audit_ending - datetime.timedelta(days=1)
+        deleted = None
+        if delete_time:
+            deleted = str(delete_time)
+        notif = utils.create_nova_notif(instance=instance,
+                                        message_id=message_id,
+                                        launched=str(launch_time),
+                                        deleted=deleted,
+                                        audit_period_beginning=str(audit_beginning),
+                                        audit_period_ending=str(audit_ending),
+                                        tenant_id=TENANT_ID_1)
+        raw = utils.create_raw(self.mox, utils.decimal_utc(audit_ending),
+                               event='compute.instance.exists',
+                               instance=instance,
+                               json_str=json.dumps(notif))
+        values = {
+            'message_id': message_id,
+            'instance': instance,
+            'launched_at': utils.decimal_utc(launch_time),
+            'audit_period_beginning': utils.decimal_utc(audit_beginning),
+            'audit_period_ending': utils.decimal_utc(audit_ending),
+            'instance_type_id': '1',
+            'raw': raw,
+            'tenant': TENANT_ID_1,
+            'rax_options': None,
+            'os_architecture': None,
+            'os_version': None,
+            'os_distro': None,
+        }
+        if delete_time:
+            values['deleted_at'] = utils.decimal_utc(delete_time)
+        return raw, notif[1], values
+
+    def test_process_exists_batched(self):
+        views.configure_caches(exists_batch_size=10)
+        launch_time1 = datetime.datetime(2013, 6, 11, 10, 0, 0)
+        launch_time2 = datetime.datetime(2013, 6, 11, 12, 0, 0)
+        delete_time2 = datetime.datetime(2013, 6, 12, 0, 30, 0)
+        raw1, body1, values1 = self._exists_notification(
+            INSTANCE_ID_1, MESSAGE_ID_1, launch_time1)
+        raw2, body2, values2 = self._exists_notification(
+            INSTANCE_ID_2, MESSAGE_ID_2, launch_time2, delete_time2)
+        launch1 = utils.decimal_utc(launch_time1)
+        launch2 = utils.decimal_utc(launch_time2)
+        usage1 = models.InstanceUsage(instance=INSTANCE_ID_1,
+                                      launched_at=launch1)
+        # Launched later, so not the usage for this exists.
+        other_usage = models.InstanceUsage(instance=INSTANCE_ID_2,
+                                           launched_at=launch2 + 5)
+        delete2 = models.InstanceDeletes(instance=INSTANCE_ID_2,
+                                         launched_at=launch2)
+        views.STACKDB.find_instance_usages(
+            set([(INSTANCE_ID_1, launch1), (INSTANCE_ID_2, launch2)]))\
+                     .AndReturn([usage1, other_usage])
+        views.STACKDB.find_instance_deletes(set([(INSTANCE_ID_2, launch2)]))\
+                     .AndReturn([delete2])
+        values1['usage'] = usage1
+        values2['delete'] = delete2
+        views.STACKDB.create_instance_exists(**values1).AndReturn('exists1')
+        views.STACKDB.create_instance_exists(**values2).AndReturn('exists2')
+        views.STACKDB.create_instance_exists_batch(['exists1', 'exists2'])
+        self.mox.ReplayAll()
+
+        views._process_exists(raw1, body1)
+        views._process_exists(raw2, body2)
+        self.assertEqual(len(views.PENDING_EXISTS), 2)
+        views.flush_caches()
+
+        self.assertEqual(views.PENDING_EXISTS, [])
+        self.mox.VerifyAll()
+
+    def test_process_exists_flushes_full_batch(self):
+        views.configure_caches(exists_batch_size=1)
+        launch_time = datetime.datetime(2013, 6, 11, 10, 0, 0)
+        raw, body, values = self._exists_notification(
+            INSTANCE_ID_1, MESSAGE_ID_1, launch_time)
+        launch = utils.decimal_utc(launch_time)
+        views.STACKDB.find_instance_usages(set([(INSTANCE_ID_1, launch)]))\
+                     .AndReturn([])
+        views.STACKDB.create_instance_exists(**values).AndReturn('exists')
+        views.STACKDB.create_instance_exists_batch(['exists'])
+        self.mox.ReplayAll()
+
+        views._process_exists(raw, body)
+
+        self.assertEqual(views.PENDING_EXISTS, [])
+        self.mox.VerifyAll()
+
+    def test_aggregate_usage_flushes_exists_before_other_events(self):
+        views.configure_caches(exists_batch_size=10)
+        self.mox.StubOutWithMock(views, 'flush_exists')
+        delete_time = datetime.datetime.utcnow()
+        delete_decimal = utils.decimal_utc(delete_time)
+        notif = utils.create_nova_notif(request_id=REQUEST_ID_1,
+                                        deleted=str(delete_time))
+        raw = utils.create_raw(self.mox, delete_decimal,
+                               event='compute.instance.delete.end',
+                               json_str=json.dumps(notif))
+        views.flush_exists()
+        delete = self.mox.CreateMockAnything()
+        views.STACKDB.get_or_create_instance_delete(instance=INSTANCE_ID_1,
+                                                    deleted_at=delete_decimal)\
+                     .AndReturn((delete, True))
+        views.STACKDB.save(delete)
+        self.mox.ReplayAll()
+
+        views.aggregate_usage(raw, notif[1])
+
+        self.mox.VerifyAll()
+
+    def test_reset_caches_drops_pending_exists(self):
+        views.configure_caches(exists_batch_size=10)
+        views.PENDING_EXISTS.append({'instance': INSTANCE_ID_1})
+        views.reset_caches()
+        self.assertEqual(views.PENDING_EXISTS, [])
+
     def test_process_exists_no_launched_at(self):
         current_time = datetime.datetime.utcnow()
         current_decimal = utils.decimal_utc(current_time)
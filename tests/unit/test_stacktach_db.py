@@ -19,11 +19,17 @@
 # IN THE SOFTWARE.
 
 import datetime
+import decimal
 import unittest
 
+from django.db import DatabaseError
+from django.db import IntegrityError
+from django.db import transaction
+from django.db.models import Q
 import mox
 
 from stacktach import db
+from stacktach import sketch
 from stacktach import stacklog
 from stacktach import models
 
@@ -35,12 +41,24 @@ class StacktachDBTestCase(unittest.TestCase):
         self.mox.StubOutWithMock(stacklog, 'get_logger')
         self.mox.StubOutWithMock(models, 'RawData', use_mock_anything=True)
         models.RawData.objects = self.mox.CreateMockAnything()
+        self.mox.StubOutWithMock(models, 'RawDataImageMeta',
+                                 use_mock_anything=True)
+        models.RawDataImageMeta.objects = self.mox.CreateMockAnything()
+        self.mox.StubOutWithMock(models, 'RawDataBody',
+                                 use_mock_anything=True)
+        models.RawDataBody.objects = self.mox.CreateMockAnything()
         self.mox.StubOutWithMock(models, 'Deployment', use_mock_anything=True)
         models.Deployment.objects = self.mox.CreateMockAnything()
         self.mox.StubOutWithMock(models, 'Lifecycle', use_mock_anything=True)
         models.Lifecycle.objects = self.mox.CreateMockAnything()
         self.mox.StubOutWithMock(models, 'Timing', use_mock_anything=True)
         models.Timing.objects = self.mox.CreateMockAnything()
+        self.mox.StubOutWithMock(models, 'TimingSummary',
+                                 use_mock_anything=True)
+        models.TimingSummary.objects = self.mox.CreateMockAnything()
+        self.mox.StubOutWithMock(models, 'TimingSketch',
+                                 use_mock_anything=True)
+        models.TimingSketch.objects = self.mox.CreateMockAnything()
         self.mox.StubOutWithMock(models, 'RequestTracker',
                                  use_mock_anything=True)
         models.RequestTracker.objects = self.mox.CreateMockAnything()
@@ -71,9 +89,8 @@ class StacktachDBTestCase(unittest.TestCase):
         filters = {'field1': 'value1', 'field2': 'value2'}
         results = self.mox.CreateMockAnything()
         Model.objects.filter(**filters).AndReturn(results)
-        results.count().AndReturn(1)
         object = self.mox.CreateMockAnything()
-        results[0].AndReturn(object)
+        results.__getslice__(0, 2).AndReturn([object])
         self.mox.ReplayAll()
         returned = db._safe_get(Model, **filters)
         self.assertEqual(returned, object)
@@ -86,7 +103,7 @@ class StacktachDBTestCase(unittest.TestCase):
         filters = {'field1': 'value1', 'field2': 'value2'}
         results = self.mox.CreateMockAnything()
         Model.objects.filter(**filters).AndReturn(results)
-        results.count().AndReturn(0)
+        results.__getslice__(0, 2).AndReturn([])
         log = self.mox.CreateMockAnything()
         self.setup_mock_log()
         self.log.warn('No records found for Model get.')
@@ -102,16 +119,48 @@ class StacktachDBTestCase(unittest.TestCase):
         filters = {'field1': 'value1', 'field2': 'value2'}
         results = self.mox.CreateMockAnything()
         Model.objects.filter(**filters).AndReturn(results)
-        results.count().AndReturn(2)
+        object = self.mox.CreateMockAnything()
+        results.__getslice__(0, 2).AndReturn([object, object])
         self.setup_mock_log()
         self.log.warn('Multiple records found for Model get.')
-        object = self.mox.CreateMockAnything()
-        results[0].AndReturn(object)
         self.mox.ReplayAll()
         returned = db._safe_get(Model, **filters)
         self.assertEqual(returned, object)
         self.mox.VerifyAll()
 
+    def test_safe_get_or_create(self):
+        Model = self.mox.CreateMockAnything()
+        Model.objects = self.mox.CreateMockAnything()
+        params = {'field1': 'value1', 'field2': 'value2'}
+        object = self.mox.CreateMockAnything()
+        Model.objects.get_or_create(**params).AndReturn((object, True))
+        self.mox.ReplayAll()
+        returned = db._safe_get_or_create(Model, **params)
+        self.assertEqual(returned, (object, True))
+        self.mox.VerifyAll()
+
+    def test_safe_get_or_create_multiple_results(self):
+        class MultipleObjectsReturned(Exception):
+            pass
+        Model = self.mox.CreateMockAnything()
+        Model.__name__ = 'Model'
+        Model.MultipleObjectsReturned = MultipleObjectsReturned
+        Model.objects = self.mox.CreateMockAnything()
+        params = {'field1': 'value1', 'field2': 'value2'}
+        Model.objects.get_or_create(**params)\
+             .AndRaise(MultipleObjectsReturned())
+        self.setup_mock_log()
+        self.log.warn('Multiple records found for Model get_or_create.')
+        results = self.mox.CreateMockAnything()
+        Model.objects.filter(**params).AndReturn(results)
+        results.order_by('id').AndReturn(results)
+        object = self.mox.CreateMockAnything()
+        results[0].AndReturn(object)
+        self.mox.ReplayAll()
+        returned = db._safe_get_or_create(Model, **params)
+        self.assertEqual(returned, (object, False))
+        self.mox.VerifyAll()
+
     def test_get_or_create_deployment(self):
         deployment = self.mox.CreateMockAnything()
         models.Deployment.objects.get_or_create(name='test').AndReturn(deployment)
@@ -120,6 +169,185 @@ class StacktachDBTestCase(unittest.TestCase):
         self.assertEqual(returned, deployment)
         self.mox.VerifyAll()
 
+    def test_create_rawdata(self):
+        kwargs = {'event': 'compute.instance.create.start',
+                  'json': '{"a": 1}', 'os_distro': 'linux',
+                  'os_version': '1', 'os_architecture': 'x64',
+                  'rax_options': '0'}
+        raw = self.mox.CreateMockAnything()
+        raw.id = 1
+        models.RawData(event='compute.instance.create.start').AndReturn(raw)
+        raw.save()
+        body = self.mox.CreateMockAnything()
+        models.RawDataBody.create(1, '{"a": 1}').AndReturn(body)
+        body.save()
+        meta = self.mox.CreateMockAnything()
+        models.RawDataImageMeta(raw_id=1, os_distro='linux', os_version='1',
+                                os_architecture='x64', rax_options='0')\
+              .AndReturn(meta)
+        meta.save()
+        self.mox.ReplayAll()
+        self.assertEqual(db.create_rawdata(**kwargs), raw)
+        self.assertEqual(raw.json, '{"a": 1}')
+        self.mox.VerifyAll()
+
+    def test_create_rawdata_headers_only(self):
+        raw = self.mox.CreateMockAnything()
+        raw.id = 1
+        models.RawData(event='compute.instance.update').AndReturn(raw)
+        raw.save()
+        self.mox.ReplayAll()
+        self.assertEqual(db.create_rawdata(event='compute.instance.update',
+                                           json=''), raw)
+        self.assertEqual(raw.json, '')
+        self.mox.VerifyAll()
+
+    def test_create_rawdata_batch(self):
+        kwargs1 = {'event': 'compute.instance.create.start',
+                   'json': '{"a": 1}', 'os_distro': 'linux',
+                   'os_version': '1', 'os_architecture': 'x64',
+                   'rax_options': '0'}
+        kwargs2 = {'event': 'compute.instance.create.end',
+                   'os_distro': 'windows', 'os_version': '2',
+                   'os_architecture': 'x86', 'rax_options': '1'}
+        self.mox.StubOutWithMock(transaction, 'is_managed')
+        transaction.is_managed().AndReturn(False)
+        self.mox.StubOutWithMock(transaction, 'commit_on_success')
+        trans_obj = self.mox.CreateMockAnything()
+        transaction.commit_on_success().AndReturn(trans_obj)
+        trans_obj.__enter__()
+        raw1 = self.mox.CreateMockAnything()
+        raw1.id = 1
+        models.RawData(event='compute.instance.create.start')\
+              .AndReturn(raw1)
+        raw1.save()
+        body1 = self.mox.CreateMockAnything()
+        models.RawDataBody.create(1, '{"a": 1}').AndReturn(body1)
+        meta1 = self.mox.CreateMockAnything()
+        models.RawDataImageMeta(raw_id=1, os_distro='linux', os_version='1',
+                                os_architecture='x64', rax_options='0')\
+              .AndReturn(meta1)
+        raw2 = self.mox.CreateMockAnything()
+        raw2.id = 2
+        models.RawData(event='compute.instance.create.end').AndReturn(raw2)
+        raw2.save()
+        meta2 = self.mox.CreateMockAnything()
+        models.RawDataImageMeta(raw_id=2, os_distro='windows',
+                                os_version='2', os_architecture='x86',
+                                rax_options='1').AndReturn(meta2)
+        models.RawDataBody.objects.bulk_create([body1])
+        models.RawDataImageMeta.objects.bulk_create([meta1, meta2])
+        trans_obj.__exit__(None, None, None)
+        self.mox.ReplayAll()
+        raws = db.create_rawdata_batch([kwargs1, kwargs2])
+        self.assertEqual(raws, [raw1, raw2])
+        self.mox.VerifyAll()
+
+    def test_create_rawdata_batch_in_transaction(self):
+        self.mox.StubOutWithMock(transaction, 'is_managed')
+        transaction.is_managed().AndReturn(True)
+        self.mox.StubOutWithMock(transaction, 'commit_on_success')
+        raw = self.mox.CreateMockAnything()
+        models.RawData(event='compute.instance.update').AndReturn(raw)
+        raw.save()
+        self.mox.ReplayAll()
+        raws = db.create_rawdata_batch([{'event': 'compute.instance.update'}])
+        self.assertEqual(raws, [raw])
+        self.mox.VerifyAll()
+
+    def _setup_transaction(self, attempts):
+        self.mox.StubOutWithMock(transaction, 'is_managed')
+        transaction.is_managed().AndReturn(False)
+        self.mox.StubOutWithMock(transaction, 'commit_on_success')
+        trans_obj = self.mox.CreateMockAnything()
+        for attempt in range(attempts):
+            transaction.commit_on_success().AndReturn(trans_obj)
+            trans_obj.__enter__()
+            trans_obj.__exit__(mox.IgnoreArg(), mox.IgnoreArg(),
+                               mox.IgnoreArg()).AndReturn(False)
+        self.mox.StubOutWithMock(db.time, 'sleep')
+        for retry in range(attempts - 1):
+            db.time.sleep(mox.IgnoreArg())
+
+    def test_transactional(self):
+        self._setup_transaction(1)
+        func = self.mox.CreateMockAnything()
+        func('arg', key='value').AndReturn('result')
+        self.mox.ReplayAll()
+        self.assertEqual(db.transactional(func, 'arg', key='value'),
+                         'result')
+        self.mox.VerifyAll()
+
+    def _stub_hooks(self, calls):
+        self.mox.stubs.Set(db, 'COMMIT_HOOKS',
+                           [lambda: calls.append('commit')])
+        self.mox.stubs.Set(db, 'ROLLBACK_HOOKS',
+                           [lambda: calls.append('rollback')])
+
+    def test_transactional_commit_hooks(self):
+        self._setup_transaction(1)
+        func = self.mox.CreateMockAnything()
+        func().AndReturn('result')
+        calls = []
+        self._stub_hooks(calls)
+        self.mox.ReplayAll()
+        self.assertEqual(db.transactional(func), 'result')
+        self.assertEqual(calls, ['commit'])
+        self.mox.VerifyAll()
+
+    def test_transactional_rollback_hooks(self):
+        self._setup_transaction(1)
+        func = self.mox.CreateMockAnything()
+        func().AndRaise(DatabaseError(1146, "Table doesn't exist"))
+        calls = []
+        self._stub_hooks(calls)
+        self.mox.ReplayAll()
+        self.assertRaises(DatabaseError, db.transactional, func)
+        self.assertEqual(calls, ['rollback'])
+        self.mox.VerifyAll()
+
+    def test_transactional_retries_deadlock(self):
+        self._setup_transaction(2)
+        func = self.mox.CreateMockAnything()
+        func().AndRaise(DatabaseError(1213, 'Deadlock found when trying '
+                                            'to get lock'))
+        func().AndReturn('result')
+        self.setup_mock_log()
+        self.log.warn(mox.StrContains('Deadlock on attempt 1'))
+        self.mox.ReplayAll()
+        self.assertEqual(db.transactional(func), 'result')
+        self.mox.VerifyAll()
+
+    def test_transactional_gives_up(self):
+        self._setup_transaction(db.DEADLOCK_RETRIES)
+        func = self.mox.CreateMockAnything()
+        for attempt in range(db.DEADLOCK_RETRIES):
+            func().AndRaise(DatabaseError(1205, 'Lock wait timeout'))
+        for attempt in range(db.DEADLOCK_RETRIES - 1):
+            self.setup_mock_log()
+            self.log.warn(mox.IgnoreArg())
+        self.mox.ReplayAll()
+        self.assertRaises(DatabaseError, db.transactional, func)
+        self.mox.VerifyAll()
+
+    def test_transactional_other_errors_not_retried(self):
+        self._setup_transaction(1)
+        func = self.mox.CreateMockAnything()
+        func().AndRaise(DatabaseError(1146, "Table doesn't exist"))
+        self.mox.ReplayAll()
+        self.assertRaises(DatabaseError, db.transactional, func)
+        self.mox.VerifyAll()
+
+    def test_transactional_nested(self):
+        self.mox.StubOutWithMock(transaction, 'is_managed')
+        transaction.is_managed().AndReturn(True)
+        self.mox.StubOutWithMock(transaction, 'commit_on_success')
+        func = self.mox.CreateMockAnything()
+        func().AndReturn('result')
+        self.mox.ReplayAll()
+        self.assertEqual(db.transactional(func), 'result')
+        self.mox.VerifyAll()
+
     def _test_db_create_func(self, Model, func):
         params = {'field1': 'value1', 'field2': 'value2'}
         object = self.mox.CreateMockAnything()
@@ -164,12 +392,76 @@ class StacktachDBTestCase(unittest.TestCase):
         self.assertEqual(returned, results)
         self.mox.VerifyAll()
 
+    def test_find_stored_message_ids(self):
+        deployment = self.mox.CreateMockAnything()
+        results = self.mox.CreateMockAnything()
+        models.RawData.objects.filter(deployment=deployment,
+                                      message_id__in=['id1', 'id2'])\
+                              .AndReturn(results)
+        results.values_list('message_id', flat=True).AndReturn(['id1'])
+        self.mox.ReplayAll()
+        stored = db.find_stored_message_ids(deployment, ['id1', 'id2'])
+        self.assertEqual(stored, set(['id1']))
+        self.mox.VerifyAll()
+
+    def test_find_stored_message_ids_none(self):
+        self.mox.ReplayAll()
+        self.assertEqual(db.find_stored_message_ids(None, []), set())
+        self.mox.VerifyAll()
+
+    def test_find_recent_message_ids(self):
+        deployment = self.mox.CreateMockAnything()
+        results = self.mox.CreateMockAnything()
+        since = decimal.Decimal('1371018652.790476')
+        models.RawData.objects.filter(deployment=deployment,
+                                      when__gte=since).AndReturn(results)
+        results.exclude(message_id=None).AndReturn(results)
+        results.values_list('message_id', flat=True).AndReturn(results)
+        results.iterator().AndReturn(iter(['id1']))
+        self.mox.ReplayAll()
+        recent = db.find_recent_message_ids(deployment, since)
+        self.assertEqual(list(recent), ['id1'])
+        self.mox.VerifyAll()
+
     def test_find_lifecycles(self):
-        self._test_db_find_func(models.Lifecycle, db.find_lifecycles)
+        params = {'field1': 'value1', 'field2': 'value2'}
+        results = self.mox.CreateMockAnything()
+        models.Lifecycle.objects.select_related().AndReturn(results)
+        results.filter(**params).AndReturn(results)
+        results.order_by('id').AndReturn(results)
+        self.mox.ReplayAll()
+        returned = db.find_lifecycles(**params)
+        self.assertEqual(returned, results)
+        self.mox.VerifyAll()
 
     def test_find_timings(self):
         self._test_db_find_func(models.Timing, db.find_timings)
 
+    def test_find_open_timing(self):
+        timing = self.mox.CreateMockAnything()
+        results = self.mox.CreateMockAnything()
+        models.Timing.objects.filter(name='compute.instance.reboot',
+                                     lifecycle=1, is_open=True)\
+                             .AndReturn(results)
+        results.order_by('-id').AndReturn(results)
+        results.__getslice__(0, 1).AndReturn([timing])
+        self.mox.ReplayAll()
+        returned = db.find_open_timing('compute.instance.reboot', 1)
+        self.assertEqual(returned, timing)
+        self.mox.VerifyAll()
+
+    def test_find_open_timing_none(self):
+        results = self.mox.CreateMockAnything()
+        models.Timing.objects.filter(name='compute.instance.reboot',
+                                     lifecycle=1, is_open=True)\
+                             .AndReturn(results)
+        results.order_by('-id').AndReturn(results)
+        results.__getslice__(0, 1).AndReturn([])
+        self.mox.ReplayAll()
+        self.assertEqual(db.find_open_timing('compute.instance.reboot', 1),
+                         None)
+        self.mox.VerifyAll()
+
     def test_find_request_trackers(self):
         self._test_db_find_func(models.RequestTracker,
                                 db.find_request_trackers,
@@ -196,9 +488,8 @@ class StacktachDBTestCase(unittest.TestCase):
         filters = {'field1': 'value1', 'field2': 'value2'}
         results = self.mox.CreateMockAnything()
         models.InstanceUsage.objects.filter(**filters).AndReturn(results)
-        results.count().AndReturn(1)
         usage = self.mox.CreateMockAnything()
-        results[0].AndReturn(usage)
+        results.__getslice__(0, 2).AndReturn([usage])
         self.mox.ReplayAll()
         returned = db.get_instance_usage(**filters)
         self.assertEqual(returned, usage)
@@ -208,17 +499,179 @@ class StacktachDBTestCase(unittest.TestCase):
         filters = {'field1': 'value1', 'field2': 'value2'}
         results = self.mox.CreateMockAnything()
         models.InstanceDeletes.objects.filter(**filters).AndReturn(results)
-        results.count().AndReturn(1)
         usage = self.mox.CreateMockAnything()
-        results[0].AndReturn(usage)
+        results.__getslice__(0, 2).AndReturn([usage])
         self.mox.ReplayAll()
         returned = db.get_instance_delete(**filters)
         self.assertEqual(returned, usage)
         self.mox.VerifyAll()
 
+    def _launches(self, expected):
+        return mox.Func(lambda q: str(q) == str(expected))
+
+    def test_find_instance_usages(self):
+        results = self.mox.CreateMockAnything()
+        expected = (Q(instance='1', launched_at__range=(10, 11)) |
+                    Q(instance='2', launched_at__range=(20, 21)))
+        models.InstanceUsage.objects.filter(self._launches(expected))\
+                                    .AndReturn(results)
+        results.order_by('id').AndReturn(results)
+        self.mox.ReplayAll()
+        returned = db.find_instance_usages(set([('2', 20), ('1', 10)]))
+        self.assertEqual(returned, results)
+        self.mox.VerifyAll()
+
+    def test_find_instance_deletes(self):
+        results = self.mox.CreateMockAnything()
+        expected = Q(instance='1', launched_at__range=(10, 11))
+        models.InstanceDeletes.objects.filter(self._launches(expected))\
+                                      .AndReturn(results)
+        results.order_by('id').AndReturn(results)
+        self.mox.ReplayAll()
+        returned = db.find_instance_deletes(set([('1', 10)]))
+        self.assertEqual(returned, results)
+        self.mox.VerifyAll()
+
+    def test_create_instance_exists_batch(self):
+        exists = [self.mox.CreateMockAnything()]
+        models.InstanceExists.objects.bulk_create(exists)
+        self.mox.ReplayAll()
+        db.create_instance_exists_batch(exists)
+        self.mox.VerifyAll()
+
     def test_save(self):
         o = self.mox.CreateMockAnything()
         o.save()
         self.mox.ReplayAll()
         db.save(o)
         self.mox.VerifyAll()
+
+    def _summary_query(self, updated):
+        query = self.mox.CreateMockAnything()
+        models.TimingSummary.objects.filter(name='compute.instance.reboot',
+                                            deployment=1, hour=3600)\
+                                    .AndReturn(query)
+        query.update(count=mox.IgnoreArg(), total=mox.IgnoreArg())\
+             .AndReturn(updated)
+        return query
+
+    def _summary_min_max(self, query, diff):
+        query.filter(min__gt=diff).AndReturn(query)
+        query.update(min=diff)
+        query.filter(max__lt=diff).AndReturn(query)
+        query.update(max=diff)
+
+    def test_add_to_timing_summary(self):
+        query = self._summary_query(1)
+        self._summary_min_max(query, 5)
+        self.mox.ReplayAll()
+        db.add_to_timing_summary('compute.instance.reboot', 1, 3600, 5)
+        self.mox.VerifyAll()
+
+    def _stub_savepoints(self):
+        self.mox.StubOutWithMock(transaction, 'savepoint')
+        self.mox.StubOutWithMock(transaction, 'savepoint_commit')
+        self.mox.StubOutWithMock(transaction, 'savepoint_rollback')
+        transaction.savepoint().AndReturn('sid')
+
+    def test_add_to_timing_summary_new_hour(self):
+        self._summary_query(0)
+        self._stub_savepoints()
+        summary = self.mox.CreateMockAnything()
+        models.TimingSummary(name='compute.instance.reboot', deployment_id=1,
+                             hour=3600, count=1, total=5, min=5, max=5)\
+              .AndReturn(summary)
+        summary.save(force_insert=True)
+        transaction.savepoint_commit('sid')
+        self.mox.ReplayAll()
+        db.add_to_timing_summary('compute.instance.reboot', 1, 3600, 5)
+        self.mox.VerifyAll()
+
+    def test_add_to_timing_summary_created_concurrently(self):
+        query = self._summary_query(0)
+        self._stub_savepoints()
+        summary = self.mox.CreateMockAnything()
+        models.TimingSummary(name='compute.instance.reboot', deployment_id=1,
+                             hour=3600, count=1, total=5, min=5, max=5)\
+              .AndReturn(summary)
+        summary.save(force_insert=True).AndRaise(IntegrityError())
+        transaction.savepoint_rollback('sid')
+        query.update(count=mox.IgnoreArg(), total=mox.IgnoreArg())\
+             .AndReturn(1)
+        self._summary_min_max(query, 5)
+        self.mox.ReplayAll()
+        db.add_to_timing_summary('compute.instance.reboot', 1, 3600, 5)
+        self.mox.VerifyAll()
+
+    def _sketch_query(self, rows):
+        query = self.mox.CreateMockAnything()
+        models.TimingSketch.objects.select_for_update().AndReturn(query)
+        query.filter(name='compute.instance.reboot', deployment=1, hour=3600,
+                     image='base', os_type='linux').AndReturn(query)
+        query.__getslice__(0, 1).AndReturn(rows)
+
+    def test_add_to_timing_sketch(self):
+        latencies = sketch.LatencySketch()
+        latencies.add(1)
+        row = self.mox.CreateMockAnything()
+        row.sketch = latencies.to_json()
+        self._sketch_query([row])
+        row.save(force_update=True)
+        self.mox.ReplayAll()
+        db.add_to_timing_sketch('compute.instance.reboot', 1, 3600, 'base',
+                                'linux', 5)
+        self.assertEqual(sketch.LatencySketch.from_json(row.sketch).count, 2)
+        self.mox.VerifyAll()
+
+    def _new_sketch(self):
+        row = self.mox.CreateMockAnything()
+        models.TimingSketch(name='compute.instance.reboot', deployment_id=1,
+                            hour=3600, image='base', os_type='linux',
+                            sketch=mox.IgnoreArg()).AndReturn(row)
+        return row
+
+    def test_add_to_timing_sketch_new_hour(self):
+        self._sketch_query([])
+        self._stub_savepoints()
+        self._new_sketch().save(force_insert=True)
+        transaction.savepoint_commit('sid')
+        self.mox.ReplayAll()
+        db.add_to_timing_sketch('compute.instance.reboot', 1, 3600, 'base',
+                                'linux', 5)
+        self.mox.VerifyAll()
+
+    def test_add_to_timing_sketch_created_concurrently(self):
+        self._sketch_query([])
+        self._stub_savepoints()
+        self._new_sketch().save(force_insert=True).AndRaise(IntegrityError())
+        transaction.savepoint_rollback('sid')
+        row = self.mox.CreateMockAnything()
+        row.sketch = sketch.LatencySketch().to_json()
+        self._sketch_query([row])
+        row.save(force_update=True)
+        self.mox.ReplayAll()
+        db.add_to_timing_sketch('compute.instance.reboot', 1, 3600, 'base',
+                                'linux', 5)
+        self.assertEqual(sketch.LatencySketch.from_json(row.sketch).count, 1)
+        self.mox.VerifyAll()
+
+    def test_update(self):
+        o = self.mox.CreateMockAnything()
+        o.save(force_update=True)
+        self.mox.ReplayAll()
+        db.update(o)
+        self.mox.VerifyAll()
+
+    def test_update_fields(self):
+        class Row(object):
+            objects = self.mox.CreateMockAnything()
+        row = Row()
+        row.id = 1
+        row.tenant = 'tenant'
+        row.launched_at = 2
+        query = self.mox.CreateMockAnything()
+        Row.objects.filter(id=1).AndReturn(query)
+        query.update(tenant='tenant')
+        self.mox.ReplayAll()
+        db.update_fields(row, ['tenant'])
+        self.mox.VerifyAll()
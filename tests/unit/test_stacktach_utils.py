@@ -18,6 +18,10 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
 # IN THE SOFTWARE.
 
+import calendar
+import datetime
+import decimal
+import random
 import unittest
 
 import mox
@@ -61,4 +65,64 @@ class StacktachUtilsTestCase(unittest.TestCase):
 
     def test_is_message_id_like_invalid(self):
         uuid = "$-^&#$"
-        self.assertFalse(stacktach_utils.is_request_id_like(uuid))
\ No newline at end of file
+        self.assertFalse(stacktach_utils.is_request_id_like(uuid))
+
+    def _old_str_time_to_unix(self, when):
+        # The strptime cascade and Decimal arithmetic str_time_to_unix
+        # used before it had a fast path.
+        formats = ["%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%d %H:%M:%S"]
+        if 'T' in when:
+            formats = ["%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S"]
+        try:
+            utc = datetime.datetime.strptime(when, formats[0])
+        except ValueError:
+            utc = datetime.datetime.strptime(when, formats[1])
+        context = decimal.Context(prec=30)
+        return context.add(
+            decimal.Decimal(str(calendar.timegm(utc.utctimetuple()))),
+            context.divide(decimal.Decimal(str(utc.microsecond)),
+                           decimal.Decimal("1000000.0")))
+
+    def _timestamp_corpus(self):
+        rand = random.Random(42)
+        corpus = []
+        for i in range(2000):
+            seconds = rand.randint(0, 2 ** 31)
+            utc = datetime.datetime.utcfromtimestamp(seconds)
+            utc = utc.replace(microsecond=rand.choice(
+                [0, 1, 10, 500000, 790000, rand.randint(0, 999999)]))
+            separator = rand.choice([' ', 'T'])
+            when = utc.strftime('%Y-%m-%d' + separator + '%H:%M:%S')
+            digits = rand.randint(0, 6)
+            if digits:
+                when += '.' + ('%06d' % utc.microsecond)[:digits]
+            corpus.append(when)
+        corpus.extend(['1970-01-01 00:00:00', '2012-02-29 23:59:59.999999',
+                       '2038-01-19T03:14:07.5', '1969-12-31 23:59:59.000005',
+                       '1900-03-01 12:00:00.000001'])
+        return corpus
+
+    def test_str_time_to_unix_matches_strptime(self):
+        for when in self._timestamp_corpus():
+            expected = self._old_str_time_to_unix(when)
+            actual = stacktach_utils.str_time_to_unix(when)
+            self.assertEqual(repr(actual), repr(expected), when)
+
+    def test_str_time_to_epoch_micros(self):
+        micros = stacktach_utils.str_time_to_epoch_micros(
+            '2013-06-12 06:30:52.790476')
+        self.assertEqual(micros, 1371018652790476)
+        micros = stacktach_utils.str_time_to_epoch_micros(
+            '2013-06-12T06:30:52')
+        self.assertEqual(micros, 1371018652000000)
+
+    def test_str_time_to_unix_falls_back_to_strptime(self):
+        # strptime takes unpadded fields, the fast path doesn't.
+        for when in ['2013-6-12 6:30:52', '2013-06-12 06:30:52.',
+                     '2013-02-30 06:30:52']:
+            self.assertEqual(stacktach_utils._fast_epoch_micros(when), None)
+        self.assertEqual(stacktach_utils.str_time_to_unix('2013-6-12 6:30:52'),
+                         decimal.Decimal('1371018652'))
+        self.assertEqual(
+            stacktach_utils.str_time_to_epoch_micros('2013-6-12 6:30:52'),
+            1371018652000000)
@@ -25,8 +25,10 @@ import unittest
 
 import mox
 
+from stacktach import archive
 from stacktach import datetime_to_decimal as dt
 from stacktach import models
+from stacktach import sketch
 from stacktach import stacky_server
 import utils
 from utils import INSTANCE_ID_1
@@ -37,14 +39,22 @@ from utils import REQUEST_ID_1
 class StackyServerTestCase(unittest.TestCase):
     def setUp(self):
         self.mox = mox.Mox()
+        dne_exception = models.RawData.DoesNotExist
         self.mox.StubOutWithMock(models, 'RawData', use_mock_anything=True)
         models.RawData.objects = self.mox.CreateMockAnything()
+        models.RawData.DoesNotExist = dne_exception
         self.mox.StubOutWithMock(models, 'Deployment', use_mock_anything=True)
         models.Deployment.objects = self.mox.CreateMockAnything()
         self.mox.StubOutWithMock(models, 'Lifecycle', use_mock_anything=True)
         models.Lifecycle.objects = self.mox.CreateMockAnything()
         self.mox.StubOutWithMock(models, 'Timing', use_mock_anything=True)
         models.Timing.objects = self.mox.CreateMockAnything()
+        self.mox.StubOutWithMock(models, 'TimingSummary',
+                                 use_mock_anything=True)
+        models.TimingSummary.objects = self.mox.CreateMockAnything()
+        self.mox.StubOutWithMock(models, 'TimingSketch',
+                                 use_mock_anything=True)
+        models.TimingSketch.objects = self.mox.CreateMockAnything()
         self.mox.StubOutWithMock(models, 'RequestTracker',
                                  use_mock_anything=True)
         models.RequestTracker.objects = self.mox.CreateMockAnything()
@@ -128,8 +138,8 @@ class StackyServerTestCase(unittest.TestCase):
         models.Timing.objects.filter(lifecycle=lifecycle).AndReturn(t_result)
         t_result.__iter__().AndReturn([timing].__iter__())
         timing.name = 'name'
-        timing.start_raw = self.mox.CreateMockAnything()
-        timing.end_raw = None
+        timing.start_raw_id = 1
+        timing.end_raw_id = None
         timing.diff = None
         self.mox.ReplayAll()
 
@@ -151,8 +161,8 @@ class StackyServerTestCase(unittest.TestCase):
         models.Timing.objects.filter(lifecycle=lifecycle).AndReturn(t_result)
         t_result.__iter__().AndReturn([timing].__iter__())
         timing.name = 'name'
-        timing.start_raw = None
-        timing.end_raw = self.mox.CreateMockAnything()
+        timing.start_raw_id = None
+        timing.end_raw_id = 2
         timing.diff = None
         self.mox.ReplayAll()
 
@@ -174,8 +184,8 @@ class StackyServerTestCase(unittest.TestCase):
         models.Timing.objects.filter(lifecycle=lifecycle).AndReturn(t_result)
         t_result.__iter__().AndReturn([timing].__iter__())
         timing.name = 'name'
-        timing.start_raw = self.mox.CreateMockAnything()
-        timing.end_raw = self.mox.CreateMockAnything()
+        timing.start_raw_id = 1
+        timing.end_raw_id = 2
         timing.diff = 20
         self.mox.ReplayAll()
         event_names = stacky_server.get_timings_for_uuid(INSTANCE_ID_1)
@@ -428,26 +438,24 @@ class StackyServerTestCase(unittest.TestCase):
         self.assertEqual(json_resp[2], [INSTANCE_ID_2, '0d 00:00:20'])
         self.mox.VerifyAll()
 
+    def _annotate_summaries(self, results):
+        results.annotate(n=mox.IgnoreArg(), total=mox.IgnoreArg(),
+                         min=mox.IgnoreArg(), max=mox.IgnoreArg())\
+               .AndReturn(results)
+
     def test_do_summary(self):
         fake_request = self.mox.CreateMockAnything()
-        self.mox.StubOutWithMock(stacky_server, 'get_event_names')
-        events = [{'event': 'test.start'}, {'event': 'test.end'}]
-        stacky_server.get_event_names().AndReturn(events)
-        fake_request.GET = {'name': 'test.event'}
+        fake_request.GET = {}
         results = self.mox.CreateMockAnything()
-        models.Timing.objects.filter(name='test').AndReturn(results)
-        results.exclude(mox.IgnoreArg()).AndReturn(results)
-        results.exclude(diff__lt=0).AndReturn(results)
-        timing1 = self.mox.CreateMockAnything()
-        timing1.lifecycle = self.mox.CreateMockAnything()
-        timing1.lifecycle.instance = INSTANCE_ID_1
-        timing1.diff = 10
-        timing2 = self.mox.CreateMockAnything()
-        timing2.lifecycle = self.mox.CreateMockAnything()
-        timing2.lifecycle.instance = INSTANCE_ID_2
-        timing2.diff = 20
-        results.__len__().AndReturn(2)
-        results.__iter__().AndReturn([timing1, timing2].__iter__())
+        models.TimingSummary.objects.all().AndReturn(results)
+        results.values('name').AndReturn(results)
+        self._annotate_summaries(results)
+        results.order_by('name').AndReturn(results)
+        summaries = [{'name': 'test', 'n': 2, 'total': decimal.Decimal(30),
+                      'min': decimal.Decimal(10), 'max': decimal.Decimal(20)},
+                     {'name': 'empty', 'n': 0, 'total': decimal.Decimal(0),
+                      'min': None, 'max': None}]
+        results.__iter__().AndReturn(summaries.__iter__())
         self.mox.ReplayAll()
 
         resp = stacky_server.do_summary(fake_request)
@@ -460,6 +468,112 @@ class StackyServerTestCase(unittest.TestCase):
 
         self.mox.VerifyAll()
 
+    def test_do_summary_end_when_min_max(self):
+        fake_request = self.mox.CreateMockAnything()
+        fake_request.GET = {'end_when_min': '7205.5',
+                            'end_when_max': '10800.1'}
+        results = self.mox.CreateMockAnything()
+        models.TimingSummary.objects.all().AndReturn(results)
+        results.filter(hour__gte=7200).AndReturn(results)
+        results.filter(hour__lte=decimal.Decimal('10800.1'))\
+               .AndReturn(results)
+        results.values('name').AndReturn(results)
+        self._annotate_summaries(results)
+        results.order_by('name').AndReturn(results)
+        results.__iter__().AndReturn([].__iter__())
+        self.mox.ReplayAll()
+
+        resp = stacky_server.do_summary(fake_request)
+        self.assertEqual(resp.status_code, 200)
+        json_resp = json.loads(resp.content)
+        self.assertEqual(json_resp, [["Event", "N", "Min", "Max", "Avg"]])
+        self.mox.VerifyAll()
+
+    def test_do_timings_hourly(self):
+        fake_request = self.mox.CreateMockAnything()
+        fake_request.GET = {'name': 'test'}
+        results = self.mox.CreateMockAnything()
+        models.TimingSummary.objects.all().AndReturn(results)
+        results.filter(name='test').AndReturn(results)
+        results.values('hour', 'deployment__name').AndReturn(results)
+        self._annotate_summaries(results)
+        results.order_by('hour', 'deployment__name').AndReturn(results)
+        hour = dt.dt_to_decimal(datetime.datetime(2013, 6, 12, 6))
+        summaries = [{'hour': hour, 'deployment__name': 'dep1', 'n': 4,
+                      'total': decimal.Decimal(100),
+                      'min': decimal.Decimal('1.5'),
+                      'max': decimal.Decimal(60)}]
+        results.__iter__().AndReturn(summaries.__iter__())
+        self.mox.ReplayAll()
+
+        resp = stacky_server.do_timings_hourly(fake_request)
+        self.assertEqual(resp.status_code, 200)
+        json_resp = json.loads(resp.content)
+        self.assertEqual(len(json_resp), 2)
+        self.assertEqual(json_resp[0], ["Hour", "Deployment", "N", "Min",
+                                        "Max", "Avg"])
+        self.assertEqual(json_resp[1], [u'2013-06-12 06:00:00', u'dep1', 4,
+                                        u'0d 00:00:01.5', u'0d 00:01:00.0',
+                                        u'0d 00:00:25'])
+        self.mox.VerifyAll()
+
+    def test_do_timings_percentiles(self):
+        fake_request = self.mox.CreateMockAnything()
+        fake_request.GET = {'name': 'test', 'deployments': '1,2',
+                            'percentiles': '50,99'}
+        results = self.mox.CreateMockAnything()
+        models.TimingSketch.objects.all().AndReturn(results)
+        results.filter(name='test').AndReturn(results)
+        results.filter(deployment__in=[1, 2]).AndReturn(results)
+        first = sketch.LatencySketch()
+        second = sketch.LatencySketch()
+        for value in range(1, 51):
+            first.add(value)
+        for value in range(51, 101):
+            second.add(value)
+        other = sketch.LatencySketch()
+        other.add(10)
+        rows = [('test', 'base', 'linux', first.to_json()),
+                ('test', 'snap', 'linux', other.to_json()),
+                ('test', 'base', 'linux', second.to_json())]
+        results.values_list('name', 'image', 'os_type', 'sketch')\
+               .AndReturn(rows)
+        self.mox.ReplayAll()
+
+        resp = stacky_server.do_timings_percentiles(fake_request)
+        self.assertEqual(resp.status_code, 200)
+        json_resp = json.loads(resp.content)
+        self.assertEqual(len(json_resp), 3)
+        self.assertEqual(json_resp[0], ["Event", "Image", "OS Type", "N",
+                                        "Min", "Max", "Avg", "50%", "99%"])
+        self.assertEqual(json_resp[1][:7], [u'test', u'base', u'linux', 100,
+                                            u'0d 00:00:01.0',
+                                            u'0d 00:01:40.0',
+                                            u'0d 00:00:50.5'])
+        # Within the sketch's 1% of 50 and 99.
+        self.assertEqual(json_resp[1][7:], [u'0d 00:00:49.90',
+                                            u'0d 00:01:38.50'])
+        self.assertEqual(json_resp[2][:4], [u'test', u'snap', u'linux', 1])
+        self.mox.VerifyAll()
+
+    def test_do_timings_percentiles_bad_percentile(self):
+        fake_request = self.mox.CreateMockAnything()
+        fake_request.GET = {'percentiles': '50,x'}
+        self.mox.ReplayAll()
+
+        resp = stacky_server.do_timings_percentiles(fake_request)
+        self.assertEqual(resp.status_code, 400)
+        self.mox.VerifyAll()
+
+    def test_do_timings_percentiles_out_of_range(self):
+        fake_request = self.mox.CreateMockAnything()
+        fake_request.GET = {'percentiles': '101'}
+        self.mox.ReplayAll()
+
+        resp = stacky_server.do_timings_percentiles(fake_request)
+        self.assertEqual(resp.status_code, 400)
+        self.mox.VerifyAll()
+
     def test_do_request(self):
         fake_request = self.mox.CreateMockAnything()
         fake_request.GET = {'request_id': REQUEST_ID_1}
@@ -534,6 +648,34 @@ class StackyServerTestCase(unittest.TestCase):
         self._assert_on_show(json_resp[0], raw)
         self.mox.VerifyAll()
 
+    def test_do_show_archived(self):
+        fake_request = self.mox.CreateMockAnything()
+        raw = self._create_raw()
+        models.RawData.objects.get(id=1)\
+                              .AndRaise(models.RawData.DoesNotExist())
+        self.mox.StubOutWithMock(archive, 'load_rawdata')
+        archive.load_rawdata(1).AndReturn(raw)
+        self.mox.ReplayAll()
+
+        resp = stacky_server.do_show(fake_request, 1)
+
+        self.assertEqual(resp.status_code, 200)
+        json_resp = json.loads(resp.content)
+        self.assertEqual(len(json_resp), 3)
+        self._assert_on_show(json_resp[0], raw)
+        self.mox.VerifyAll()
+
+    def test_do_show_missing(self):
+        fake_request = self.mox.CreateMockAnything()
+        models.RawData.objects.get(id=1)\
+                              .AndRaise(models.RawData.DoesNotExist())
+        self.mox.StubOutWithMock(archive, 'load_rawdata')
+        archive.load_rawdata(1).AndReturn(None)
+        self.mox.ReplayAll()
+
+        self.assertEqual(stacky_server.do_show(fake_request, 1), [])
+        self.mox.VerifyAll()
+
     def test_do_watch(self):
         fake_request = self.mox.CreateMockAnything()
         fake_request.GET = {}
@@ -0,0 +1,73 @@
+# Copyright (c) 2013 - Rackspace Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+import unittest
+
+from stacktach import storage_policy
+from stacktach.storage_policy import StoragePolicy
+
+
+class StoragePolicyTestCase(unittest.TestCase):
+    def test_default_is_full(self):
+        policy = StoragePolicy()
+        self.assertEqual(policy.decide('monitor.info',
+                                       'compute.instance.update'),
+                         storage_policy.FULL)
+
+    def test_first_matching_rule_wins(self):
+        policy = StoragePolicy([
+            {'event_type': 'compute.instance.update',
+             'routing_key': 'monitor.error', 'store': 'full'},
+            {'event_type': 'compute.instance.update', 'store': 'headers'},
+            {'event_type': 'compute.*', 'store': 'drop'}])
+        self.assertEqual(policy.decide('monitor.info',
+                                       'compute.instance.update'),
+                         storage_policy.HEADERS)
+        self.assertEqual(policy.decide('monitor.error',
+                                       'compute.instance.update'),
+                         storage_policy.FULL)
+        self.assertEqual(policy.decide('monitor.info',
+                                       'compute.instance.reboot.start'),
+                         storage_policy.DROP)
+        self.assertEqual(policy.decide('monitor.info',
+                                       'scheduler.run_instance.start'),
+                         storage_policy.FULL)
+
+    def test_sample(self):
+        policy = StoragePolicy([{'event_type': 'compute.instance.update',
+                                 'store': 'sample', 'sample_rate': 3}])
+        decisions = [policy.decide('monitor.info', 'compute.instance.update')
+                     for i in range(7)]
+        self.assertEqual(decisions, [storage_policy.FULL,
+                                     storage_policy.DROP,
+                                     storage_policy.DROP,
+                                     storage_policy.FULL,
+                                     storage_policy.DROP,
+                                     storage_policy.DROP,
+                                     storage_policy.FULL])
+
+    def test_unknown_policy(self):
+        self.assertRaises(ValueError, StoragePolicy,
+                          [{'event_type': '*', 'store': 'compress'}])
+
+    def test_bad_sample_rate(self):
+        self.assertRaises(ValueError, StoragePolicy,
+                          [{'event_type': '*', 'store': 'sample',
+                            'sample_rate': 0}])
@@ -30,6 +30,7 @@ import kombu.entity
 import kombu.pools
 import mox
 
+from stacktach import archive
 from stacktach import datetime_to_decimal as dt
 from stacktach import models
 from utils import INSTANCE_ID_1
@@ -56,6 +57,8 @@ class VerifierTestCase(unittest.TestCase):
         self.mox = mox.Mox()
         self.mox.StubOutWithMock(models, 'RawData', use_mock_anything=True)
         models.RawData.objects = self.mox.CreateMockAnything()
+        self.mox.StubOutWithMock(models, 'RawDataBody',
+                                 use_mock_anything=True)
         self.mox.StubOutWithMock(models, 'Deployment', use_mock_anything=True)
         models.Deployment.objects = self.mox.CreateMockAnything()
         self.mox.StubOutWithMock(models, 'Lifecycle', use_mock_anything=True)
@@ -585,7 +588,7 @@ class VerifierTestCase(unittest.TestCase):
             'status': 'pending'
         }
         results.filter(**filters).AndReturn(results)
-        results.order_by('id').AndReturn(results)
+        results.order_by('audit_period_ending', 'id').AndReturn(results)
         results.count().AndReturn(2)
         exist1 = self.mox.CreateMockAnything()
         exist2 = self.mox.CreateMockAnything()
@@ -614,7 +617,7 @@ class VerifierTestCase(unittest.TestCase):
             'status': 'pending'
         }
         results.filter(**filters).AndReturn(results)
-        results.order_by('id').AndReturn(results)
+        results.order_by('audit_period_ending', 'id').AndReturn(results)
         results.count().AndReturn(2)
         exist1 = self.mox.CreateMockAnything()
         exist2 = self.mox.CreateMockAnything()
@@ -634,7 +637,7 @@ class VerifierTestCase(unittest.TestCase):
         connection = self.mox.CreateMockAnything()
         exchange = self.mox.CreateMockAnything()
         exist = self.mox.CreateMockAnything()
-        exist.raw = self.mox.CreateMockAnything()
+        exist.raw_id = 1
         exist_dict = [
             'monitor.info',
             {
@@ -643,7 +646,7 @@ class VerifierTestCase(unittest.TestCase):
             }
         ]
         exist_str = json.dumps(exist_dict)
-        exist.raw.json = exist_str
+        models.RawDataBody.load(1).AndReturn(exist_str)
         self.mox.StubOutWithMock(kombu.pools, 'producers')
         self.mox.StubOutWithMock(kombu.common, 'maybe_declare')
         producer = self.mox.CreateMockAnything()
@@ -664,11 +667,51 @@ class VerifierTestCase(unittest.TestCase):
         dbverifier.send_verified_notification(exist, exchange, connection)
         self.mox.VerifyAll()
 
+    def test_send_verified_notification_archived(self):
+        connection = self.mox.CreateMockAnything()
+        exchange = self.mox.CreateMockAnything()
+        exist = self.mox.CreateMockAnything()
+        exist.raw_id = 1
+        exist_dict = ['monitor.info', {'event_type': 'test',
+                                       'message_id': 'some_uuid'}]
+        models.RawDataBody.load(1).AndReturn('')
+        self.mox.StubOutWithMock(archive, 'load_rawdata')
+        raw = self.mox.CreateMockAnything()
+        raw.json = json.dumps(exist_dict)
+        archive.load_rawdata(1).AndReturn(raw)
+        self.mox.StubOutWithMock(dbverifier, '_send_notification')
+        self.mox.StubOutWithMock(uuid, 'uuid4')
+        uuid.uuid4().AndReturn('some_other_uuid')
+        message = {'event_type': 'compute.instance.exists.verified.old',
+                   'message_id': 'some_other_uuid',
+                   'original_message_id': 'some_uuid'}
+        dbverifier._send_notification(message, 'monitor.info', connection,
+                                      exchange)
+        self.mox.ReplayAll()
+
+        dbverifier.send_verified_notification(exist, connection, exchange)
+        self.mox.VerifyAll()
+
+    def test_send_verified_notification_without_body(self):
+        connection = self.mox.CreateMockAnything()
+        exchange = self.mox.CreateMockAnything()
+        exist = self.mox.CreateMockAnything()
+        exist.id = 5
+        exist.raw_id = 1
+        models.RawDataBody.load(1).AndReturn('')
+        self.mox.StubOutWithMock(archive, 'load_rawdata')
+        archive.load_rawdata(1).AndReturn(None)
+        self.mox.StubOutWithMock(dbverifier, '_send_notification')
+        self.mox.ReplayAll()
+
+        dbverifier.send_verified_notification(exist, connection, exchange)
+        self.mox.VerifyAll()
+
     def test_send_verified_notification_routing_keys(self):
         connection = self.mox.CreateMockAnything()
         exchange = self.mox.CreateMockAnything()
         exist = self.mox.CreateMockAnything()
-        exist.raw = self.mox.CreateMockAnything()
+        exist.raw_id = 1
         exist_dict = [
             'monitor.info',
             {
@@ -677,7 +720,7 @@ class VerifierTestCase(unittest.TestCase):
             }
         ]
         exist_str = json.dumps(exist_dict)
-        exist.raw.json = exist_str
+        models.RawDataBody.load(1).AndReturn(exist_str)
         self.mox.StubOutWithMock(uuid, 'uuid4')
         uuid.uuid4().AndReturn('some_other_uuid')
         self.mox.StubOutWithMock(kombu.pools, 'producers')
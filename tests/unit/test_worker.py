@@ -18,7 +18,11 @@
 # FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
 # IN THE SOFTWARE.
 
+import datetime
+import decimal
 import json
+import os
+import time
 import unittest
 
 import kombu
@@ -26,13 +30,21 @@ import kombu.entity
 import kombu.connection
 import mox
 
+from django import db as django_db
 from stacktach import db, views
 import worker.worker as worker
+from worker import dedup
+from worker import stats as worker_stats
+
+
+def _no_transaction(func, *args, **kwargs):
+    return func(*args, **kwargs)
 
 
 class NovaConsumerTestCase(unittest.TestCase):
     def setUp(self):
         self.mox = mox.Mox()
+        self.mox.stubs.Set(db, 'transactional', _no_transaction)
 
     def tearDown(self):
         self.mox.UnsetStubs()
@@ -69,6 +81,26 @@ class NovaConsumerTestCase(unittest.TestCase):
         self.assertTrue(consumer.on_nova in created_callbacks)
         self.mox.VerifyAll()
 
+    def test_get_consumers_with_prefetch(self):
+        kombu_consumer = self.mox.CreateMockAnything()
+        kombu_consumer.qos(prefetch_count=50)
+        def Consumer(queues=None, callbacks=None):
+            return kombu_consumer
+        self.mox.StubOutWithMock(worker.NovaConsumer, '_create_exchange')
+        self.mox.StubOutWithMock(worker.NovaConsumer, '_create_queue')
+        consumer = worker.NovaConsumer('test', None, None, True, {},
+                                       prefetch_count=50)
+        exchange = self.mox.CreateMockAnything()
+        consumer._create_exchange('nova', 'topic').AndReturn(exchange)
+        consumer._create_queue('monitor.info', exchange, 'monitor.info')\
+                .AndReturn(self.mox.CreateMockAnything())
+        consumer._create_queue('monitor.error', exchange, 'monitor.error')\
+                .AndReturn(self.mox.CreateMockAnything())
+        self.mox.ReplayAll()
+        consumers = consumer.get_consumers(Consumer, None)
+        self.assertEqual(consumers, [kombu_consumer])
+        self.mox.VerifyAll()
+
     def test_create_exchange(self):
         args = {'key': 'value'}
         consumer = worker.NovaConsumer('test', None, None, True, args)
@@ -114,6 +146,7 @@ class NovaConsumerTestCase(unittest.TestCase):
     def test_process(self):
         deployment = self.mox.CreateMockAnything()
         raw = self.mox.CreateMockAnything()
+        raw.when = decimal.Decimal('1371018652.790476')
         message = self.mox.CreateMockAnything()
 
         consumer = worker.NovaConsumer('test', None, deployment, True, {})
@@ -124,22 +157,24 @@ class NovaConsumerTestCase(unittest.TestCase):
         self.mox.StubOutWithMock(views, 'process_raw_data',
                                  use_mock_anything=True)
         args = (routing_key, body_dict)
-        views.process_raw_data(deployment, args, json.dumps(args))\
+        raw_json = '["monitor.info", %s]' % message.body
+        views.process_raw_data(deployment, args, raw_json)\
              .AndReturn(raw)
-        message.ack()
         self.mox.StubOutWithMock(views, 'post_process')
         views.post_process(raw, body_dict)
-        self.mox.StubOutWithMock(consumer, '_check_memory',
+        message.ack()
+        self.mox.StubOutWithMock(consumer, '_report_stats',
                                  use_mock_anything=True)
-        consumer._check_memory()
+        consumer._report_stats()
         self.mox.ReplayAll()
         consumer._process(message)
         self.assertEqual(consumer.processed, 1)
         self.mox.VerifyAll()
 
-    def test_process_no_raw_dont_ack(self):
+    def test_process_no_raw_acks_without_post_process(self):
         deployment = self.mox.CreateMockAnything()
         raw = self.mox.CreateMockAnything()
+        raw.when = decimal.Decimal('1371018652.790476')
         message = self.mox.CreateMockAnything()
 
         consumer = worker.NovaConsumer('test', None, deployment, True, {})
@@ -150,16 +185,591 @@ class NovaConsumerTestCase(unittest.TestCase):
         self.mox.StubOutWithMock(views, 'process_raw_data',
                                  use_mock_anything=True)
         args = (routing_key, body_dict)
-        views.process_raw_data(deployment, args, json.dumps(args))\
+        raw_json = '["monitor.info", %s]' % message.body
+        views.process_raw_data(deployment, args, raw_json)\
              .AndReturn(None)
-        self.mox.StubOutWithMock(consumer, '_check_memory',
+        message.ack()
+        self.mox.StubOutWithMock(views, 'post_process')
+        self.mox.StubOutWithMock(consumer, '_report_stats',
                                  use_mock_anything=True)
-        consumer._check_memory()
+        consumer._report_stats()
         self.mox.ReplayAll()
         consumer._process(message)
         self.assertEqual(consumer.processed, 0)
         self.mox.VerifyAll()
 
+    def test_process_with_post_process_pool(self):
+        deployment = self.mox.CreateMockAnything()
+        raw = self.mox.CreateMockAnything()
+        raw.when = decimal.Decimal('1371018652.790476')
+        message = self.mox.CreateMockAnything()
+        pool = self.mox.CreateMockAnything()
+
+        consumer = worker.NovaConsumer('test', None, deployment, True, {},
+                                       post_process_pool=pool)
+        routing_key = 'monitor.info'
+        message.delivery_info = {'routing_key': routing_key}
+        body_dict = {u'key': u'value'}
+        message.body = json.dumps(body_dict)
+        self.mox.StubOutWithMock(views, 'process_raw_data',
+                                 use_mock_anything=True)
+        args = (routing_key, body_dict)
+        raw_json = '["monitor.info", %s]' % message.body
+        views.process_raw_data(deployment, args, raw_json)\
+             .AndReturn(raw)
+        message.ack()
+        self.mox.StubOutWithMock(views, 'post_process')
+        pool.put(raw, body_dict)
+        self.mox.StubOutWithMock(consumer, '_report_stats',
+                                 use_mock_anything=True)
+        consumer._report_stats()
+        self.mox.ReplayAll()
+        consumer._process(message)
+        self.assertEqual(consumer.processed, 1)
+        self.mox.VerifyAll()
+
+    def _dedup_message(self, message_id, redelivered=False):
+        message = self.mox.CreateMockAnything()
+        message.delivery_info = {'routing_key': 'monitor.info',
+                                 'redelivered': redelivered}
+        message.body = json.dumps({u'message_id': message_id})
+        return message
+
+    def test_process_skips_duplicate(self):
+        deployment = self.mox.CreateMockAnything()
+        messages = dedup.MessageFilter(100)
+        messages.add(u'abc')
+        consumer = worker.NovaConsumer('test', None, deployment, True, {},
+                                       dedup=messages)
+        message = self._dedup_message(u'abc')
+        self.mox.StubOutWithMock(db, 'find_stored_message_ids')
+        db.find_stored_message_ids(deployment, [u'abc'])\
+          .AndReturn(set([u'abc']))
+        self.mox.StubOutWithMock(views, 'process_raw_data')
+        message.ack()
+        self.mox.StubOutWithMock(consumer, '_report_stats',
+                                 use_mock_anything=True)
+        consumer._report_stats()
+        self.mox.ReplayAll()
+        consumer._process(message)
+        self.assertEqual(consumer.duplicates, 1)
+        self.assertEqual(consumer.processed, 0)
+        self.mox.VerifyAll()
+
+    def test_process_filter_miss_skips_lookup(self):
+        deployment = self.mox.CreateMockAnything()
+        raw = self.mox.CreateMockAnything()
+        raw.when = decimal.Decimal('1371018652.790476')
+        raw.message_id = u'abc'
+        messages = dedup.MessageFilter(100)
+        consumer = worker.NovaConsumer('test', None, deployment, True, {},
+                                       dedup=messages)
+        message = self._dedup_message(u'abc')
+        self.mox.StubOutWithMock(db, 'find_stored_message_ids')
+        self.mox.StubOutWithMock(views, 'process_raw_data',
+                                 use_mock_anything=True)
+        views.process_raw_data(deployment, mox.IgnoreArg(), mox.IgnoreArg())\
+             .AndReturn(raw)
+        self.mox.StubOutWithMock(views, 'post_process')
+        views.post_process(raw, {u'message_id': u'abc'})
+        message.ack()
+        self.mox.StubOutWithMock(consumer, '_report_stats',
+                                 use_mock_anything=True)
+        consumer._report_stats()
+        self.mox.ReplayAll()
+        consumer._process(message)
+        self.assertEqual(consumer.duplicates, 0)
+        self.assertTrue(u'abc' in messages)
+        self.mox.VerifyAll()
+
+    def test_process_false_positive_is_stored(self):
+        deployment = self.mox.CreateMockAnything()
+        messages = dedup.MessageFilter(100)
+        messages.add(u'abc')
+        consumer = worker.NovaConsumer('test', None, deployment, True, {},
+                                       dedup=messages)
+        message = self._dedup_message(u'abc')
+        self.mox.StubOutWithMock(db, 'find_stored_message_ids')
+        db.find_stored_message_ids(deployment, [u'abc']).AndReturn(set())
+        self.mox.StubOutWithMock(views, 'process_raw_data',
+                                 use_mock_anything=True)
+        views.process_raw_data(deployment, mox.IgnoreArg(), mox.IgnoreArg())\
+             .AndReturn(None)
+        message.ack()
+        self.mox.StubOutWithMock(consumer, '_report_stats',
+                                 use_mock_anything=True)
+        consumer._report_stats()
+        self.mox.ReplayAll()
+        consumer._process(message)
+        self.assertEqual(consumer.duplicates, 0)
+        self.mox.VerifyAll()
+
+    def test_process_redelivered_checks_database(self):
+        deployment = self.mox.CreateMockAnything()
+        consumer = worker.NovaConsumer('test', None, deployment, True, {},
+                                       batch_size=10,
+                                       dedup=dedup.MessageFilter(100))
+        consumer.batch = [('message', 'args', 'json')]
+        message = self._dedup_message(u'abc', redelivered=True)
+        self.mox.StubOutWithMock(db, 'find_stored_message_ids')
+        db.find_stored_message_ids(deployment, [u'abc'])\
+          .AndReturn(set([u'abc']))
+        # Only this message is acked, the batch isn't stored yet.
+        message.ack()
+        self.mox.StubOutWithMock(consumer, '_report_stats',
+                                 use_mock_anything=True)
+        consumer._report_stats()
+        self.mox.ReplayAll()
+        consumer._process(message)
+        self.assertEqual(consumer.duplicates, 1)
+        self.assertEqual(len(consumer.batch), 1)
+        self.mox.VerifyAll()
+
+    def test_raw_json(self):
+        body = '{"event_type":  "compute.instance.update", "payload": {}}'
+        raw_json = worker.raw_json('monitor.info', body)
+        self.assertEqual(raw_json, '["monitor.info", %s]' % body)
+        self.assertEqual(json.loads(raw_json),
+                         ['monitor.info', json.loads(body)])
+
+    def test_ack_every(self):
+        consumer = worker.NovaConsumer('test', None, None, True, {},
+                                       ack_every=3)
+        messages = []
+        for tag in range(1, 4):
+            message = self.mox.CreateMockAnything()
+            message.delivery_tag = tag
+            message.channel = self.mox.CreateMockAnything()
+            messages.append(message)
+        messages[2].channel.basic_ack(3, multiple=True)
+        self.mox.ReplayAll()
+        consumer._ack(messages[0])
+        consumer._ack(messages[1])
+        self.assertEqual(consumer.unacked_count, 2)
+        consumer._ack(messages[2])
+        self.assertEqual(consumer.unacked_count, 0)
+        self.assertEqual(consumer.unacked, None)
+        self.mox.VerifyAll()
+
+    def test_ack_every_limited_by_prefetch(self):
+        consumer = worker.NovaConsumer('test', None, None, True, {},
+                                       prefetch_count=10, ack_every=100)
+        self.assertEqual(consumer.ack_every, 10)
+
+    def test_on_iteration_flushes_expired_acks(self):
+        consumer = worker.NovaConsumer('test', None, None, True, {},
+                                       ack_every=10, ack_interval_ms=0)
+        message = self.mox.CreateMockAnything()
+        message.delivery_tag = 1
+        message.channel = self.mox.CreateMockAnything()
+        message.channel.basic_ack(1, multiple=True)
+        self.mox.ReplayAll()
+        consumer._ack(message)
+        consumer.on_iteration()
+        self.assertEqual(consumer.unacked, None)
+        self.mox.VerifyAll()
+
+    def _spooling_consumer(self, deployment=None, **kwargs):
+        consumer = worker.NovaConsumer('test', None, deployment, True, {},
+                                       **kwargs)
+        consumer.spool = self.mox.CreateMockAnything()
+        consumer.spool.directory = '/tmp/spool'
+        return consumer
+
+    def _message(self, body_dict):
+        message = self.mox.CreateMockAnything()
+        message.delivery_info = {'routing_key': 'monitor.info'}
+        message.body = json.dumps(body_dict)
+        return message
+
+    def test_process_spools_on_database_error(self):
+        deployment = self.mox.CreateMockAnything()
+        consumer = self._spooling_consumer(deployment)
+        body_dict = {u'key': u'value'}
+        message = self._message(body_dict)
+        raw_json = '["monitor.info", %s]' % message.body
+        self.mox.StubOutWithMock(views, 'process_raw_data',
+                                 use_mock_anything=True)
+        views.process_raw_data(deployment, ('monitor.info', body_dict),
+                               raw_json)\
+             .AndRaise(django_db.DatabaseError('gone away'))
+        self.mox.StubOutWithMock(django_db, 'close_connection')
+        django_db.close_connection()
+        consumer.spool.append(raw_json)
+        message.ack()
+        self.mox.StubOutWithMock(consumer, '_report_stats',
+                                 use_mock_anything=True)
+        consumer._report_stats()
+        self.mox.ReplayAll()
+        consumer._process(message)
+        self.assertTrue(consumer.spooling)
+        self.assertEqual(consumer.spooled, 1)
+        self.mox.VerifyAll()
+
+    def test_process_database_error_without_spool(self):
+        consumer = worker.NovaConsumer('test', None, None, True, {})
+        message = self._message({u'key': u'value'})
+        self.mox.StubOutWithMock(views, 'process_raw_data',
+                                 use_mock_anything=True)
+        views.process_raw_data(None, mox.IgnoreArg(), mox.IgnoreArg())\
+             .AndRaise(django_db.DatabaseError('gone away'))
+        self.mox.ReplayAll()
+        self.assertRaises(django_db.DatabaseError, consumer._process, message)
+        self.mox.VerifyAll()
+
+    def test_process_while_spooling(self):
+        consumer = self._spooling_consumer()
+        consumer.spooling = True
+        message = self._message({u'key': u'value'})
+        consumer.spool.append('["monitor.info", %s]' % message.body)
+        message.ack()
+        self.mox.StubOutWithMock(views, 'process_raw_data',
+                                 use_mock_anything=True)
+        self.mox.StubOutWithMock(consumer, '_report_stats',
+                                 use_mock_anything=True)
+        consumer._report_stats()
+        self.mox.ReplayAll()
+        consumer._process(message)
+        self.mox.VerifyAll()
+
+    def test_slow_database_starts_spooling(self):
+        consumer = self._spooling_consumer(spool_latency_ms=0)
+        self.mox.StubOutWithMock(django_db, 'close_connection')
+        django_db.close_connection()
+        self.mox.ReplayAll()
+        consumer._check_latency(0.001)
+        self.assertTrue(consumer.spooling)
+        self.mox.VerifyAll()
+
+    def test_replay_waits_for_retry(self):
+        consumer = self._spooling_consumer()
+        consumer.spooling = True
+        consumer.replay_after = time.time() + 60
+        self.mox.ReplayAll()
+        consumer.on_iteration()
+        self.assertTrue(consumer.spooling)
+        self.mox.VerifyAll()
+
+    def test_replay_batch(self):
+        deployment = self.mox.CreateMockAnything()
+        consumer = self._spooling_consumer(deployment, spool_replay_batch=2)
+        consumer.spooling = True
+        raw = self.mox.CreateMockAnything()
+        raw.when = decimal.Decimal('1371018652.790476')
+        lines = ['["monitor.info", {"a": 1}]', '["monitor.info", {"a": 2}]']
+        consumer.spool.pending().AndReturn(['/tmp/spool/1', '/tmp/spool/2'])
+        consumer.spool.read('/tmp/spool/1', 0, 2).AndReturn((lines, 54))
+        self.mox.StubOutWithMock(views, 'process_raw_data_batch',
+                                 use_mock_anything=True)
+        messages = [(('monitor.info', {'a': 1}), lines[0]),
+                    (('monitor.info', {'a': 2}), lines[1])]
+        views.process_raw_data_batch(deployment, messages, skip_stored=True)\
+             .AndReturn([None, raw])
+        self.mox.StubOutWithMock(views, 'post_process')
+        views.post_process(raw, {'a': 2})
+        self.mox.ReplayAll()
+        consumer.on_iteration()
+        self.assertEqual(consumer.replay_segment, '/tmp/spool/1')
+        self.assertEqual(consumer.replay_offset, 54)
+        self.assertEqual(consumer.processed, 1)
+        self.mox.VerifyAll()
+
+    def test_replay_database_error(self):
+        deployment = self.mox.CreateMockAnything()
+        consumer = self._spooling_consumer(deployment)
+        consumer.spooling = True
+        consumer.replay_segment = '/tmp/spool/1'
+        consumer.replay_offset = 54
+        lines = ['["monitor.info", {"a": 1}]']
+        consumer.spool.read('/tmp/spool/1', 54, 500).AndReturn((lines, 81))
+        self.mox.StubOutWithMock(views, 'process_raw_data_batch',
+                                 use_mock_anything=True)
+        views.process_raw_data_batch(deployment, mox.IgnoreArg(),
+                                     skip_stored=True)\
+             .AndRaise(django_db.DatabaseError('gone away'))
+        self.mox.StubOutWithMock(django_db, 'close_connection')
+        django_db.close_connection()
+        self.mox.ReplayAll()
+        consumer.on_iteration()
+        self.assertEqual(consumer.replay_offset, 54)
+        self.assertTrue(consumer.replay_after > time.time())
+        self.mox.VerifyAll()
+
+    def test_replay_bad_batch_one_at_a_time(self):
+        deployment = self.mox.CreateMockAnything()
+        consumer = self._spooling_consumer(deployment)
+        consumer.spooling = True
+        consumer.replay_segment = '/tmp/spool/1'
+        lines = ['["monitor.info", {"a": 1}]', '["monitor.info", {}]']
+        consumer.spool.read('/tmp/spool/1', 0, 500).AndReturn((lines, 48))
+        consumer.spool.read('/tmp/spool/1', 0, 1).AndReturn((lines[:1], 27))
+        consumer.spool.read('/tmp/spool/1', 27, 1).AndReturn((lines[1:], 48))
+        self.mox.StubOutWithMock(views, 'process_raw_data_batch',
+                                 use_mock_anything=True)
+        views.process_raw_data_batch(deployment, mox.IgnoreArg(),
+                                     skip_stored=True)\
+             .AndRaise(KeyError('payload'))
+        views.process_raw_data_batch(deployment, mox.IgnoreArg(),
+                                     skip_stored=True)\
+             .AndReturn([None])
+        views.process_raw_data_batch(deployment, mox.IgnoreArg(),
+                                     skip_stored=True)\
+             .AndRaise(KeyError('payload'))
+        self.mox.ReplayAll()
+        consumer.on_iteration()
+        self.assertEqual(consumer.replay_offset, 0)
+        consumer.on_iteration()
+        self.assertEqual(consumer.replay_offset, 27)
+        consumer.on_iteration()
+        self.assertEqual(consumer.replay_offset, 48)
+        self.mox.VerifyAll()
+
+    def test_replay_removes_finished_segment(self):
+        consumer = self._spooling_consumer()
+        consumer.spooling = True
+        consumer.replay_segment = '/tmp/spool/1'
+        consumer.replay_offset = 54
+        consumer.spool.read('/tmp/spool/1', 54, 500).AndReturn(([], 54))
+        consumer.spool.remove('/tmp/spool/1')
+        self.mox.ReplayAll()
+        consumer.on_iteration()
+        self.assertEqual(consumer.replay_segment, None)
+        self.mox.VerifyAll()
+
+    def test_replay_rotates_active_segment(self):
+        consumer = self._spooling_consumer()
+        consumer.spooling = True
+        consumer.spool.pending().AndReturn([])
+        consumer.spool.empty().AndReturn(False)
+        consumer.spool.rotate()
+        consumer.spool.pending().AndReturn(['/tmp/spool/2'])
+        consumer.spool.read('/tmp/spool/2', 0, 500).AndReturn(([], 0))
+        consumer.spool.remove('/tmp/spool/2')
+        self.mox.ReplayAll()
+        consumer.on_iteration()
+        self.assertTrue(consumer.spooling)
+        self.mox.VerifyAll()
+
+    def test_replay_stops_spooling_when_drained(self):
+        consumer = self._spooling_consumer()
+        consumer.spooling = True
+        consumer.spool.pending().AndReturn([])
+        consumer.spool.empty().AndReturn(True)
+        self.mox.ReplayAll()
+        consumer.on_iteration()
+        self.assertFalse(consumer.spooling)
+        self.mox.VerifyAll()
+
+    def test_process_batch_not_full(self):
+        deployment = self.mox.CreateMockAnything()
+        message = self.mox.CreateMockAnything()
+
+        consumer = worker.NovaConsumer('test', None, deployment, True, {},
+                                       batch_size=2)
+        routing_key = 'monitor.info'
+        message.delivery_info = {'routing_key': routing_key}
+        body_dict = {u'key': u'value'}
+        message.body = json.dumps(body_dict)
+        self.mox.StubOutWithMock(views, 'process_raw_data_batch',
+                                 use_mock_anything=True)
+        self.mox.StubOutWithMock(consumer, '_report_stats',
+                                 use_mock_anything=True)
+        consumer._report_stats()
+        self.mox.ReplayAll()
+        consumer._process(message)
+        self.assertEqual(consumer.processed, 0)
+        self.assertEqual(len(consumer.batch), 1)
+        self.mox.VerifyAll()
+
+    def test_process_batch_full(self):
+        deployment = self.mox.CreateMockAnything()
+        raw1 = self.mox.CreateMockAnything()
+        raw1.when = decimal.Decimal('1371018652.790476')
+        message1 = self.mox.CreateMockAnything()
+        message2 = self.mox.CreateMockAnything()
+        message2.channel = self.mox.CreateMockAnything()
+        message2.delivery_tag = 2
+
+        consumer = worker.NovaConsumer('test', None, deployment, True, {},
+                                       batch_size=2)
+        routing_key = 'monitor.info'
+        body_dict1 = {u'key': u'value1'}
+        body_dict2 = {u'key': u'value2'}
+        message1.delivery_info = {'routing_key': routing_key}
+        message1.body = json.dumps(body_dict1)
+        message2.delivery_info = {'routing_key': routing_key}
+        message2.body = json.dumps(body_dict2)
+        args1 = (routing_key, body_dict1)
+        args2 = (routing_key, body_dict2)
+        self.mox.StubOutWithMock(views, 'process_raw_data_batch',
+                                 use_mock_anything=True)
+        messages = [(args1, '["monitor.info", %s]' % message1.body),
+                    (args2, '["monitor.info", %s]' % message2.body)]
+        views.process_raw_data_batch(deployment, messages,
+                                     skip_stored=False)\
+             .AndReturn([raw1, None])
+        self.mox.StubOutWithMock(views, 'post_process')
+        views.post_process(raw1, body_dict1)
+        message2.channel.basic_ack(2, multiple=True)
+        self.mox.StubOutWithMock(consumer, '_report_stats',
+                                 use_mock_anything=True)
+        consumer._report_stats()
+        consumer._report_stats()
+        self.mox.ReplayAll()
+        consumer._process(message1)
+        consumer._process(message2)
+        self.assertEqual(consumer.processed, 1)
+        self.assertEqual(consumer.batch, [])
+        self.mox.VerifyAll()
+
+    def test_flush_batch_after_spool_clears_pending_acks(self):
+        deployment = self.mox.CreateMockAnything()
+        consumer = self._spooling_consumer(deployment, batch_size=2,
+                                           ack_every=10, ack_interval_ms=0)
+        channel = self.mox.CreateMockAnything()
+        messages = []
+        for tag in range(1, 4):
+            message = self._message({u'key': u'value%d' % tag})
+            message.delivery_tag = tag
+            message.channel = channel
+            messages.append(message)
+        consumer.spool.append(mox.IgnoreArg())
+        self.mox.StubOutWithMock(views, 'process_raw_data_batch',
+                                 use_mock_anything=True)
+        views.process_raw_data_batch(deployment, mox.IgnoreArg(),
+                                     skip_stored=False)\
+             .AndReturn([None, None])
+        # Only the batch's multiple ack, which also covers the spooled
+        # message's tag.
+        channel.basic_ack(3, multiple=True)
+        self.mox.StubOutWithMock(consumer, '_report_stats',
+                                 use_mock_anything=True)
+        consumer._report_stats()
+        consumer._report_stats()
+        self.mox.ReplayAll()
+
+        consumer._spool(messages[0], 'spooled')
+        self.assertEqual(consumer.unacked, messages[0])
+        consumer._process(messages[1])
+        consumer._process(messages[2])
+        self.assertEqual(consumer.unacked, None)
+        self.assertEqual(consumer.unacked_count, 0)
+        consumer.on_iteration()
+        self.mox.VerifyAll()
+
+    def test_on_iteration_flushes_due_caches(self):
+        consumer = worker.NovaConsumer('test', None, None, True, {})
+        self.mox.StubOutWithMock(views, 'caches_due')
+        self.mox.StubOutWithMock(views, 'flush_caches')
+        views.caches_due().AndReturn(True)
+        views.flush_caches()
+        views.caches_due().AndReturn(False)
+        self.mox.ReplayAll()
+        consumer.on_iteration()
+        # Nothing to save, so no transaction either.
+        self.mox.StubOutWithMock(db, 'transactional')
+        consumer.on_iteration()
+        self.mox.VerifyAll()
+
+    def test_on_iteration_flushes_expired_batch(self):
+        consumer = worker.NovaConsumer('test', None, None, True, {},
+                                       batch_size=10, batch_interval_ms=0)
+        consumer.batch = [('message', 'args', 'json')]
+        consumer.batch_started = datetime.datetime.utcnow()
+        self.mox.StubOutWithMock(consumer, '_flush_batch')
+        consumer._flush_batch()
+        self.mox.ReplayAll()
+        consumer.on_iteration()
+        self.mox.VerifyAll()
+
+    def test_on_iteration_keeps_fresh_batch(self):
+        consumer = worker.NovaConsumer('test', None, None, True, {},
+                                       batch_size=10,
+                                       batch_interval_ms=60000)
+        consumer.batch = [('message', 'args', 'json')]
+        consumer.batch_started = datetime.datetime.utcnow()
+        self.mox.StubOutWithMock(consumer, '_flush_batch')
+        self.mox.ReplayAll()
+        consumer.on_iteration()
+        self.mox.VerifyAll()
+
+    def test_report_stats_not_due(self):
+        stats = self.mox.CreateMock(worker_stats.WorkerStats)
+        consumer = worker.NovaConsumer('test', None, None, True, {},
+                                       stats=stats)
+        stats.due().AndReturn(False)
+        self.mox.ReplayAll()
+        consumer._report_stats()
+        self.mox.VerifyAll()
+
+    def test_report_stats(self):
+        stats = worker_stats.WorkerStats('test', interval=0)
+        stats.record_timing('process_raw_data', 0.01)
+        stats.record_message(lag=1.5)
+        consumer = worker.NovaConsumer('test', None, None, True, {},
+                                       batch_size=10, stats=stats)
+        consumer.pmi = self.mox.CreateMockAnything()
+        consumer.pmi.update()
+        consumer.pmi.vsz = 1000000
+        self.mox.StubOutWithMock(stats, 'write')
+        stats.write(mox.And(mox.ContainsKeyValue('batch_size', 10),
+                            mox.ContainsKeyValue('messages', 1),
+                            mox.ContainsKeyValue('vsz_kb', 1000)))
+        self.mox.ReplayAll()
+        consumer._report_stats()
+        self.assertEqual(stats.messages, 0)
+        self.mox.VerifyAll()
+
+    def test_cache_options(self):
+        config = {'name': 'test', 'lifecycle_cache_size': 100,
+                  'timing_cache_size': 200, 'exists_batch_size': 50}
+        options = worker.cache_options(config)
+        self.assertEqual(options['lifecycle_cache_size'], 100)
+        self.assertEqual(options['timing_cache_size'], 200)
+        self.assertEqual(options['tracker_cache_size'], 0)
+        self.assertEqual(options['lifecycle_cache_ttl'], 300)
+        self.assertEqual(options['exists_batch_size'], 50)
+
+    def test_cache_options_with_post_process_threads(self):
+        config = {'name': 'test', 'lifecycle_cache_size': 100,
+                  'usage_cache_size': 100, 'exists_batch_size': 50,
+                  'post_process_threads': 4}
+        self.mox.StubOutWithMock(worker, 'LOG')
+        worker.LOG.warn("test: lifecycle_cache_size, usage_cache_size, "
+                        "exists_batch_size ignored when "
+                        "post_process_threads is set")
+        self.mox.ReplayAll()
+        options = worker.cache_options(config)
+        self.mox.VerifyAll()
+        self.assertEqual(options['lifecycle_cache_size'], 0)
+        self.assertEqual(options['usage_cache_size'], 0)
+        self.assertEqual(options['exists_batch_size'], 0)
+
+    def test_cache_options_with_competing_consumers(self):
+        config = {'name': 'test', 'lifecycle_cache_size': 100,
+                  'timing_cache_size': 100, 'tracker_cache_size': 100,
+                  'usage_cache_size': 100, 'exists_batch_size': 50,
+                  'consumers': 4}
+        options = worker.cache_options(config)
+        self.assertEqual(options['lifecycle_cache_size'], 0)
+        self.assertEqual(options['timing_cache_size'], 0)
+        self.assertEqual(options['tracker_cache_size'], 0)
+        self.assertEqual(options['usage_cache_size'], 0)
+        # Batched exists don't cache anything another process changes.
+        self.assertEqual(options['exists_batch_size'], 50)
+
+    def test_cache_options_sample_config(self):
+        # Nothing the sample sets is quietly ignored.
+        path = os.path.join(os.path.dirname(__file__), '..', '..', 'etc',
+                            'sample_stacktach_worker_config.json')
+        with open(path) as f:
+            config = json.load(f)
+        self.mox.StubOutWithMock(worker, 'LOG')
+        self.mox.ReplayAll()
+        for deployment_config in config['deployments']:
+            worker.cache_options(deployment_config)
+        self.mox.VerifyAll()
+
     def test_run(self):
         config = {
             'name': 'east_coast.prod.global',
@@ -189,13 +799,64 @@ class NovaConsumerTestCase(unittest.TestCase):
         conn.__exit__(None, None, None).AndReturn(None)
         self.mox.StubOutClassWithMocks(worker, 'NovaConsumer')
         consumer = worker.NovaConsumer(config['name'], conn, deployment,
-                                       config['durable_queue'], {})
+                                       config['durable_queue'], {},
+                                       batch_size=1, batch_interval_ms=1000,
+                                       post_process_pool=None,
+                                       stats=mox.IsA(worker_stats.WorkerStats),
+                                       prefetch_count=None, ack_every=1,
+                                       ack_interval_ms=1000, spool=None,
+                                       spool_latency_ms=5000,
+                                       spool_retry_interval=30,
+                                       spool_replay_batch=500, dedup=None)
         consumer.run()
         worker.continue_running().AndReturn(False)
         self.mox.ReplayAll()
         worker.run(config)
         self.mox.VerifyAll()
 
+    def test_run_with_deployment(self):
+        config = {
+            'name': 'east_coast.prod.global',
+            'durable_queue': False,
+            'rabbit_host': '10.0.0.1',
+            'rabbit_port': 5672,
+            'rabbit_userid': 'rabbit',
+            'rabbit_password': 'rabbit',
+            'rabbit_virtual_host': '/'
+        }
+        # Created by start_workers, before the consumers fork.
+        self.mox.StubOutWithMock(db, 'get_or_create_deployment')
+        deployment = self.mox.CreateMockAnything()
+        self.mox.StubOutWithMock(kombu.connection, 'BrokerConnection')
+        params = dict(hostname=config['rabbit_host'],
+                      port=config['rabbit_port'],
+                      userid=config['rabbit_userid'],
+                      password=config['rabbit_password'],
+                      transport="librabbitmq",
+                      virtual_host=config['rabbit_virtual_host'])
+        self.mox.StubOutWithMock(worker, "continue_running")
+        worker.continue_running().AndReturn(True)
+        conn = self.mox.CreateMockAnything()
+        kombu.connection.BrokerConnection(**params).AndReturn(conn)
+        conn.__enter__().AndReturn(conn)
+        conn.__exit__(None, None, None).AndReturn(None)
+        self.mox.StubOutClassWithMocks(worker, 'NovaConsumer')
+        consumer = worker.NovaConsumer(config['name'], conn, deployment,
+                                       config['durable_queue'], {},
+                                       batch_size=1, batch_interval_ms=1000,
+                                       post_process_pool=None,
+                                       stats=mox.IsA(worker_stats.WorkerStats),
+                                       prefetch_count=None, ack_every=1,
+                                       ack_interval_ms=1000, spool=None,
+                                       spool_latency_ms=5000,
+                                       spool_retry_interval=30,
+                                       spool_replay_batch=500, dedup=None)
+        consumer.run()
+        worker.continue_running().AndReturn(False)
+        self.mox.ReplayAll()
+        worker.run(config, deployment)
+        self.mox.VerifyAll()
+
     def test_run_queue_args(self):
         config = {
             'name': 'east_coast.prod.global',
@@ -227,9 +888,60 @@ class NovaConsumerTestCase(unittest.TestCase):
         self.mox.StubOutClassWithMocks(worker, 'NovaConsumer')
         consumer = worker.NovaConsumer(config['name'], conn, deployment,
                                        config['durable_queue'],
-                                       config['queue_arguments'])
+                                       config['queue_arguments'],
+                                       batch_size=1, batch_interval_ms=1000,
+                                       post_process_pool=None,
+                                       stats=mox.IsA(worker_stats.WorkerStats),
+                                       prefetch_count=None, ack_every=1,
+                                       ack_interval_ms=1000, spool=None,
+                                       spool_latency_ms=5000,
+                                       spool_retry_interval=30,
+                                       spool_replay_batch=500, dedup=None)
         consumer.run()
         worker.continue_running().AndReturn(False)
         self.mox.ReplayAll()
         worker.run(config)
-        self.mox.VerifyAll()
\ No newline at end of file
+        self.mox.VerifyAll()
+
+
+class PostProcessPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.mox = mox.Mox()
+        self.mox.stubs.Set(db, 'transactional', _no_transaction)
+
+    def tearDown(self):
+        self.mox.UnsetStubs()
+
+    def test_put(self):
+        pool = worker.PostProcessPool('test', 0, 2)
+        pool.put('raw1', 'body1')
+        pool.put('raw2', 'body2')
+        self.assertEqual(pool.depth(), 2)
+        self.assertTrue(pool.queue.full())
+
+    def test_process_one(self):
+        pool = worker.PostProcessPool('test', 0, 2)
+        raw = self.mox.CreateMockAnything()
+        body = {'key': 'value'}
+        pool.put(raw, body)
+        self.mox.StubOutWithMock(views, 'post_process')
+        views.post_process(raw, body)
+        self.mox.ReplayAll()
+        pool._process_one()
+        self.assertEqual(pool.depth(), 0)
+        self.mox.VerifyAll()
+
+    def test_process_one_logs_failure(self):
+        pool = worker.PostProcessPool('test', 0, 2)
+        raw = self.mox.CreateMockAnything()
+        raw.id = 1
+        body = {'key': 'value'}
+        pool.put(raw, body)
+        self.mox.StubOutWithMock(views, 'post_process')
+        views.post_process(raw, body).AndRaise(Exception('boom'))
+        self.mox.StubOutWithMock(worker.LOG, 'exception')
+        worker.LOG.exception(mox.IgnoreArg())
+        self.mox.ReplayAll()
+        pool._process_one()
+        self.assertEqual(pool.depth(), 0)
+        self.mox.VerifyAll()
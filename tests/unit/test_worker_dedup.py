@@ -0,0 +1,89 @@
+# Copyright (c) 2013 - Rackspace Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+import unittest
+
+from worker import dedup
+
+
+class BloomFilterTestCase(unittest.TestCase):
+    def test_added_keys_are_members(self):
+        bloom = dedup.BloomFilter(1000)
+        keys = ['message-%d' % i for i in range(1000)]
+        for key in keys:
+            bloom.add(key)
+        for key in keys:
+            self.assertTrue(key in bloom)
+        self.assertEqual(bloom.count, 1000)
+
+    def test_unicode_keys(self):
+        bloom = dedup.BloomFilter(10)
+        bloom.add(u'\xe9v\xe9nement')
+        self.assertTrue(u'\xe9v\xe9nement' in bloom)
+
+    def test_false_positive_rate(self):
+        bloom = dedup.BloomFilter(1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add('message-%d' % i)
+        false_positives = len([i for i in range(10000)
+                               if 'other-%d' % i in bloom])
+        self.assertTrue(false_positives < 300)
+
+
+class MessageFilterTestCase(unittest.TestCase):
+    def test_contains(self):
+        messages = dedup.MessageFilter(100)
+        messages.add('a', now=0)
+        self.assertTrue('a' in messages)
+        self.assertFalse('b' in messages)
+
+    def test_rotates_when_full(self):
+        messages = dedup.MessageFilter(2)
+        messages.add('a', now=0)
+        messages.add('b', now=0)
+        messages.add('c', now=0)
+        self.assertEqual(messages.rotations, 1)
+        self.assertTrue('a' in messages)
+        self.assertTrue('c' in messages)
+        messages.add('d', now=0)
+        messages.add('e', now=0)
+        self.assertEqual(messages.rotations, 2)
+        self.assertFalse('a' in messages)
+        self.assertTrue('c' in messages)
+
+    def test_rotates_after_window(self):
+        messages = dedup.MessageFilter(100, window=60)
+        messages.started = 0
+        messages.add('a', now=10)
+        messages.add('b', now=70)
+        self.assertEqual(messages.rotations, 1)
+        self.assertTrue('a' in messages)
+        messages.add('c', now=140)
+        self.assertFalse('a' in messages)
+        self.assertTrue('b' in messages)
+
+    def test_stats(self):
+        messages = dedup.MessageFilter(100)
+        messages.add('a', now=0)
+        stats = messages.stats()
+        self.assertEqual(stats['size'], 1)
+        self.assertEqual(stats['rotations'], 0)
+        self.assertEqual(stats['bytes'],
+                         2 * len(messages.current.array))
@@ -0,0 +1,196 @@
+# Copyright (c) 2013 - Rackspace Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+import gzip
+import json
+import argparse
+import os
+import Queue
+import shutil
+import StringIO
+import tempfile
+import threading
+import unittest
+
+from django import db as django_db
+import mox
+
+from stacktach import db
+from stacktach import views
+from worker import replay
+
+
+class _Child(threading.Thread):
+    # Stands in for a child process, without holding up exit on failure.
+    def __init__(self, *args, **kwargs):
+        super(_Child, self).__init__(*args, **kwargs)
+        self.daemon = True
+
+
+class _Queue(Queue.Queue):
+    # A failed child errors the test rather than hanging it.
+    def get(self, block=True, timeout=5):
+        return Queue.Queue.get(self, block, timeout)
+
+
+class ReplayTestCase(unittest.TestCase):
+    def setUp(self):
+        self.mox = mox.Mox()
+        self.mox.stubs.Set(db, 'transactional',
+                           lambda func, *args: func(*args))
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.mox.UnsetStubs()
+        shutil.rmtree(self.directory)
+
+    def test_read_lines(self):
+        plain = os.path.join(self.directory, 'events.json')
+        with open(plain, 'w') as f:
+            f.write('["monitor.info", {}]\n\n["monitor.error", {}]\n')
+        zipped = os.path.join(self.directory, 'events.json.gz')
+        f = gzip.open(zipped, 'w')
+        f.write('["monitor.info", {"a": 1}]\n')
+        f.close()
+        lines = list(replay.read_lines([plain, zipped]))
+        self.assertEqual(lines, ['["monitor.info", {}]',
+                                 '["monitor.error", {}]',
+                                 '["monitor.info", {"a": 1}]'])
+
+    def test_partition_by_instance(self):
+        body = {'_context_request_id': 'req', 'publisher_id': 'compute.h1',
+                'event_type': 'compute.instance.update',
+                'payload': {'instance_id': 'uuid1'}}
+        other = {'_context_request_id': 'req', 'publisher_id': 'compute.h2',
+                 'event_type': 'compute.instance.exists',
+                 'payload': {'instance_id': 'uuid1'}}
+        first = replay.partition(['monitor.info', body], 8)
+        self.assertEqual(replay.partition(['monitor.error', other], 8), first)
+        self.assertEqual(replay.partition(['monitor.info', body], 1), 0)
+
+    def _setup_ingester(self, **kwargs):
+        deployment = self.mox.CreateMockAnything()
+        self.mox.StubOutWithMock(views, 'process_raw_data_batch',
+                                 use_mock_anything=True)
+        self.mox.StubOutWithMock(views, 'post_process')
+        ingester = replay.Ingester(deployment, **kwargs)
+        return deployment, ingester
+
+    def test_ingest(self):
+        deployment, ingester = self._setup_ingester(batch_size=2)
+        lines = ['["monitor.info", {"a": 1}]', '["monitor.info", {"a": 2}]']
+        messages = [(('monitor.info', {'a': 1}), lines[0]),
+                    (('monitor.info', {'a': 2}), lines[1])]
+        raw = self.mox.CreateMockAnything()
+        views.process_raw_data_batch(deployment, messages,
+                                     skip_stored=False)\
+             .AndReturn([raw, None])
+        views.post_process(raw, {'a': 1})
+        self.mox.ReplayAll()
+        ingester.ingest(lines)
+        results = ingester.results()
+        self.assertEqual(results['events'], 2)
+        self.assertEqual(results['stored'], 1)
+        self.assertEqual(len(results['timings']['process_raw_data']), 1)
+        self.assertEqual(len(results['timings']['post_process']), 1)
+        self.mox.VerifyAll()
+
+    def test_ingest_single_event(self):
+        deployment, ingester = self._setup_ingester(batch_size=1,
+                                                    post_process=False)
+        line = '["monitor.info", {"a": 1}]'
+        self.mox.StubOutWithMock(views, 'process_raw_data',
+                                 use_mock_anything=True)
+        raw = self.mox.CreateMockAnything()
+        views.process_raw_data(deployment, ('monitor.info', {'a': 1}), line)\
+             .AndReturn(raw)
+        self.mox.ReplayAll()
+        ingester.ingest([line])
+        self.assertEqual(ingester.stored, 1)
+        self.mox.VerifyAll()
+
+    def test_ingest_skip_stored(self):
+        deployment, ingester = self._setup_ingester(skip_stored=True)
+        line = '["monitor.info", {"a": 1}]'
+        views.process_raw_data_batch(deployment, mox.IgnoreArg(),
+                                     skip_stored=True).AndReturn([None])
+        self.mox.ReplayAll()
+        ingester.ingest([line])
+        self.assertEqual(ingester.events, 1)
+        self.assertEqual(ingester.stored, 0)
+        self.mox.VerifyAll()
+
+    def test_merge_and_report(self):
+        result = {
+            'events': 10,
+            'stored': 9,
+            'queries': 45,
+            'seconds': {'process_raw_data': 1.0, 'post_process': 2.0},
+            'timings': {'process_raw_data': [0.1], 'post_process': [0.2]},
+        }
+        merged = replay.merge([result, result])
+        self.assertEqual(merged['events'], 20)
+        self.assertEqual(merged['queries'], 90)
+        self.assertEqual(merged['seconds']['post_process'], 4.0)
+        self.assertEqual(merged['timings']['post_process'], [0.2, 0.2])
+
+        out = StringIO.StringIO()
+        replay.report(merged, 2.0, out=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(lines[0], '20 events (18 stored) in 2.0s, '
+                                   '10.0 events/sec')
+        self.assertEqual(lines[1], '4.5 queries/event')
+        self.assertTrue(lines[3].startswith('post_process'))
+
+    def test_replay_processes_share_deployment(self):
+        path = os.path.join(self.directory, 'events.json')
+        with open(path, 'w') as f:
+            for instance in ['uuid1', 'uuid2', 'uuid3']:
+                body = {'_context_request_id': 'req',
+                        'publisher_id': 'compute.h1',
+                        'event_type': 'compute.instance.update',
+                        'payload': {'instance_id': instance}}
+                f.write(json.dumps(['monitor.info', body]) + '\n')
+        options = argparse.Namespace(files=[path], limit=None, processes=2,
+                                     deployment='east')
+        deployment = self.mox.CreateMockAnything()
+        self.mox.StubOutWithMock(db, 'get_or_create_deployment')
+        db.get_or_create_deployment('east').AndReturn((deployment, True))
+        self.mox.stubs.Set(django_db, 'close_connection', lambda: None)
+        self.mox.stubs.Set(replay.multiprocessing, 'Process', _Child)
+        self.mox.stubs.Set(replay.multiprocessing, 'Queue', _Queue)
+        given = []
+
+        class FakeIngester(object):
+            def ingest(self, lines):
+                pass
+
+            def results(self):
+                return replay.merge([])
+
+        def fake_ingester(options, deployment):
+            given.append(deployment)
+            return FakeIngester()
+        self.mox.stubs.Set(replay, '_ingester', fake_ingester)
+
+        self.mox.ReplayAll()
+        replay.replay(options)
+        self.assertEqual(given, [deployment, deployment])
+        self.mox.VerifyAll()
@@ -0,0 +1,109 @@
+# Copyright (c) 2013 - Rackspace Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import mox
+
+from worker import spool
+
+
+class SpoolTestCase(unittest.TestCase):
+    def setUp(self):
+        self.mox = mox.Mox()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.mox.UnsetStubs()
+        shutil.rmtree(self.directory)
+
+    def _write_segment(self, pid, sequence, lines):
+        filename = 'test.%d.%012d.spool' % (pid, sequence)
+        path = os.path.join(self.directory, filename)
+        with open(path, 'w') as f:
+            f.write(''.join(line + '\n' for line in lines))
+        return path
+
+    def test_append_and_read(self):
+        test_spool = spool.Spool(self.directory, 'test')
+        self.assertTrue(test_spool.empty())
+        test_spool.append('["monitor.info", {"a": 1}]')
+        test_spool.append('["monitor.info",\n {"a": 2}]')
+        self.assertFalse(test_spool.empty())
+        self.assertEqual(test_spool.pending(), [])
+
+        test_spool.rotate()
+        pending = test_spool.pending()
+        self.assertEqual(len(pending), 1)
+        lines, offset = test_spool.read(pending[0], 0, 1)
+        self.assertEqual(lines, ['["monitor.info", {"a": 1}]'])
+        lines, offset = test_spool.read(pending[0], offset, 10)
+        self.assertEqual(lines, ['["monitor.info",  {"a": 2}]'])
+        self.assertEqual(test_spool.read(pending[0], offset, 10),
+                         ([], offset))
+
+        test_spool.remove(pending[0])
+        self.assertTrue(test_spool.empty())
+
+    def test_append_rotates_full_segment(self):
+        test_spool = spool.Spool(self.directory, 'test', segment_bytes=10)
+        test_spool.append('["monitor.info", {}]')
+        test_spool.append('["monitor.info", {}]')
+        self.assertEqual(len(test_spool.pending()), 2)
+        self.assertEqual(test_spool.active, None)
+
+    def test_read_ignores_torn_write(self):
+        test_spool = spool.Spool(self.directory, 'test')
+        path = os.path.join(self.directory, 'test.%d.%012d.spool' %
+                                            (os.getpid(), 0))
+        with open(path, 'w') as f:
+            f.write('["monitor.info", {}]\n["monitor.in')
+        lines, offset = test_spool.read(path, 0, 10)
+        self.assertEqual(lines, ['["monitor.info", {}]'])
+        self.assertEqual(offset, len('["monitor.info", {}]\n'))
+
+    def test_claims_segments_of_dead_workers(self):
+        self.mox.StubOutWithMock(spool, '_pid_alive')
+        spool._pid_alive(1234).InAnyOrder().AndReturn(False)
+        spool._pid_alive(1234).InAnyOrder().AndReturn(False)
+        spool._pid_alive(5678).InAnyOrder().AndReturn(True)
+        self._write_segment(1234, 0, ['first'])
+        self._write_segment(1234, 1, ['second'])
+        live = self._write_segment(5678, 0, ['running'])
+        self.mox.ReplayAll()
+
+        test_spool = spool.Spool(self.directory, 'test')
+        pending = test_spool.pending()
+        self.assertEqual(len(pending), 2)
+        self.assertEqual(test_spool.read(pending[0], 0, 10)[0], ['first'])
+        self.assertEqual(test_spool.read(pending[1], 0, 10)[0], ['second'])
+        self.assertTrue(os.path.exists(live))
+        self.assertEqual(test_spool.sequence, 2)
+        self.mox.VerifyAll()
+
+    def test_ignores_other_deployments(self):
+        path = os.path.join(self.directory, 'test.cell1.1234.000000000000.spool')
+        open(path, 'w').close()
+        test_spool = spool.Spool(self.directory, 'test')
+        self.assertEqual(test_spool.pending(), [])
+        self.assertTrue(os.path.exists(path))
@@ -0,0 +1,164 @@
+# Copyright (c) 2013 - Rackspace Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from worker import stats
+
+
+class WorkerStatsTestCase(unittest.TestCase):
+    def test_percentile(self):
+        samples = range(1, 101)
+        self.assertEqual(stats.percentile(samples, 50), 50)
+        self.assertEqual(stats.percentile(samples, 95), 95)
+        self.assertEqual(stats.percentile(samples, 99), 99)
+        self.assertEqual(stats.percentile([7], 99), 7)
+        self.assertEqual(stats.percentile([], 50), None)
+
+    def test_snapshot(self):
+        worker_stats = stats.WorkerStats('test')
+        start = worker_stats.window_start
+        for i in range(1, 11):
+            worker_stats.record_timing('process_raw_data', i / 1000.0)
+            worker_stats.record_message(lag=float(i))
+        worker_stats.queries += 30
+        snapshot = worker_stats.snapshot(now=start + 5, batch_size=1)
+        self.assertEqual(snapshot['name'], 'test')
+        self.assertEqual(snapshot['messages'], 10)
+        self.assertEqual(snapshot['messages_per_sec'], 2.0)
+        self.assertEqual(snapshot['queries_per_message'], 3.0)
+        self.assertEqual(snapshot['process_raw_data']['p50'], 0.005)
+        self.assertEqual(snapshot['process_raw_data']['p99'], 0.01)
+        self.assertEqual(snapshot['post_process']['p50'], None)
+        self.assertEqual(snapshot['lag']['p95'], 10.0)
+        self.assertEqual(snapshot['batch_size'], 1)
+
+    def test_reset(self):
+        worker_stats = stats.WorkerStats('test')
+        worker_stats.record_timing('post_process', 0.1)
+        worker_stats.record_message(queries=3, lag=1.0)
+        worker_stats.reset()
+        self.assertEqual(worker_stats.messages, 0)
+        self.assertEqual(worker_stats.queries, 0)
+        self.assertEqual(worker_stats.timings['post_process'], [])
+        self.assertEqual(worker_stats.lags, [])
+        self.assertEqual(worker_stats.total_messages, 1)
+
+    def test_record_queries(self):
+        worker_stats = stats.WorkerStats('test')
+        worker_stats.record_queries(4)
+        worker_stats.record_queries(2)
+        self.assertEqual(worker_stats.queries, 6)
+
+    def test_record_timing_from_threads(self):
+        worker_stats = stats.WorkerStats('test', max_samples=100)
+
+        def record():
+            for i in range(1000):
+                worker_stats.record_timing('post_process', 0.001)
+
+        threads = [threading.Thread(target=record) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for i in range(50):
+            worker_stats.snapshot()
+            worker_stats.reset()
+        for thread in threads:
+            thread.join()
+        self.assertTrue(len(worker_stats.timings['post_process']) <= 100)
+        self.assertTrue(worker_stats.seen['post_process'] <= 4000)
+
+    def test_samples_are_bounded(self):
+        worker_stats = stats.WorkerStats('test', max_samples=10)
+        for i in range(100):
+            worker_stats.record_timing('post_process', i)
+        self.assertEqual(len(worker_stats.timings['post_process']), 10)
+
+    def test_due(self):
+        worker_stats = stats.WorkerStats('test', interval=30)
+        start = worker_stats.window_start
+        self.assertFalse(worker_stats.due(now=start + 10))
+        self.assertTrue(worker_stats.due(now=start + 30))
+
+    def test_write(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, '%(name)s.json')
+            worker_stats = stats.WorkerStats('cell1', stats_file=path)
+            worker_stats.write({'messages': 5})
+            with open(os.path.join(tmpdir, 'cell1.json')) as f:
+                self.assertEqual(json.load(f), {'messages': 5})
+            self.assertEqual(os.listdir(tmpdir), ['cell1.json'])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_write_without_file(self):
+        worker_stats = stats.WorkerStats('test')
+        worker_stats.write({'messages': 5})
+
+
+class FakeCursor(object):
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, sql, params=()):
+        self.statements.append(sql)
+
+    def executemany(self, sql, param_list):
+        self.statements.append(sql)
+
+
+class FakeConnection(object):
+    use_debug_cursor = None
+
+    def __init__(self):
+        self.raw_cursor = FakeCursor()
+
+    def is_managed(self):
+        return False
+
+    def cursor(self):
+        # As BaseDatabaseWrapper.cursor() does.
+        if self.use_debug_cursor:
+            return self.make_debug_cursor(self.raw_cursor)
+        return self.raw_cursor
+
+
+class QueryCountTestCase(unittest.TestCase):
+    def test_count_queries(self):
+        connection = FakeConnection()
+        stats.count_queries(connection)
+        cursor = connection.cursor()
+        cursor.execute('SELECT 1')
+        cursor.executemany('INSERT', [(1,), (2,)])
+        connection.cursor().execute('SELECT 2')
+        self.assertEqual(connection.raw_cursor.statements,
+                         ['SELECT 1', 'INSERT', 'SELECT 2'])
+        self.assertFalse(hasattr(connection, 'queries'))
+        self.assertEqual(stats.take_query_count(connection), 3)
+        self.assertEqual(stats.take_query_count(connection), 0)
+
+    def test_take_query_count_without_counting(self):
+        self.assertEqual(stats.take_query_count(FakeConnection()), 0)
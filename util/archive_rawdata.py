@@ -0,0 +1,92 @@
+# Copyright (c) 2013 - Rackspace Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""Move old RawData out of the database into the archive.
+
+Rows older than --days are written to compressed segment files in
+RAWDATA_ARCHIVE_DIR (see stacktach/archive.py) and deleted from the
+database. Run it daily from cron, e.g. to keep 30 days in the database:
+
+    python util/archive_rawdata.py --days 30
+
+On a partitioned RawData, run it before manage_partitions.py drops
+anything, with --days less than the partitions kept.
+"""
+
+import argparse
+import datetime
+import os
+import sys
+
+POSSIBLE_TOPDIR = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir, os.pardir))
+if os.path.exists(os.path.join(POSSIBLE_TOPDIR, 'stacktach')):
+    sys.path.insert(0, POSSIBLE_TOPDIR)
+
+from stacktach import archive
+from stacktach import datetime_to_decimal as dt
+
+
+def report(results, out=sys.stdout):
+    out.write("%d rows archived in %.1fs, %.1f rows/sec\n" %
+              (results['rows'], results['seconds'],
+               results['rows_per_sec']))
+    ratio = 0.0
+    if results['bytes_out']:
+        ratio = float(results['bytes_in']) / results['bytes_out']
+    out.write("%d bytes read, %.1f KB/sec, %d bytes written "
+              "(%.1fx compression)\n" %
+              (results['bytes_in'], results['bytes_per_sec'] / 1024,
+               results['bytes_out'], ratio))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--days', type=int, required=True,
+                        help="Archive RawData older than this many days")
+    parser.add_argument('--directory', default=archive.RAWDATA_ARCHIVE_DIR,
+                        help="Defaults to the RAWDATA_ARCHIVE_DIR setting")
+    parser.add_argument('--batch', type=int, default=1000,
+                        help="Rows archived and deleted per transaction")
+    parser.add_argument('--block-rows', type=int, default=100,
+                        help="Rows compressed together. Bigger blocks "
+                             "compress better but are slower to look "
+                             "a row up in")
+    parser.add_argument('--limit', type=int, default=None,
+                        help="Stop after this many rows")
+    options = parser.parse_args(argv)
+    if not options.directory:
+        parser.error("RAWDATA_ARCHIVE_DIR isn't set, so --directory "
+                     "is needed")
+
+    cutoff = datetime.datetime.utcnow() - \
+        datetime.timedelta(days=options.days)
+    writer = archive.ArchiveWriter(options.directory)
+    try:
+        archiver = archive.Archiver(writer, batch=options.batch,
+                                    block_rows=options.block_rows)
+        archiver.archive(dt.dt_to_decimal(cutoff), limit=options.limit)
+    finally:
+        writer.close()
+    report(archiver.report())
+
+
+if __name__ == '__main__':
+    main()
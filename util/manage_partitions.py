@@ -0,0 +1,72 @@
+# Copyright (c) 2013 - Rackspace Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""Create upcoming RawData partitions and drop expired ones.
+
+Run it daily from cron on a deployment with RAWDATA_PARTITIONS set
+(see stacktach/partitions.py), e.g. to keep 90 days:
+
+    python util/manage_partitions.py --ahead 7 --keep 90
+"""
+
+import argparse
+import datetime
+import os
+import sys
+
+POSSIBLE_TOPDIR = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir, os.pardir))
+if os.path.exists(os.path.join(POSSIBLE_TOPDIR, 'stacktach')):
+    sys.path.insert(0, POSSIBLE_TOPDIR)
+
+from django.db import transaction
+
+from stacktach import partitions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scheme', default=partitions.RAWDATA_PARTITIONS,
+                        choices=partitions.SCHEMES,
+                        help="Defaults to the RAWDATA_PARTITIONS setting")
+    parser.add_argument('--ahead', type=int, default=7,
+                        help="Periods past the current one to create "
+                             "partitions for")
+    parser.add_argument('--keep', type=int, default=None,
+                        help="Periods before the current one to keep. "
+                             "Older partitions are dropped; without "
+                             "--keep nothing is")
+    options = parser.parse_args(argv)
+    if not options.scheme:
+        parser.error("RAWDATA_PARTITIONS isn't set, so --scheme is needed")
+
+    manager = partitions.PartitionManager(options.scheme)
+    now = datetime.datetime.utcnow()
+    for name in manager.create(now, ahead=options.ahead):
+        print "Created %s" % name
+    if options.keep is not None:
+        for name in manager.drop_expired(now, options.keep):
+            print "Dropped %s" % name
+    # Partition DDL commits implicitly; this is for the SELECTs.
+    transaction.commit_unless_managed()
+
+
+if __name__ == '__main__':
+    main()
@@ -42,6 +42,7 @@ from stacktach import stacklog
 stacklog.set_default_logger_name('verifier')
 LOG = stacklog.get_logger()
 
+from stacktach import archive
 from stacktach import models
 from stacktach import datetime_to_decimal as dt
 from verifier import AmbiguousResults
@@ -56,8 +57,11 @@ def _list_exists(ending_max=None, status=None):
         params['audit_period_ending__lte'] = dt.dt_to_decimal(ending_max)
     if status:
         params['status'] = status
+    # In the order of the (status, audit_period_ending, id) index, so
+    # the pending exists don't have to be sorted.
     return models.InstanceExists.objects.select_related()\
-                                .filter(**params).order_by('id')
+                                .filter(**params)\
+                                .order_by('audit_period_ending', 'id')
 
 
 def _find_launch(instance, launched):
@@ -352,8 +356,25 @@ def _send_notification(message, routing_key, connection, exchange):
         producer.publish(message, routing_key)
 
 
+def _exists_body(raw_id):
+    """The stored notification for an exists, straight from the body
+    table or, once it has been archived, from the archive. '' if
+    neither has it."""
+    body = models.RawDataBody.load(raw_id)
+    if not body:
+        raw = archive.load_rawdata(raw_id)
+        if raw is not None:
+            body = raw.json
+    return body
+
+
 def send_verified_notification(exist, connection, exchange, routing_keys=None):
-    body = exist.raw.json
+    body = _exists_body(exist.raw_id)
+    if not body:
+        LOG.warn("No notification body for RawData(%s), not sending the "
+                 "verified notification for InstanceExists(%s)" %
+                 (exist.raw_id, exist.id))
+        return
     json_body = json.loads(body)
     json_body[1]['event_type'] = 'compute.instance.exists.verified.old'
     json_body[1]['original_message_id'] = json_body[1]['message_id']
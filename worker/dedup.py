@@ -0,0 +1,98 @@
+# Copyright (c) 2013 - Rackspace Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""Recently seen message_ids, used by the worker to skip duplicates.
+
+A MessageFilter is a pair of Bloom filters. New ids go into the current
+generation; once it holds `capacity` ids or is `window` seconds old it
+becomes the previous generation and a fresh one is started, so memory
+is fixed no matter how busy the deployment is and an id is remembered
+for at least one window. Membership is probabilistic: a miss is
+definite, a hit has to be confirmed against the database.
+"""
+
+import hashlib
+import math
+import struct
+import time
+
+
+class BloomFilter(object):
+    def __init__(self, capacity, error_rate=0.001):
+        bits = -capacity * math.log(error_rate) / (math.log(2) ** 2)
+        self.bits = max(8, int(math.ceil(bits)))
+        self.hashes = max(1, int(round(self.bits * math.log(2) / capacity)))
+        self.array = bytearray((self.bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # Double hashing, as in Kirsch and Mitzenmacher: two 64-bit
+        # halves of one md5 give all k positions.
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        h1, h2 = struct.unpack('<QQ', hashlib.md5(key).digest())
+        for i in xrange(self.hashes):
+            yield (h1 + i * h2) % self.bits
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.array[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        for pos in self._positions(key):
+            if not self.array[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+
+class MessageFilter(object):
+    def __init__(self, capacity, window=3600, error_rate=0.001):
+        self.capacity = capacity
+        self.window = window
+        self.error_rate = error_rate
+        self.previous = None
+        self.current = BloomFilter(capacity, error_rate)
+        self.started = time.time()
+        self.rotations = 0
+
+    def _rotate(self, now):
+        self.previous = self.current
+        self.current = BloomFilter(self.capacity, self.error_rate)
+        self.started = now
+        self.rotations += 1
+
+    def add(self, message_id, now=None):
+        if now is None:
+            now = time.time()
+        if (self.current.count >= self.capacity or
+                now - self.started >= self.window):
+            self._rotate(now)
+        self.current.add(message_id)
+
+    def __contains__(self, message_id):
+        if message_id in self.current:
+            return True
+        return self.previous is not None and message_id in self.previous
+
+    def stats(self):
+        return {'size': self.current.count,
+                'bytes': len(self.current.array) * 2,
+                'rotations': self.rotations}
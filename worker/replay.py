@@ -0,0 +1,316 @@
+# Copyright (c) 2013 - Rackspace Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""Replay archived notifications straight into the database.
+
+Reads newline-delimited [routing_key, body] envelopes (the format of
+RawData.json and of the worker's spool segments) and pushes them
+through process_raw_data and post_process, the same way the worker
+does, but without RabbitMQ. Use it for capacity testing, rebuilding a
+database from an archive and regression benchmarks:
+
+    python worker/replay.py --deployment east_coast.prod.cell1 \\
+        --processes 4 --batch-size 100 events-2013-06-12.json.gz
+
+Events are partitioned across processes by instance, so each instance's
+events are still processed in order. A summary of events/sec, queries
+per event and per-stage timings is printed at the end.
+"""
+
+import argparse
+import gzip
+import itertools
+import multiprocessing
+import os
+import sys
+import time
+
+try:
+    import ujson as json
+except ImportError:
+    try:
+        import simplejson as json
+    except ImportError:
+        import json
+
+POSSIBLE_TOPDIR = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir, os.pardir))
+if os.path.exists(os.path.join(POSSIBLE_TOPDIR, 'stacktach')):
+    sys.path.insert(0, POSSIBLE_TOPDIR)
+
+from django import db as django_db
+
+from stacktach import db
+from stacktach import views
+import stats as worker_stats
+
+CHUNK_SIZE = 500
+
+
+def read_lines(filenames):
+    """Yield the non-blank lines of each file. '-' is stdin and .gz
+    files are decompressed on the fly."""
+    for filename in filenames:
+        if filename == '-':
+            f = sys.stdin
+        elif filename.endswith('.gz'):
+            f = gzip.open(filename)
+        else:
+            f = open(filename)
+        try:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield line
+        finally:
+            if f is not sys.stdin:
+                f.close()
+
+
+def partition(envelope, partitions):
+    """Pick a partition so every event for an instance goes to the
+    same process."""
+    if partitions == 1:
+        return 0
+    routing_key, body = envelope
+    instance = views.NOTIFICATIONS[routing_key](body).instance
+    return hash(instance) % partitions
+
+
+class Ingester(object):
+    """Stores parsed envelopes the way the worker does and keeps the
+    numbers for the summary."""
+    def __init__(self, deployment, batch_size=100, skip_stored=False,
+                 post_process=True):
+        self.deployment = deployment
+        self.batch_size = batch_size
+        self.skip_stored = skip_stored
+        self.post_process = post_process
+        self.stats = worker_stats.WorkerStats('replay')
+        self.events = 0
+        self.stored = 0
+        self.seconds = dict((stage, 0.0) for stage in worker_stats.STAGES)
+
+    def _timed(self, stage, func, *args, **kwargs):
+        start = time.time()
+        result = func(*args, **kwargs)
+        elapsed = time.time() - start
+        self.stats.record_timing(stage, elapsed)
+        self.seconds[stage] += elapsed
+        return result
+
+    def ingest(self, lines):
+        for start in range(0, len(lines), self.batch_size):
+            self._ingest_batch(lines[start:start + self.batch_size])
+
+    def _store(self, messages):
+        if len(messages) == 1 and not self.skip_stored:
+            args, line = messages[0]
+            raws = [self._timed('process_raw_data', views.process_raw_data,
+                                self.deployment, args, line)]
+        else:
+            raws = self._timed('process_raw_data',
+                               views.process_raw_data_batch,
+                               self.deployment, messages,
+                               skip_stored=self.skip_stored)
+
+        if self.post_process:
+            for (args, line), raw in zip(messages, raws):
+                if raw:
+                    self._timed('post_process', views.post_process,
+                                raw, args[1])
+            views.flush_caches()
+        return raws
+
+    def _ingest_batch(self, lines):
+        messages = []
+        for line in lines:
+            routing_key, body = json.loads(line)
+            messages.append(((routing_key, body), line))
+
+        # One transaction per batch, as the worker does.
+        raws = db.transactional(self._store, messages)
+        self.stored += len([raw for raw in raws if raw])
+
+        self.stats.record_queries(
+            worker_stats.take_query_count(django_db.connection))
+        self.events += len(messages)
+
+    def results(self):
+        return {
+            'events': self.events,
+            'stored': self.stored,
+            'queries': self.stats.queries,
+            'seconds': self.seconds,
+            'timings': self.stats.timings,
+        }
+
+
+def _ingester(options, deployment):
+    # Count queries so queries/event can be reported.
+    worker_stats.count_queries(django_db.connection)
+    views.configure_caches(lifecycle_cache_size=options.lifecycle_cache_size,
+                           timing_cache_size=options.timing_cache_size,
+                           tracker_cache_size=options.tracker_cache_size,
+                           usage_cache_size=options.usage_cache_size,
+                           exists_batch_size=options.exists_batch_size)
+    return Ingester(deployment, batch_size=options.batch_size,
+                    skip_stored=options.skip_stored,
+                    post_process=not options.no_post_process)
+
+
+def _child(options, deployment, chunks, results):
+    # Don't share the parent's database connection.
+    django_db.close_connection()
+    ingester = _ingester(options, deployment)
+    while True:
+        lines = chunks.get()
+        if lines is None:
+            break
+        ingester.ingest(lines)
+    results.put(ingester.results())
+
+
+def merge(results):
+    merged = {
+        'events': 0,
+        'stored': 0,
+        'queries': 0,
+        'seconds': dict((stage, 0.0) for stage in worker_stats.STAGES),
+        'timings': dict((stage, []) for stage in worker_stats.STAGES),
+    }
+    for result in results:
+        for key in ['events', 'stored', 'queries']:
+            merged[key] += result[key]
+        for stage in worker_stats.STAGES:
+            merged['seconds'][stage] += result['seconds'][stage]
+            merged['timings'][stage].extend(result['timings'][stage])
+    return merged
+
+
+def report(results, elapsed, out=sys.stdout):
+    events = results['events']
+    out.write("%d events (%d stored) in %.1fs, %.1f events/sec\n" %
+              (events, results['stored'], elapsed,
+               events / elapsed if elapsed else 0.0))
+    if events:
+        out.write("%.1f queries/event\n" %
+                  (float(results['queries']) / events))
+    for stage in worker_stats.STAGES:
+        samples = sorted(results['timings'][stage])
+        p = [(worker_stats.percentile(samples, pct) or 0) * 1000
+             for pct in worker_stats.PERCENTILES]
+        out.write("%-17s %8.1fs total, p50/p95/p99 %.1f/%.1f/%.1fms\n" %
+                  (stage, results['seconds'][stage], p[0], p[1], p[2]))
+
+
+def replay(options):
+    """Replay every line of options.files and return the merged results
+    and the elapsed time."""
+    lines = read_lines(options.files)
+    if options.limit:
+        lines = itertools.islice(lines, options.limit)
+
+    start = time.time()
+    # Created once, here, so the children can't race to insert it.
+    deployment, new = db.get_or_create_deployment(options.deployment)
+    if options.processes <= 1:
+        ingester = _ingester(options, deployment)
+        chunk = []
+        for line in lines:
+            chunk.append(line)
+            if len(chunk) >= CHUNK_SIZE:
+                ingester.ingest(chunk)
+                chunk = []
+        ingester.ingest(chunk)
+        return merge([ingester.results()]), time.time() - start
+
+    django_db.close_connection()
+    results = multiprocessing.Queue()
+    queues = []
+    children = []
+    for i in range(options.processes):
+        chunks = multiprocessing.Queue(maxsize=4)
+        child = multiprocessing.Process(target=_child,
+                                        args=(options, deployment, chunks,
+                                              results))
+        child.start()
+        queues.append(chunks)
+        children.append(child)
+
+    pending = [[] for i in range(options.processes)]
+    for line in lines:
+        index = partition(json.loads(line), options.processes)
+        pending[index].append(line)
+        if len(pending[index]) >= CHUNK_SIZE:
+            queues[index].put(pending[index])
+            pending[index] = []
+    for chunks, chunk in zip(queues, pending):
+        if chunk:
+            chunks.put(chunk)
+        chunks.put(None)
+
+    merged = merge([results.get() for child in children])
+    for child in children:
+        child.join()
+    return merged, time.time() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('files', nargs='+',
+                        help="[routing_key, body] files, '-' for stdin")
+    parser.add_argument('--deployment', required=True,
+                        help="Deployment name to store the events under")
+    parser.add_argument('--processes', type=int, default=1,
+                        help="Worker processes, each with its own "
+                             "database connection")
+    parser.add_argument('--batch-size', type=int, default=100,
+                        help="Events stored per transaction")
+    parser.add_argument('--skip-stored', action='store_true',
+                        help="Skip events whose message_id is already "
+                             "stored, so a replay can be re-run")
+    parser.add_argument('--no-post-process', action='store_true',
+                        help="Only store RawData, skip aggregation")
+    parser.add_argument('--limit', type=int, default=None,
+                        help="Stop after this many events")
+    parser.add_argument('--lifecycle-cache-size', type=int, default=0,
+                        help="Lifecycles cached per process, as the "
+                             "worker's lifecycle_cache_size")
+    parser.add_argument('--timing-cache-size', type=int, default=0,
+                        help="Open Timings cached per process, as the "
+                             "worker's timing_cache_size")
+    parser.add_argument('--tracker-cache-size', type=int, default=0,
+                        help="RequestTrackers cached per process, as the "
+                             "worker's tracker_cache_size")
+    parser.add_argument('--usage-cache-size', type=int, default=0,
+                        help="InstanceUsages cached per process, as the "
+                             "worker's usage_cache_size")
+    parser.add_argument('--exists-batch-size', type=int, default=0,
+                        help="Exists events stored together, as the "
+                             "worker's exists_batch_size")
+    options = parser.parse_args(argv)
+
+    results, elapsed = replay(options)
+    report(results, elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+# Copyright (c) 2013 - Rackspace Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""Local disk spool used by the worker while the database is unavailable.
+
+Notifications are appended, one [routing_key, body] envelope per line
+(the same format as RawData.json), to segment files named
+
+    <name>.<pid>.<sequence>.spool
+
+Each worker process only writes its own segments. Segments left behind
+by a process that is no longer running are claimed (renamed) by the
+next worker for the same deployment to start, so nothing spooled is
+lost across restarts.
+"""
+
+import errno
+import os
+
+SUFFIX = '.spool'
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError, e:
+        return e.errno == errno.EPERM
+    return True
+
+
+class Spool(object):
+    def __init__(self, directory, name, segment_bytes=64 * 1024 * 1024,
+                 fsync=True):
+        self.directory = directory
+        self.name = name
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.pid = os.getpid()
+        self.active = None
+        self.active_path = None
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.sequence = 0
+        self._claim_orphans()
+
+    def _parse(self, filename):
+        """Return (pid, sequence) for one of our deployment's segments,
+        or None for anything else in the directory."""
+        prefix = self.name + '.'
+        if not filename.startswith(prefix) or not filename.endswith(SUFFIX):
+            return None
+        parts = filename[len(prefix):-len(SUFFIX)].split('.')
+        if len(parts) != 2:
+            return None
+        try:
+            return int(parts[0]), int(parts[1])
+        except ValueError:
+            return None
+
+    def _path(self, sequence):
+        filename = "%s.%d.%012d%s" % (self.name, self.pid, sequence, SUFFIX)
+        return os.path.join(self.directory, filename)
+
+    def _segments(self, mine=True):
+        segments = []
+        for filename in os.listdir(self.directory):
+            parsed = self._parse(filename)
+            if not parsed:
+                continue
+            pid, sequence = parsed
+            if (pid == self.pid) == mine:
+                path = os.path.join(self.directory, filename)
+                segments.append((sequence, pid, path))
+        return sorted(segments)
+
+    def _claim_orphans(self):
+        owned = self._segments()
+        if owned:
+            self.sequence = owned[-1][0] + 1
+
+        orphans = []
+        for sequence, pid, path in self._segments(mine=False):
+            if _pid_alive(pid):
+                continue
+            try:
+                orphans.append((os.path.getmtime(path), sequence, path))
+            except OSError:
+                pass  # Claimed by another worker.
+
+        for mtime, sequence, path in sorted(orphans):
+            target = self._path(self.sequence)
+            try:
+                os.rename(path, target)
+            except OSError:
+                continue  # Claimed by another worker.
+            self.sequence += 1
+
+    def append(self, line):
+        """Durably append one envelope. Literal newlines can only be
+        whitespace in valid json, so they are flattened to keep one
+        envelope per line."""
+        if not self.active:
+            self.active_path = self._path(self.sequence)
+            self.sequence += 1
+            self.active = open(self.active_path, 'a')
+        self.active.write(line.replace('\n', ' ') + '\n')
+        self.active.flush()
+        if self.fsync:
+            os.fsync(self.active.fileno())
+        if self.active.tell() >= self.segment_bytes:
+            self.rotate()
+
+    def rotate(self):
+        """Close the segment being written so it can be replayed."""
+        if self.active:
+            self.active.close()
+        self.active = None
+        self.active_path = None
+
+    def pending(self):
+        """Closed segments waiting to be replayed, oldest first."""
+        return [path for sequence, pid, path in self._segments()
+                if path != self.active_path]
+
+    def empty(self):
+        return not self.active and not self.pending()
+
+    def read(self, path, offset, count):
+        """Read up to count envelopes from path starting at byte offset.
+        Returns the lines and the offset just after the last one."""
+        lines = []
+        with open(path) as f:
+            f.seek(offset)
+            while len(lines) < count:
+                line = f.readline()
+                if not line.endswith('\n'):
+                    # EOF, or a write torn by a crash.
+                    break
+                offset += len(line)
+                line = line.strip()
+                if line:
+                    lines.append(line)
+        return lines, offset
+
+    def remove(self, path):
+        os.remove(path)
@@ -10,6 +10,9 @@ POSSIBLE_TOPDIR = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
 if os.path.exists(os.path.join(POSSIBLE_TOPDIR, 'stacktach')):
     sys.path.insert(0, POSSIBLE_TOPDIR)
 
+from django import db as django_db
+
+from stacktach import db
 import worker.worker as worker
 
 config_filename = os.environ.get('STACKTACH_DEPLOYMENTS_FILE',
@@ -41,9 +44,22 @@ if __name__ == '__main__':
 
     deployments = config['deployments']
 
-    for deployment in deployments:
-        if deployment.get('enabled', True):
-            process = Process(target=worker.run, args=(deployment,))
+    # Several consumers can compete for the same queues of a busy
+    # deployment, each in its own process. Create the Deployment rows
+    # here first, or the consumers race to insert duplicates.
+    enabled = []
+    for deployment_config in deployments:
+        if deployment_config.get('enabled', True):
+            name = deployment_config['name']
+            deployment, new = db.get_or_create_deployment(name)
+            enabled.append((deployment_config, deployment))
+    # The children open their own connections.
+    django_db.close_connection()
+
+    for deployment_config, deployment in enabled:
+        for i in range(deployment_config.get('consumers', 1)):
+            process = Process(target=worker.run,
+                              args=(deployment_config, deployment))
             process.daemon = True
             process.start()
             processes.append(process)
@@ -0,0 +1,184 @@
+# Copyright (c) 2013 - Rackspace Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+"""Throughput and latency stats for a single worker consumer.
+
+Samples are collected over a reporting window (stats_interval seconds).
+At the end of each window the worker logs a summary and, if a
+stats_file is configured, rewrites that file with the snapshot as
+json so it can be scraped or just cat'ed to see if a cell is falling
+behind.
+
+Queries are counted by count_queries(), which swaps the connection's
+debug cursor for one that only bumps a counter: Django's own formats
+and keeps every statement it runs.
+"""
+
+import json
+import math
+import os
+import random
+import threading
+import time
+
+from django.db.backends import util as backend_util
+
+STAGES = ['process_raw_data', 'post_process']
+PERCENTILES = [50, 95, 99]
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not samples:
+        return None
+    rank = int(math.ceil(pct / 100.0 * len(samples))) - 1
+    rank = max(0, min(rank, len(samples) - 1))
+    return samples[rank]
+
+
+class _CountingCursor(backend_util.CursorWrapper):
+    def execute(self, sql, params=()):
+        self.db.query_count += 1
+        return self.cursor.execute(sql, params)
+
+    def executemany(self, sql, param_list):
+        self.db.query_count += 1
+        return self.cursor.executemany(sql, param_list)
+
+
+def count_queries(connection):
+    """Count the statements run on this thread's connection. Read and
+    reset the count with take_query_count()."""
+    connection.query_count = 0
+    connection.make_debug_cursor = \
+        lambda cursor: _CountingCursor(cursor, connection)
+    connection.use_debug_cursor = True
+
+
+def take_query_count(connection):
+    count = getattr(connection, 'query_count', 0)
+    connection.query_count = 0
+    return count
+
+
+class WorkerStats(object):
+    """record_timing() is called from the post_process pool threads as
+    well as the consumer, so everything that touches the samples holds
+    the lock."""
+    def __init__(self, name, interval=30, stats_file=None,
+                 max_samples=10000):
+        self.name = name
+        self.interval = interval
+        self.stats_file = stats_file
+        if stats_file:
+            self.stats_file = stats_file % {'name': name, 'pid': os.getpid()}
+        self.max_samples = max_samples
+        self.started = time.time()
+        self.total_messages = 0
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.window_start = time.time()
+            self.messages = 0
+            self.queries = 0
+            self.timings = dict((stage, []) for stage in STAGES)
+            self.seen = dict((stage, 0) for stage in STAGES)
+            self.lags = []
+            self.lags_seen = 0
+
+    def _sample(self, samples, seen, value):
+        # Reservoir sampling keeps memory bounded on busy windows.
+        if len(samples) < self.max_samples:
+            samples.append(value)
+        else:
+            index = random.randint(0, seen - 1)
+            if index < self.max_samples:
+                samples[index] = value
+
+    def record_timing(self, stage, seconds):
+        with self.lock:
+            self.seen[stage] += 1
+            self._sample(self.timings[stage], self.seen[stage], seconds)
+
+    def record_message(self, queries=0, lag=None):
+        with self.lock:
+            self.messages += 1
+            self.total_messages += 1
+            self.queries += queries
+            if lag is not None:
+                self.lags_seen += 1
+                self._sample(self.lags, self.lags_seen, lag)
+
+    def record_queries(self, queries):
+        with self.lock:
+            self.queries += queries
+
+    def due(self, now=None):
+        if now is None:
+            now = time.time()
+        return now - self.window_start >= self.interval
+
+    def _summarize(self, samples):
+        samples = sorted(samples)
+        summary = {}
+        for pct in PERCENTILES:
+            summary['p%d' % pct] = percentile(samples, pct)
+        return summary
+
+    def snapshot(self, now=None, **extra):
+        with self.lock:
+            return self._snapshot(now, extra)
+
+    def _snapshot(self, now, extra):
+        if now is None:
+            now = time.time()
+        elapsed = now - self.window_start
+        snapshot = {
+            'name': self.name,
+            'pid': os.getpid(),
+            'time': now,
+            'uptime': now - self.started,
+            'window': elapsed,
+            'messages': self.messages,
+            'total_messages': self.total_messages,
+            'messages_per_sec': 0.0,
+            'queries_per_message': None,
+            'lag': self._summarize(self.lags),
+        }
+        if elapsed > 0:
+            snapshot['messages_per_sec'] = self.messages / elapsed
+        if self.messages:
+            snapshot['queries_per_message'] = \
+                float(self.queries) / self.messages
+        for stage in STAGES:
+            snapshot[stage] = self._summarize(self.timings[stage])
+        snapshot.update(extra)
+        return snapshot
+
+    def write(self, snapshot):
+        if not self.stats_file:
+            return
+        # Write then rename so readers never see a partial file.
+        tmp = "%s.tmp" % self.stats_file
+        with open(tmp, 'w') as f:
+            json.dump(snapshot, f, indent=2, sort_keys=True)
+        os.rename(tmp, self.stats_file)
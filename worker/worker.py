@@ -20,7 +20,9 @@ import datetime
 import kombu
 import kombu.entity
 import kombu.mixins
+import Queue
 import sys
+import threading
 import time
 
 try:
@@ -31,27 +33,133 @@ except ImportError:
     except ImportError:
         import json
 
+from django import db as django_db
 from pympler.process import ProcessMemoryInfo
 
+from stacktach import datetime_to_decimal as dt
 from stacktach import db
 from stacktach import stacklog
+from stacktach import storage_policy
 from stacktach import views
+import dedup as worker_dedup
+import spool as worker_spool
+import stats as worker_stats
 
 stacklog.set_default_logger_name('worker')
 LOG = stacklog.get_logger()
 
 
+def raw_json(routing_key, body):
+    """Build the stored [routing_key, body] envelope around the original
+    message body. This gives the same document as dumping the parsed
+    body again, without re-serialising what can be a many-KB payload."""
+    return '[%s, %s]' % (json.dumps(routing_key), body)
+
+
+def database_errors():
+    """Exceptions that mean the database is down or failing. Errors
+    raised while connecting come straight from the DB-API driver
+    without being wrapped by Django."""
+    errors = [django_db.DatabaseError]
+    backend = sys.modules[django_db.connection.__module__]
+    driver = getattr(backend, 'Database', None)
+    if driver:
+        errors.append(driver.Error)
+    return tuple(errors)
+
+
+class PostProcessPool(object):
+    """Runs views.post_process off the ack path.
+
+    The consumer stores and acks the raw event and then hands it to
+    this pool. A bounded queue is drained by a set of threads, each of
+    which gets its own Django DB connection. put() blocks when the
+    queue is full, which stops the consumer from pulling more messages
+    until aggregation catches up."""
+    def __init__(self, name, threads, queue_size, stats=None):
+        self.name = name
+        self.stats = stats
+        self.queue = Queue.Queue(maxsize=queue_size)
+        self.threads = []
+        for i in range(threads):
+            thread = threading.Thread(target=self._drain,
+                                      name="%s-post-process-%d" % (name, i))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def put(self, raw, body):
+        self.queue.put((raw, body))
+
+    def depth(self):
+        return self.queue.qsize()
+
+    def _process_one(self):
+        raw, body = self.queue.get()
+        try:
+            start = time.time()
+            db.transactional(views.post_process, raw, body)
+            if self.stats:
+                self.stats.record_timing('post_process', time.time() - start)
+        except Exception, e:
+            LOG.exception("%s: post_process failed for RawData(%s): %s" %
+                          (self.name, raw.id, e))
+        finally:
+            self.queue.task_done()
+
+    def _drain(self):
+        while True:
+            self._process_one()
+
+
 class NovaConsumer(kombu.mixins.ConsumerMixin):
-    def __init__(self, name, connection, deployment, durable, queue_arguments):
+    def __init__(self, name, connection, deployment, durable, queue_arguments,
+                 batch_size=1, batch_interval_ms=1000, post_process_pool=None,
+                 stats=None, prefetch_count=None, ack_every=1,
+                 ack_interval_ms=1000, spool=None, spool_latency_ms=5000,
+                 spool_retry_interval=30, spool_replay_batch=500,
+                 dedup=None):
         self.connection = connection
         self.deployment = deployment
         self.durable = durable
         self.queue_arguments = queue_arguments
         self.name = name
-        self.last_time = None
         self.pmi = None
         self.processed = 0
-        self.total_processed = 0
+        self.stats = stats
+        if self.stats is None:
+            self.stats = worker_stats.WorkerStats(name)
+        self.batch_size = batch_size
+        self.batch_interval = \
+            datetime.timedelta(milliseconds=batch_interval_ms)
+        self.batch = []
+        self.batch_started = None
+        self.post_process_pool = post_process_pool
+        self.prefetch_count = prefetch_count
+        # The broker stops delivering once prefetch_count messages are
+        # unacked, so never wait for more than that before acking.
+        if prefetch_count and ack_every > prefetch_count:
+            ack_every = prefetch_count
+        self.ack_every = ack_every
+        self.ack_interval = datetime.timedelta(milliseconds=ack_interval_ms)
+        self.unacked = None
+        self.unacked_count = 0
+        self.unacked_since = None
+        self.spool = spool
+        self.spool_latency = spool_latency_ms / 1000.0
+        self.spool_retry_interval = spool_retry_interval
+        self.spool_replay_batch = spool_replay_batch
+        self.spooled = 0
+        self.replay_segment = None
+        self.replay_offset = 0
+        self.replay_after = 0
+        self.replay_singly_until = 0
+        self.db_errors = database_errors()
+        self.dedup = dedup
+        self.duplicates = 0
+        # Segments left by a previous run are replayed before anything
+        # new goes to the database, so events stay in order.
+        self.spooling = bool(spool and not spool.empty())
 
     def _create_exchange(self, name, type, exclusive=False, auto_delete=False):
         return kombu.entity.Exchange(name, type=type, exclusive=exclusive,
@@ -73,52 +181,357 @@ class NovaConsumer(kombu.mixins.ConsumerMixin):
             self._create_queue('monitor.error', nova_exchange, 'monitor.error')
         ]
 
-        return [Consumer(queues=nova_queues, callbacks=[self.on_nova])]
+        consumer = Consumer(queues=nova_queues, callbacks=[self.on_nova])
+        if self.prefetch_count:
+            consumer.qos(prefetch_count=self.prefetch_count)
+        return [consumer]
 
     def _process(self, message):
         routing_key = message.delivery_info['routing_key']
 
         body = str(message.body)
         args = (routing_key, json.loads(body))
-        asJson = json.dumps(args)
+        asJson = raw_json(routing_key, body)
 
-        # save raw and ack the message
-        raw = views.process_raw_data(self.deployment, args, asJson)
+        # While spooling the database can't confirm a duplicate, but the
+        # spool replay skips stored message_ids anyway.
+        if (self.dedup is not None and not self.spooling and
+                self._is_duplicate(message, args[1])):
+            self.duplicates += 1
+            if self.batch_size > 1:
+                # A multiple ack would cover the unstored batch too.
+                message.ack()
+            else:
+                self._ack(message)
+            self._report_stats()
+            return
+
+        if self.spooling:
+            self._spool(message, asJson)
+        elif self.batch_size > 1:
+            self._add_to_batch(message, args, asJson)
+        else:
+            # save raw and ack the message. Notifications the storage
+            # policy chose not to store are acked too.
+            start = time.time()
+            try:
+                raw = db.transactional(self._store, args, asJson)
+            except self.db_errors, e:
+                if not self.spool:
+                    raise
+                self._start_spooling(e)
+                self._spool(message, asJson)
+                self._report_stats()
+                return
+            elapsed = time.time() - start
+            self._ack(message)
 
-        if raw:
-            self.processed += 1
+            if raw:
+                self._stored(raw, args[1])
+            self.stats.record_queries(
+                worker_stats.take_query_count(django_db.connection))
+            self._check_latency(elapsed)
+
+        self._report_stats()
+
+    def _is_duplicate(self, message, body):
+        """True if this message_id is already stored. Only filter hits
+        and redeliveries, which may have been stored by a worker that
+        died before acking, cost a query."""
+        message_id = body.get('message_id')
+        if not message_id:
+            return False
+        redelivered = message.delivery_info.get('redelivered')
+        if not redelivered and message_id not in self.dedup:
+            return False
+        try:
+            stored = db.find_stored_message_ids(self.deployment, [message_id])
+        except self.db_errors:
+            # Let the store path decide whether to spool.
+            return False
+        if stored:
+            LOG.debug("%s: skipping duplicate message_id %s" %
+                      (self.name, message_id))
+        return bool(stored)
+
+    def _ack(self, message):
+        if self.ack_every <= 1:
             message.ack()
-            views.post_process(raw, args[1])
+            return
+
+        if not self.unacked:
+            self.unacked_since = datetime.datetime.utcnow()
+        self.unacked = message
+        self.unacked_count += 1
+        if self.unacked_count >= self.ack_every:
+            self._flush_acks()
+
+    def _flush_acks(self):
+        # One ack with multiple=True covers every earlier delivery tag
+        # on this channel.
+        if self.unacked:
+            self.unacked.channel.basic_ack(self.unacked.delivery_tag,
+                                           multiple=True)
+        self._clear_acks()
+
+    def _clear_acks(self):
+        self.unacked = None
+        self.unacked_count = 0
+        self.unacked_since = None
+
+    def _acks_expired(self):
+        if not self.unacked:
+            return False
+        age = datetime.datetime.utcnow() - self.unacked_since
+        return age >= self.ack_interval
+
+    def _add_to_batch(self, message, args, asJson):
+        if not self.batch:
+            self.batch_started = datetime.datetime.utcnow()
+        self.batch.append((message, args, asJson))
+        if len(self.batch) >= self.batch_size:
+            self._flush_batch()
+
+    def _batch_expired(self):
+        if not self.batch:
+            return False
+        age = datetime.datetime.utcnow() - self.batch_started
+        return age >= self.batch_interval
+
+    def _flush_batch(self):
+        batch = self.batch
+        self.batch = []
+        self.batch_started = None
+        if not batch:
+            return
+
+        messages = [(args, asJson) for (message, args, asJson) in batch]
+        start = time.time()
+        try:
+            raws = db.transactional(self._store_batch, messages)
+        except self.db_errors, e:
+            if not self.spool:
+                raise
+            # The batch transaction was rolled back, spool all of it.
+            self._start_spooling(e)
+            for message, args, asJson in batch:
+                self._spool(message, asJson)
+            return
+        elapsed = time.time() - start
+
+        # The whole batch is committed, so a single ack of the last
+        # delivery tag with multiple=True acks everything before it.
+        last = batch[-1][0]
+        last.channel.basic_ack(last.delivery_tag, multiple=True)
+        # That covers any spooled messages still waiting for a coalesced
+        # ack too. Acking their tags again would close the channel.
+        self._clear_acks()
+
+        for (message, args, asJson), raw in zip(batch, raws):
+            if raw:
+                self._stored(raw, args[1])
+        self.stats.record_queries(
+            worker_stats.take_query_count(django_db.connection))
+        self._check_latency(elapsed)
 
-        self._check_memory()
+    def _aggregate(self, raw, body):
+        start = time.time()
+        views.post_process(raw, body)
+        self.stats.record_timing('post_process', time.time() - start)
+
+    def _store(self, args, asJson):
+        """Store one notification and, unless the post_process pool will
+        do it later, aggregate it. Called inside one transaction."""
+        start = time.time()
+        raw = views.process_raw_data(self.deployment, args, asJson)
+        self.stats.record_timing('process_raw_data', time.time() - start)
+        if raw and not self.post_process_pool:
+            self._aggregate(raw, args[1])
+            views.flush_caches()
+        return raw
+
+    def _store_batch(self, messages, skip_stored=False):
+        """Batched version of _store(), called inside one transaction."""
+        start = time.time()
+        raws = views.process_raw_data_batch(self.deployment, messages,
+                                            skip_stored=skip_stored)
+        self.stats.record_timing('process_raw_data', time.time() - start)
+        if not self.post_process_pool:
+            for (args, asJson), raw in zip(messages, raws):
+                if raw:
+                    self._aggregate(raw, args[1])
+            views.flush_caches()
+        return raws
+
+    def _stored(self, raw, body):
+        # Only once the transaction is committed can the pool see raw.
+        self.processed += 1
+        if self.dedup is not None and raw.message_id:
+            self.dedup.add(raw.message_id)
+        now = dt.dt_to_decimal(datetime.datetime.utcnow())
+        self.stats.record_message(lag=float(now - raw.when))
+        if self.post_process_pool:
+            self.post_process_pool.put(raw, body)
+
+    def _spool(self, message, asJson):
+        # The envelope is on disk before the ack goes out.
+        self.spool.append(asJson)
+        self.spooled += 1
+        self._ack(message)
+
+    def _check_latency(self, elapsed):
+        if self.spool and elapsed >= self.spool_latency:
+            self._start_spooling("process_raw_data took %.0fms" %
+                                 (elapsed * 1000))
+
+    def _start_spooling(self, reason):
+        if not self.spooling:
+            LOG.warn("%s: database unavailable (%s), spooling to %s" %
+                     (self.name, reason, self.spool.directory))
+        self.spooling = True
+        self.replay_after = time.time() + self.spool_retry_interval
+        # Don't reuse a connection that may be wedged.
+        django_db.close_connection()
+
+    def _replay(self):
+        """Replay one batch of spooled notifications into the database.
+
+        Batches are read oldest segment first and the segment being
+        written is rotated once everything before it is stored. When the
+        spool is empty the consumer goes back to writing directly.
+        Replayed batches skip message_ids that are already stored, so a
+        crash between storing a batch and moving past it in the segment
+        doesn't store anything twice."""
+        if time.time() < self.replay_after:
+            return
+
+        if self.replay_segment is None:
+            pending = self.spool.pending()
+            if not pending:
+                if self.spool.empty():
+                    LOG.info("%s: spool drained, %d notifications spooled" %
+                             (self.name, self.spooled))
+                    self.spooling = False
+                    self.spooled = 0
+                    return
+                self.spool.rotate()
+                pending = self.spool.pending()
+            self.replay_segment = pending[0]
+            self.replay_offset = 0
+
+        count = self.spool_replay_batch
+        if self.replay_offset < self.replay_singly_until:
+            count = 1
+        lines, offset = self.spool.read(self.replay_segment,
+                                        self.replay_offset, count)
+        if not lines:
+            self.spool.remove(self.replay_segment)
+            self.replay_segment = None
+            return
+
+        messages = []
+        for line in lines:
+            routing_key, body = json.loads(line)
+            messages.append(((routing_key, body), line))
+
+        start = time.time()
+        try:
+            raws = db.transactional(self._store_batch, messages,
+                                    skip_stored=True)
+        except self.db_errors, e:
+            LOG.warn("%s: spool replay failed, retrying in %ds: %s" %
+                     (self.name, self.spool_retry_interval, e))
+            self.replay_after = time.time() + self.spool_retry_interval
+            django_db.close_connection()
+            return
+        except Exception, e:
+            # A bad notification shouldn't wedge the spool. Replay the
+            # batch one at a time and skip just the one that fails.
+            if len(lines) > 1:
+                LOG.exception("%s: spool replay failed, retrying batch "
+                              "one at a time: %s" % (self.name, e))
+                self.replay_singly_until = offset
+            else:
+                LOG.exception("%s: skipping spooled notification: %s\n%s" %
+                              (self.name, e, lines[0]))
+                self.replay_offset = offset
+            return
+        elapsed = time.time() - start
+        self.replay_offset = offset
+        for (args, asJson), raw in zip(messages, raws):
+            if raw:
+                self._stored(raw, args[1])
+
+        # Still slow, give the database room before the next batch.
+        if elapsed >= self.spool_latency:
+            self.replay_after = time.time() + self.spool_retry_interval
+
+    def on_iteration(self):
+        # Called by ConsumerMixin about once a second even when the
+        # queues are idle, so partial batches don't sit around forever.
+        if self._batch_expired():
+            self._flush_batch()
+        if self._acks_expired():
+            self._flush_acks()
+        if self.spooling:
+            self._replay()
+        elif not self.post_process_pool and views.caches_due():
+            # Don't hold cached changes back forever on a quiet queue.
+            db.transactional(views.flush_caches)
+
+    def _report_stats(self):
+        if not self.stats.due():
+            return
 
-    def _check_memory(self):
         if not self.pmi:
             self.pmi = ProcessMemoryInfo()
-            self.last_vsz = self.pmi.vsz
-            self.initial_vsz = self.pmi.vsz
-
-        utc = datetime.datetime.utcnow()
-        check = self.last_time is None
-        if self.last_time:
-            diff = utc - self.last_time
-            if diff.seconds > 30:
-                check = True
-        if check:
-            self.last_time = utc
-            self.pmi.update()
-            diff = (self.pmi.vsz - self.last_vsz) / 1000
-            idiff = (self.pmi.vsz - self.initial_vsz) / 1000
-            self.total_processed += self.processed
-            per_message = 0
-            if self.total_processed:
-                per_message = idiff / self.total_processed
-            LOG.debug("%20s %6dk/%6dk ram, "
-                      "%3d/%4d msgs @ %6dk/msg" %
-                      (self.name, diff, idiff, self.processed,
-                      self.total_processed, per_message))
-            self.last_vsz = self.pmi.vsz
-            self.processed = 0
+        self.pmi.update()
+        depth = None
+        if self.post_process_pool:
+            depth = self.post_process_pool.depth()
+        extra = views.cache_stats()
+        if self.dedup is not None:
+            extra['dedup'] = self.dedup.stats()
+        snapshot = self.stats.snapshot(batch_size=self.batch_size,
+                                       prefetch_count=self.prefetch_count,
+                                       ack_every=self.ack_every,
+                                       post_process_queue=depth,
+                                       spooling=self.spooling,
+                                       duplicates=self.duplicates,
+                                       vsz_kb=self.pmi.vsz / 1000,
+                                       **extra)
+
+        def ms(value):
+            if value is None:
+                return 0
+            return value * 1000
+
+        raw_times = snapshot['process_raw_data']
+        post_times = snapshot['post_process']
+        LOG.debug("%20s %6d msgs %8.2f msgs/sec, process_raw_data "
+                  "p50/p95/p99 %.1f/%.1f/%.1fms, post_process "
+                  "p50/p95/p99 %.1f/%.1f/%.1fms, %.1f queries/msg, "
+                  "lag p50/p99 %.1f/%.1fs, %6dk ram" %
+                  (self.name, snapshot['messages'],
+                   snapshot['messages_per_sec'],
+                   ms(raw_times['p50']), ms(raw_times['p95']),
+                   ms(raw_times['p99']), ms(post_times['p50']),
+                   ms(post_times['p95']), ms(post_times['p99']),
+                   snapshot['queries_per_message'] or 0,
+                   snapshot['lag']['p50'] or 0, snapshot['lag']['p99'] or 0,
+                   snapshot['vsz_kb']))
+        for name, stats in sorted(views.cache_stats().items()):
+            LOG.debug("%20s %s: %d entries, %d hits, %d misses" %
+                      (self.name, name, stats['size'], stats['hits'],
+                       stats['misses']))
+        if self.dedup is not None:
+            LOG.debug("%20s %d duplicates skipped" %
+                      (self.name, self.duplicates))
+        try:
+            self.stats.write(snapshot)
+        except IOError, e:
+            LOG.warn("%s: could not write stats file: %s" % (self.name, e))
+        self.stats.reset()
 
     def on_nova(self, body, message):
         try:
@@ -140,7 +553,56 @@ def exit_or_sleep(exit=False):
     time.sleep(5)
 
 
-def run(deployment_config):
+def cache_options(deployment_config):
+    """The views.configure_caches() arguments for a deployment. The
+    caches are only safe when this process is the only one aggregating
+    the deployment's events, from a single thread."""
+    name = deployment_config['name']
+    options = {
+        'lifecycle_cache_size':
+            deployment_config.get('lifecycle_cache_size', 0),
+        'lifecycle_cache_ttl':
+            deployment_config.get('lifecycle_cache_ttl', 300),
+        'lifecycle_flush_interval':
+            deployment_config.get('lifecycle_flush_interval', 0),
+        'timing_cache_size': deployment_config.get('timing_cache_size', 0),
+        'timing_cache_ttl': deployment_config.get('timing_cache_ttl', 300),
+        'tracker_cache_size': deployment_config.get('tracker_cache_size', 0),
+        'tracker_negative_ttl':
+            deployment_config.get('tracker_negative_ttl', 60),
+        'usage_cache_size': deployment_config.get('usage_cache_size', 0),
+        'usage_cache_ttl': deployment_config.get('usage_cache_ttl', 300),
+        'exists_batch_size': deployment_config.get('exists_batch_size', 0),
+    }
+    sizes = ['lifecycle_cache_size', 'timing_cache_size',
+             'tracker_cache_size', 'usage_cache_size']
+
+    if deployment_config.get('post_process_threads', 0) > 0:
+        # The caches aren't shared safely between pool threads.
+        disabled = sizes + ['exists_batch_size']
+        reason = "post_process_threads is set"
+    elif deployment_config.get('consumers', 1) > 1:
+        # Competing consumers update the same Lifecycles, Timings,
+        # trackers and usages, so what one process has cached can be
+        # changed under it by another. Batched exists are only inserts.
+        disabled = sizes
+        reason = "consumers is more than 1"
+    else:
+        return options
+
+    ignored = [option for option in disabled if options[option]]
+    if ignored:
+        LOG.warn("%s: %s ignored when %s" %
+                 (name, ', '.join(ignored), reason))
+    for option in disabled:
+        options[option] = 0
+    return options
+
+
+def run(deployment_config, deployment=None):
+    """Consume notifications for one deployment until stopped. When
+    several processes consume for the same deployment, the parent
+    passes in the Deployment so they don't race to create it."""
     name = deployment_config['name']
     host = deployment_config.get('rabbit_host', 'localhost')
     port = deployment_config.get('rabbit_port', 5672)
@@ -150,12 +612,63 @@ def run(deployment_config):
     durable = deployment_config.get('durable_queue', True)
     queue_arguments = deployment_config.get('queue_arguments', {})
     exit_on_exception = deployment_config.get('exit_on_exception', False)
+    batch_size = deployment_config.get('batch_size', 1)
+    batch_interval_ms = deployment_config.get('batch_interval_ms', 1000)
+    post_process_threads = deployment_config.get('post_process_threads', 0)
+    post_process_queue_size = deployment_config.get('post_process_queue_size',
+                                                    1000)
+    prefetch_count = deployment_config.get('prefetch_count')
+    ack_every = deployment_config.get('ack_every', 1)
+    ack_interval_ms = deployment_config.get('ack_interval_ms', 1000)
+    stats_interval = deployment_config.get('stats_interval', 30)
+    stats_file = deployment_config.get('stats_file')
+    spool_dir = deployment_config.get('spool_dir')
+    spool_segment_mb = deployment_config.get('spool_segment_mb', 64)
+    spool_latency_ms = deployment_config.get('spool_latency_ms', 5000)
+    spool_retry_interval = deployment_config.get('spool_retry_interval', 30)
+    spool_replay_batch = deployment_config.get('spool_replay_batch', 500)
+    dedup_filter_size = deployment_config.get('dedup_filter_size', 0)
+    dedup_window = deployment_config.get('dedup_window', 3600)
 
-    deployment, new = db.get_or_create_deployment(name)
+    views.STORAGE_POLICY = storage_policy.StoragePolicy(
+        deployment_config.get('storage_policy', []))
+    views.configure_caches(**cache_options(deployment_config))
+
+    if deployment is None:
+        deployment, new = db.get_or_create_deployment(name)
 
     print "Starting worker for '%s'" % name
     LOG.info("%s: %s %s %s %s" % (name, host, port, user_id, virtual_host))
 
+    # Count the queries run on this connection so the stats can report
+    # queries per message.
+    worker_stats.count_queries(django_db.connection)
+    stats = worker_stats.WorkerStats(name, interval=stats_interval,
+                                     stats_file=stats_file)
+
+    # The pool outlives reconnects so queued aggregations aren't lost.
+    post_process_pool = None
+    if post_process_threads > 0:
+        post_process_pool = PostProcessPool(name, post_process_threads,
+                                            post_process_queue_size,
+                                            stats=stats)
+
+    # Like the pool, the spool outlives reconnects.
+    spool = None
+    if spool_dir:
+        spool = worker_spool.Spool(spool_dir, name,
+                                   segment_bytes=spool_segment_mb << 20)
+
+    # So is the dedup filter, warmed with what was stored recently.
+    dedup = None
+    if dedup_filter_size > 0:
+        dedup = worker_dedup.MessageFilter(dedup_filter_size,
+                                           window=dedup_window)
+        since = dt.dt_to_decimal(datetime.datetime.utcnow() -
+                                 datetime.timedelta(seconds=dedup_window))
+        for message_id in db.find_recent_message_ids(deployment, since):
+            dedup.add(message_id)
+
     params = dict(hostname=host,
                   port=port,
                   userid=user_id,
@@ -169,8 +682,20 @@ def run(deployment_config):
             LOG.debug("Processing on '%s'" % name)
             with kombu.connection.BrokerConnection(**params) as conn:
                 try:
-                    consumer = NovaConsumer(name, conn, deployment, durable,
-                                            queue_arguments)
+                    consumer = NovaConsumer(
+                        name, conn, deployment, durable, queue_arguments,
+                        batch_size=batch_size,
+                        batch_interval_ms=batch_interval_ms,
+                        post_process_pool=post_process_pool,
+                        stats=stats,
+                        prefetch_count=prefetch_count,
+                        ack_every=ack_every,
+                        ack_interval_ms=ack_interval_ms,
+                        spool=spool,
+                        spool_latency_ms=spool_latency_ms,
+                        spool_retry_interval=spool_retry_interval,
+                        spool_replay_batch=spool_replay_batch,
+                        dedup=dedup)
                     consumer.run()
                 except Exception as e:
                     LOG.error("!!!!Exception!!!!")